@@ -0,0 +1,3 @@
+"""
+Benchmark suite of the model: synthetic inputs generator (synthetic.py) and stage and function benchmarks (run.py).
+"""
@@ -0,0 +1,287 @@
+"""
+run.py
+
+Benchmarks of the model: wall time, CPU time and peak memory of every stage of the pipeline and of the main
+geocomputation functions, on synthetic inputs (see synthetic.py) at several scales. Every benchmark runs in a process of
+its own, so that its memory peak isn't hidden by the ones measured before. The results of a run are stored as a JSON
+file in benchmarks/results, and two runs can be compared:
+
+    python -m benchmarks.run --scales 0.01 0.05 0.2 --label my-change
+    python -m benchmarks.run --compare benchmarks/results/<run 1>.json benchmarks/results/<run 2>.json
+
+Run from the repository folder. Parameters of the model can be changed with --set (e.g. --set pop_engine='"points"').
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import geopandas as gpd
+
+from config import *
+from globals import *
+import geocomputation as gcpt
+import pointstore
+import storage
+from benchmarks.synthetic import generate_inputs
+from pipeline.graph import stage_dependencies, topological_order
+from pipeline.layers import set_memory_budget
+from pipeline.stages import build_stages
+
+repository_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+results_dir = os.path.join(repository_dir, 'benchmarks', 'results')
+
+def _rss_mb(usage):
+    return usage.ru_maxrss / 1024  # kilobytes on Linux
+
+def _measured_call(connection, func, args):
+    start_rss = _rss_mb(resource.getrusage(resource.RUSAGE_SELF))
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    try:
+        func(*args)
+        error = None
+    except Exception as e:
+        error = repr(e)
+    wall = time.perf_counter() - start
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)  # process pools started by func
+    own_peak = _rss_mb(resource.getrusage(resource.RUSAGE_SELF))
+    connection.send({'wall_s': wall,
+                     'cpu_s': time.process_time() - start_cpu + children.ru_utime + children.ru_stime,
+                     'peak_rss_mb': max(own_peak, _rss_mb(children)),
+                     'rss_increase_mb': own_peak - start_rss,
+                     'error': error})
+    connection.close()
+
+def measure(func, *args):
+    """Call func(*args) in a forked process and return its wall time, CPU time (including the processes it starts)
+    and memory peak."""
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_measured_call, args=(sender, func, args))
+    process.start()
+    result = receiver.recv()
+    process.join()
+    return result
+
+def files_size_mb(paths):
+    """Total size of files (and of the component files of shapefiles)."""
+    size = 0
+    for path in paths:
+        root, ext = os.path.splitext(path)
+        components = [root + e for e in storage.shp_extensions] if ext == '.shp' else [path]
+        size += sum(os.path.getsize(c) for c in components if os.path.isfile(c))
+    return size / 2**20
+
+def _run_stage(stage, parameters):
+    set_memory_budget(parameters["layer_cache_mb"])
+    stage.func(parameters)
+
+def stage_benchmarks(parameters):
+    """Run all the stages of the pipeline, in dependency order, in the current folder (which holds the inputs)."""
+    for folder in [modelRunsDir, outputFolder]:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    stages = build_stages(parameters)
+    results = []
+    for stage in topological_order(stages, stage_dependencies(stages)):
+        for output in stage.outputs:
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+        print('Benchmarking stage', stage.name)
+        result = measure(_run_stage, stage, parameters)
+        result.update(kind='stage', name=stage.name, output_mb=files_size_mb(stage.outputs))
+        results.append(result)
+        if result['error'] is not None:
+            print('Stage', stage.name, 'failed:', result['error'])
+            break
+    return results
+
+def function_benchmarks(parameters):
+    """Benchmarks of the geocomputation functions, on the files written by the stages (run stage_benchmarks first)."""
+    scratch = os.path.join(modelRunsDir, 'benchmarks')
+    os.makedirs(scratch, exist_ok=True)
+    target_classes = parameters["ghsl_target_classes"]
+    dsd_gdf = gpd.read_file(inputs["SL_DSD"])
+    districts_gdf = gpd.read_file(inputs["SL_Districts"])
+    district_geom = districts_gdf.geometry.iloc[0]
+    land_use_gdf = storage.read_vector(ag_lands)
+
+    def consume_points():
+        for _ in gcpt.raster_points(Resampled_pop_raster, 'pop_count', parameters["point_chunk_rows"]):
+            pass
+
+    def buffers_points_sum():
+        points = storage.read_vector(rur_points_shp)
+        store = pointstore.create_store(points.geometry.x.values, points.geometry.y.values, points['pop_count'].values)
+        store.polygons_sum(storage.read_vector(tanks_buffers).geometry.values)
+
+    def tanks_nearest_allocation():
+        gcpt.nearest_allocation([storage.read_vector(rur_points_shp)], 'pop_count',
+                                gpd.read_file(inputs["tanks_polygons"]), parameters["tank_buffer"],
+                                parameters["metric_crs"])
+
+    def district_signed_distances():
+        x, y, _ = gcpt.raster_cells(Rural_pop_raster, district_geom)
+        gcpt.signed_distances(x, y, gcpt.clip_union(land_use_gdf.geometry.values, district_geom))
+
+    functions = [
+        ('resample_raster', lambda: gcpt.resample_raster(inputs["WorldPop_1km_raster"],
+                                                         os.path.join(scratch, 'resampled.tif'),
+                                                         parameters["x_resolution"], parameters["y_resolution"],
+                                                         preserve_sum=True)),
+        ('raster_points', consume_points),
+        ('raster_to_shp_poly', lambda: gcpt.raster_to_shp_poly(ghsl_merged_clipped,
+                                                               os.path.join(scratch, 'ghsl' + vector_ext),
+                                                               target_classes, dissolved_output_file=os.path.join(
+                                                                   scratch, 'ghsl_dissolved' + vector_ext))),
+        ('mask_raster_by_classes', lambda: gcpt.mask_raster_by_classes(Resampled_pop_raster, ghsl_merged_clipped,
+                                                                       target_classes,
+                                                                       os.path.join(scratch, 'rural.tif'))),
+        ('zonal_sum', lambda: gcpt.zonal_sum(Resampled_pop_raster, dsd_gdf)),
+        ('clip_union', lambda: gcpt.clip_union(land_use_gdf.geometry.values, district_geom)),
+        ('signed_distances', district_signed_distances),
+        ('polygons_sum', buffers_points_sum),
+        ('nearest_allocation', tanks_nearest_allocation),
+    ]
+
+    results = []
+    for name, func in functions:
+        print('Benchmarking function', name)
+        result = measure(func)
+        result.update(kind='function', name=name)
+        results.append(result)
+    shutil.rmtree(scratch, ignore_errors=True)
+    return results
+
+def best_of(runs):
+    """Merge repeated runs of the same benchmarks keeping the fastest one of each."""
+    best = {}
+    for run in runs:
+        for result in run:
+            key = (result['kind'], result['name'])
+            if key not in best or result['wall_s'] < best[key]['wall_s']:
+                best[key] = result
+    return list(best.values())
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repository_dir, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    libraries = {}
+    for name in ['numpy', 'pandas', 'geopandas', 'shapely', 'rasterio', 'pyarrow', 'pyogrio']:
+        module = sys.modules.get(name) or __import__(name)
+        libraries[name] = getattr(module, '__version__', None)
+    return {'commit': commit, 'python': platform.python_version(), 'platform': platform.platform(),
+            'cpu_count': os.cpu_count(), 'libraries': libraries}
+
+def run_benchmarks(scales, parameters, workdir, repeat=1, functions=True, seed=1):
+    """Benchmark the stages (and the geocomputation functions) at every scale. Returns the list of results."""
+    results = []
+    cwd = os.getcwd()
+    for scale in scales:
+        scale_dir = os.path.join(workdir, 'scale-%g' % scale)
+        if not os.path.isdir(os.path.join(scale_dir, os.path.dirname(inputs["SL_Districts"]))):
+            print('Generating synthetic inputs at scale', scale)
+            start = time.perf_counter()
+            dataset = generate_inputs(scale_dir, scale, seed)
+            print('Inputs generated in %.1f s: %s' % (time.perf_counter() - start, dataset))
+        print()
+
+        os.chdir(scale_dir)
+        try:
+            runs = []
+            for _ in range(repeat):
+                run = stage_benchmarks(parameters)
+                if functions and all(r['error'] is None for r in run):
+                    run += function_benchmarks(parameters)
+                runs.append(run)
+        finally:
+            os.chdir(cwd)
+
+        for result in best_of(runs):
+            result['scale'] = scale
+            results.append(result)
+    return results
+
+def save_results(results, parameters, scales, label):
+    os.makedirs(results_dir, exist_ok=True)
+    date = datetime.datetime.now()
+    file = os.path.join(results_dir, date.strftime('%Y%m%d-%H%M%S') + ('-' + label if label else '') + '.json')
+    report = {'label': label, 'date': date.isoformat(timespec='seconds'), 'environment': environment(),
+              'scales': scales, 'parameters': parameters, 'results': results}
+    with open(file, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    return file
+
+def print_results(results):
+    print('%-6s %-9s %-26s %10s %10s %10s' % ('scale', 'kind', 'name', 'wall (s)', 'cpu (s)', 'peak (MB)'))
+    for r in results:
+        print('%-6g %-9s %-26s %10.2f %10.2f %10.0f%s' % (r['scale'], r['kind'], r['name'], r['wall_s'], r['cpu_s'],
+                                                         r['peak_rss_mb'], '  FAILED' if r['error'] else ''))
+
+def compare_results(file_a, file_b):
+    """Print the wall time and memory peak of the benchmarks of two runs, side by side."""
+    with open(file_a) as f:
+        a = json.load(f)
+    with open(file_b) as f:
+        b = json.load(f)
+    b_results = {(r['scale'], r['kind'], r['name']): r for r in b['results']}
+
+    print('A:', file_a, a['environment']['commit'])
+    print('B:', file_b, b['environment']['commit'])
+    print('%-6s %-9s %-26s %10s %10s %7s %10s %10s' % ('scale', 'kind', 'name', 'A wall', 'B wall', 'B/A',
+                                                      'A peak', 'B peak'))
+    for r in a['results']:
+        other = b_results.get((r['scale'], r['kind'], r['name']))
+        if other is None:
+            continue
+        ratio = other['wall_s'] / r['wall_s'] if r['wall_s'] > 0 else np.nan
+        print('%-6g %-9s %-26s %10.2f %10.2f %7.2f %10.0f %10.0f' % (r['scale'], r['kind'], r['name'], r['wall_s'],
+                                                                      other['wall_s'], ratio, r['peak_rss_mb'],
+                                                                      other['peak_rss_mb']))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the model on synthetic inputs.')
+    parser.add_argument('--scales', type=float, nargs='+', default=[0.01, 0.05, 0.2],
+                        help='fractions of the area of Sri Lanka generated (1 = realistic sizes)')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of every benchmark (the fastest is kept)')
+    parser.add_argument('--label', default='', help='label of the results file')
+    parser.add_argument('--workdir', help='folder of the synthetic inputs (reused if already generated)')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the synthetic inputs generator')
+    parser.add_argument('--no-functions', action='store_true', help='benchmark only the pipeline stages')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='model parameter to change (JSON value)')
+    parser.add_argument('--compare', nargs=2, metavar='RESULTS', help='compare two results files')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare_results(*args.compare)
+        return
+
+    model_parameters = dict(parameters)
+    for setting in args.set:
+        name, value = setting.split('=', 1)
+        model_parameters[name] = json.loads(value)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='sl-tanks-benchmarks-')
+    results = run_benchmarks(args.scales, model_parameters, os.path.abspath(workdir), args.repeat,
+                             not args.no_functions, args.seed)
+    print()
+    print_results(results)
+    print()
+    print('Results saved to', save_results(results, model_parameters, args.scales, args.label))
+
+if __name__ == "__main__":
+    main()
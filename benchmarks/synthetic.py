@@ -0,0 +1,194 @@
+"""
+synthetic.py
+
+Generator of synthetic model inputs with the size and layout of the real ones (which are large and not shipped with the
+repository): a Sri Lanka shaped island with a 1km population raster, four GHSL tiles, 25 districts split into DSDs,
+a land use coverage, N tank polygons and the tank level tables (rainfall covariate and rock structure).
+
+The scale is the fraction of the area of Sri Lanka that is generated: the island keeps its shape and is shrunk around
+its centre, and the number of land use polygons and tanks is scaled with its area (scale=1 gives realistic sizes).
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyogrio
+import rasterio
+import shapely
+from shapely import affinity
+from rasterio.features import geometry_mask
+from rasterio.transform import from_origin
+from rasterio.warp import transform_bounds
+
+from config import inputs
+
+# Outline of Sri Lanka (lon, lat), coarse
+island_outline = [(79.87, 9.82), (80.28, 9.83), (80.62, 9.45), (81.05, 8.85), (81.30, 8.45), (81.42, 8.12),
+                  (81.70, 7.50), (81.88, 7.00), (81.83, 6.62), (81.55, 6.30), (81.10, 6.12), (80.60, 5.92),
+                  (80.25, 6.00), (80.05, 6.25), (79.87, 6.80), (79.82, 7.40), (79.80, 8.00), (79.88, 8.55),
+                  (79.93, 9.05), (80.05, 9.40)]
+
+district_names = ['Ampara', 'Anuradhapura', 'Badulla', 'Batticaloa', 'Colombo', 'Galle', 'Gampaha', 'Hambantota',
+                  'Jaffna', 'Kalutara', 'Kandy', 'Kegalle', 'Kilinochchi', 'Kurunegala', 'Mannar', 'Matale', 'Matara',
+                  'Monaragala', 'Mullaitivu', 'Nuwara Eliya', 'Polonnaruwa', 'Puttalam', 'Ratnapura', 'Trincomalee',
+                  'Vavuniya']
+
+land_use_types = ['Chena', 'Coconut', 'Other (Mango, etc)', 'Paddy', 'Other plantations', 'Rubber', 'Tea',
+                  'Uncultivated lands', 'Home Garden', 'Forest', 'Water', 'Built-up']
+land_use_probabilities = [.08, .07, .04, .18, .03, .05, .04, .06, .15, .2, .04, .06]
+
+aquifer_types = ["Shallow alluvial aquifer", "Deep confined aquifer", "Shallow karstic acquifer",
+                 "Shallow sandy aquifer", "Basement regolith aquifer", "Regolith or fractured aquifer",
+                 "Laterite (cabook) aquifer"]
+
+ghsl_tiles = ['GHSL_raw_1', 'GHSL_raw_2', 'GHSL_raw_3', 'GHSL_raw_4']
+
+pop_resolution = 0.008983  # 1km WorldPop pixels (degrees)
+ghsl_resolution = 1000  # GHSL pixels (metres, Mollweide)
+dsd_per_district = 13  # Sri Lanka has 331 DSDs
+full_land_use_polygons = 100000
+full_tanks = 11000
+
+def island(scale):
+    """Sri Lanka shaped polygon covering the fraction 'scale' of the area of Sri Lanka."""
+    outline = shapely.Polygon(island_outline)
+    centre = outline.centroid
+    factor = np.sqrt(scale)
+    return affinity.scale(outline, factor, factor, origin=centre)
+
+def random_points(geom, n, rng):
+    """n random points within a polygon."""
+    xmin, ymin, xmax, ymax = geom.bounds
+    x, y = np.empty(0), np.empty(0)
+    shapely.prepare(geom)
+    while len(x) < n:
+        cx = rng.uniform(xmin, xmax, 2 * n)
+        cy = rng.uniform(ymin, ymax, 2 * n)
+        inside = shapely.contains_xy(geom, cx, cy)
+        x, y = np.concatenate([x, cx[inside]]), np.concatenate([y, cy[inside]])
+    return x[:n], y[:n]
+
+def voronoi_partition(geom, n, rng):
+    """Partition of a polygon into n cells (Voronoi cells of random seeds clipped to the polygon)."""
+    x, y = random_points(geom, n, rng)
+    seeds = shapely.points(x, y)
+    cells = shapely.get_parts(shapely.voronoi_polygons(shapely.multipoints(seeds), extend_to=geom))
+    # Order the cells as the seeds
+    tree = shapely.STRtree(cells)
+    seed_index, cell_index = tree.query(seeds, predicate='within')
+    cells = cells[cell_index[np.argsort(seed_index)]]
+    return shapely.intersection(cells, geom)
+
+def path(directory, key):
+    return os.path.join(directory, inputs[key])
+
+def write_population_raster(directory, land, rng):
+    xmin, ymin, xmax, ymax = land.bounds
+    width = int(np.ceil((xmax - xmin) / pop_resolution)) + 2
+    height = int(np.ceil((ymax - ymin) / pop_resolution)) + 2
+    transform = from_origin(xmin - pop_resolution, ymax + pop_resolution, pop_resolution, pop_resolution)
+
+    pop = rng.gamma(1.2, 250, (height, width)).astype(np.float32)
+    outside = geometry_mask([land], out_shape=(height, width), transform=transform)
+    pop[outside] = -99999
+
+    with rasterio.open(path(directory, "WorldPop_1km_raster"), 'w', driver='GTiff', height=height, width=width,
+                       count=1, dtype='float32', crs='EPSG:4326', transform=transform, nodata=-99999) as dst:
+        dst.write(pop, 1)
+
+def write_ghsl_tiles(directory, land, rng):
+    # Settlement model classes: 30 urban centre, 21-23 suburban/towns, 11-13 rural, 10 water
+    bounds = transform_bounds('EPSG:4326', 'ESRI:54009', *shapely.buffer(land, 0.1).bounds)
+    cols = int((bounds[2] - bounds[0]) / ghsl_resolution) + 1
+    rows = int((bounds[3] - bounds[1]) / ghsl_resolution) + 1
+    transform = from_origin(bounds[0], bounds[3], ghsl_resolution, ghsl_resolution)
+
+    # Distance of every pixel from the nearest town
+    land_moll = gpd.GeoSeries([land], crs='EPSG:4326').to_crs('ESRI:54009').iloc[0]
+    town_x, town_y = random_points(land_moll, max(3, int(land_moll.area / 4e8)), rng)
+    xx, yy = np.meshgrid(bounds[0] + (np.arange(cols) + 0.5) * ghsl_resolution,
+                         bounds[3] - (np.arange(rows) + 0.5) * ghsl_resolution)
+    distance = np.full((rows, cols), np.inf)
+    for tx, ty in zip(town_x, town_y):
+        distance = np.minimum(distance, np.hypot(xx - tx, yy - ty))
+
+    classes = np.select([distance < 2000, distance < 4000, distance < 6000, distance < 9000],
+                        [30, 23, 22, 21],
+                        rng.choice([11, 12, 13], size=(rows, cols), p=[.5, .3, .2])).astype(np.uint8)
+    on_land = ~geometry_mask([land_moll], out_shape=(rows, cols), transform=transform)
+    classes[~on_land] = 10
+
+    half_rows, half_cols = rows // 2, cols // 2
+    tiles = [(0, half_rows, 0, half_cols), (0, half_rows, half_cols, cols),
+             (half_rows, rows, 0, half_cols), (half_rows, rows, half_cols, cols)]
+    for key, (r0, r1, c0, c1) in zip(ghsl_tiles, tiles):
+        file = path(directory, key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        with rasterio.open(file, 'w', driver='GTiff', height=r1 - r0, width=c1 - c0, count=1, dtype='uint8',
+                           crs='ESRI:54009', transform=transform * transform.translation(c0, r0), nodata=255) as dst:
+            dst.write(classes[r0:r1, c0:c1], 1)
+
+def write_admin_units(directory, land, rng):
+    districts = voronoi_partition(land, len(district_names), rng)
+    district_codes = ['LK%02d' % (k + 1) for k in range(len(district_names))]
+    districts_gdf = gpd.GeoDataFrame({'ADM2_EN': district_names, 'ADM2_PCODE': district_codes,
+                                      'geometry': districts}, crs='EPSG:4326')
+    districts_gdf.to_file(path(directory, "SL_Districts"))
+
+    dsds = []
+    for name, code, district in zip(district_names, district_codes, districts):
+        for k, dsd in enumerate(voronoi_partition(district, dsd_per_district, rng)):
+            dsds.append({'ADM3_EN': '%s %d' % (name, k + 1), 'ADM3_PCODE': '%s%03d' % (code, k + 1),
+                         'ADM2_EN': name, 'ADM2_PCODE': code, 'Shape_Leng': dsd.length, 'Shape_Area': dsd.area,
+                         'geometry': dsd})
+    gpd.GeoDataFrame(dsds, crs='EPSG:4326').to_file(path(directory, "SL_DSD"))
+
+    # District level agricultural labour (the HIES file spells Nuwara Eliya as Nuwara-eliya)
+    pd.DataFrame({'ADM2_EN': [name if name != 'Nuwara Eliya' else 'Nuwara-eliya' for name in district_names],
+                  'pop_ag_ind_or_ag_income_1plus': rng.uniform(10, 60, len(district_names)),
+                  'pop_ag_reliant_income': rng.uniform(5, 30, len(district_names))}).to_csv(
+        path(directory, "hies_pop_csv"), index=False)
+
+def write_land_use(directory, land, n, rng):
+    cells = voronoi_partition(land, n, rng)
+    gpd.GeoDataFrame({'GFCODE': np.arange(n), 'NAME_1': 'Sri Lanka',
+                      'LU': rng.choice(land_use_types, n, p=land_use_probabilities), 'Name': 'land use',
+                      'geometry': cells}, crs='EPSG:4326').to_file(path(directory, "land_use"))
+
+def write_tanks(directory, land, n, rng):
+    x, y = random_points(shapely.buffer(land, -0.01), n, rng)
+    radius = rng.uniform(0.0005, 0.003, n)  # 50m to 300m
+    tanks = gpd.GeoDataFrame({'Tank_Name': ['tank %d' % k for k in range(n)], 'Map_id': np.arange(1, n + 1),
+                              'District': 'd', 'ASC_': 'a', 'GND': 'g', 'River_B_na': 'r', 'DSD': 's',
+                              'Ownership': 'o', 'silt_p': rng.integers(1, 4, n).astype(float),
+                              'max_soil_d': rng.uniform(0, 5, n), 'cascade': 'c', 'renovat': 'n',
+                              'functional': rng.choice(['Abandoned', 'Damaged', 'Functioning'], n),
+                              'Shape_Leng': 2 * np.pi * radius, 'Shape_Area': np.pi * radius ** 2,
+                              'geometry': shapely.buffer(shapely.points(x, y), radius, quad_segs=4)},
+                             crs='EPSG:4326')
+    tanks.to_file(path(directory, "tanks_polygons"))
+
+    pyogrio.write_dataframe(pd.DataFrame({'Map_id': tanks.Map_id, 'gridcode_m': rng.uniform(10, 40, n)}),
+                            path(directory, "cov_rainfall"), driver='ESRI Shapefile')
+    gpd.GeoDataFrame({'Map_id': tanks.Map_id, 'AquName': rng.choice(aquifer_types, n)},
+                     geometry=shapely.points(x, y), crs='EPSG:4326').to_file(path(directory, "rock_structure"))
+
+def generate_inputs(directory, scale=1.0, seed=1):
+    """Write a synthetic set of model inputs in directory (with the paths of config.inputs, relative to directory).
+    Returns a dictionary with the size of the generated data."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.join(directory, os.path.dirname(inputs["SL_Districts"])), exist_ok=True)
+
+    land = island(scale)
+    land_use_polygons = max(len(district_names) * 4, int(full_land_use_polygons * scale))
+    tanks = max(len(district_names), int(full_tanks * scale))
+
+    write_population_raster(directory, land, rng)
+    write_ghsl_tiles(directory, land, rng)
+    write_admin_units(directory, land, rng)
+    write_land_use(directory, land, land_use_polygons, rng)
+    write_tanks(directory, land, tanks, rng)
+
+    return {'scale': scale, 'seed': seed, 'districts': len(district_names),
+            'dsds': len(district_names) * dsd_per_district, 'land_use_polygons': land_use_polygons, 'tanks': tanks}
@@ -18,6 +18,7 @@ outputs = {}
 
 outputs["ag_dep_pop_shp"] = "./output-data/ag_dependent_population.shp" # agricultural dependent population shapefile
 outputs["tanks_buffers_pop"] = "./output-data/tanks_buffers_agpop.shp" # tank buffers with ag-dep population count
+outputs["tanks_radius_sweep_csv"] = "./output-data/tanks_buffers_radius_sweep.csv" # population within each radius of the tank buffer sweep, by tank
 outputs["tanks_two_part_dsd_level"] = "./output-data/two_part_index_values_dsd.shp" # DSD polygons with index values
 outputs["tanks_GWR_dsd_level"] = "./output-data/GWR_index_values_dsd.shp" # DSD polygons with index values
 outputs["tanks_two_part_dsd_level_csv"] = "./output-data/two_part_index_values_dsd.csv" # DSD level index values
@@ -25,4 +26,36 @@ outputs["tanks_GWR_dsd_level_csv"] = "./output-data/GWR_index_values_dsd.csv" #
 outputs["two_part_index_tank_level_csv"] = "./output-data/index_two_part_tank_level.csv" # Two part index values at tank level
 outputs["three_part_index_tank_level_csv"] = "./output-data/index_three_part_tank_level.csv" # Two part index values at tank level
 outputs["two_part_index_tank_level"] = "./output-data/index_two_part_tank_level.shp" # DSD polygons with index values
-outputs["three_part_index_tank_level"] = "./output-data/index_three_part_tank_level.shp" # DSD polygons with index values
\ No newline at end of file
+outputs["three_part_index_tank_level"] = "./output-data/index_three_part_tank_level.shp" # DSD polygons with index values
+outputs["index_scenarios_csv"] = "./output-data/index_scenarios.csv" # Prioritisation index scenarios compared with the base index
+outputs["index_rank_stability_csv"] = "./output-data/index_rank_stability_tank_level.csv" # Tank ranks statistics over the index scenarios
+# Model parameters. Every stage of the pipeline records the parameters it uses: changing one of them re-runs only the
+# stages (and the downstream ones) that depend on it.
+parameters = {}
+
+parameters["x_resolution"] = 0.0008983 # 100m in degrees (resampled WorldPop raster)
+parameters["y_resolution"] = 0.0008983 # 100m in degrees (resampled WorldPop raster)
+parameters["point_chunk_rows"] = 500 # raster rows converted into points (and written to file) at a time
+parameters["point_chunk_size"] = 500000 # population points read, processed and written at a time by the point layer stages
+parameters["point_tile_size"] = 0 # side (in degrees) of the tiles the point layer stages process the points in, spilling them to disk (partitioned mode, see partitions.py, for layers that don't fit in memory; 0 = chunks of the layers in file order)
+parameters["ghsl_target_classes"] = [11, 12, 13, 21] # GHSL classes considered as rural
+parameters["rural_classification"] = "polygons" # 'polygons': population within the polygonized GHSL rural classes, 'pixels': GHSL class looked up at each population cell (no polygons)
+parameters["Home_Gardens"] = False # Shall we consider home gardens as agricultural lands? Yes=True, No=False
+parameters["pop_engine"] = "raster" # 'raster': zonal sums on the 100m population raster, 'points': queries of the 100m population cells store (see pointstore.py)
+parameters["threshold"] = 0.05 # Acceptable % difference among pop counts
+parameters["r_increment"] = 100 # progressive increment of agricultural lands buffer radius (in metres)
+parameters["tank_buffer"] = 1000 # tank buffer in metres
+parameters["tank_buffer_sweep"] = [500, 1000, 1500, 2000] # tank buffer radii (in metres) of the catchment sweep: population within each radius of every tank, one column per radius (empty list = no sweep)
+parameters["tanks_incremental"] = True # re-buffer and recount only the tanks added or changed (by Map_id, geometry and attributes) since the last run; the other tanks keep their buffers and population counts
+parameters["tank_allocation"] = "buffers" # 'buffers': population within each tank buffer (overlapping buffers share people), 'nearest': ag-dep population assigned to its nearest tank within tank_buffer (Voronoi split)
+parameters["metric_crs"] = "EPSG:5235" # projected CRS (SLD99 / Sri Lanka Grid 1999, metres) used to measure distances
+parameters["selection"] = 0.1 # top 10% SuppDem_index scoring tanks
+parameters["index_scenarios"] = 0 # number of random variants of the prioritisation index evaluated to measure the stability of the tank ranks (0 = none, see prioritisation.py)
+parameters["scenario_weight_range"] = [0.5, 1.5] # range of the weights of the index attributes in the scenarios
+parameters["scenario_selections"] = [0.05, 0.1, 0.2] # selection fractions drawn in the scenarios
+parameters["epochs"] = {"2020": {}} # input epochs of the batch runs (python -m pipeline --epochs): epoch name -> inputs replacing the ones above, e.g. "2015": {"WorldPop_1km_raster": "./input-data/lka_ppp_2015_1km_Aggregated_UNadj.tif", "GHSL_raw_1": ...}
+parameters["epoch_workers"] = 2 # number of epochs run concurrently by the batch runs
+parameters["stage_workers"] = 4 # number of independent stages run concurrently
+parameters["district_workers"] = 8 # number of processes running the per-district tasks of a stage
+parameters["layer_cache_mb"] = 4096 # memory budget (in MB) of the layers kept in memory by each stage process (0 = no cache)
+parameters["profile"] = False # run every stage under cProfile and save its profile in generated-files/profiles
@@ -1,90 +1,125 @@
 """
 This module contains a set of bespoke geocomputation functions
+(rasterio is imported by the functions using it, so that it's only loaded by the stages working on rasters)
 """
 
-import rasterio
-from rasterio.enums import Resampling
-from rasterio.merge import merge
-from rasterio.warp import calculate_default_transform, reproject, Resampling
-from rasterio.mask import mask
-from rasterio.features import shapes
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Point, shape
-from shapely.ops import unary_union
+import shapely
+from shapely.geometry import shape
 import os
-def resample_raster(input_path, output_path, x_resolution, y_resolution):
-    """This function resamples a raster file given a new resolution."""
-    # Open the input raster file
+import hashlib
+
+import storage
+
+def _nearest_index(n_src, n_dst):
+    """Index of the nearest neighbour source pixel of each of the n_dst output pixels along one axis of a raster."""
+    return np.minimum(((np.arange(n_dst) + 0.5) * (n_src / n_dst)).astype(np.int64), n_src - 1)
+
+def resample_raster(input_path, output_path, x_resolution, y_resolution, preserve_sum=False, block_rows=1024):
+    """This function resamples a raster file given a new resolution (nearest neighbour resampling).
+    The output is computed and written in blocks of block_rows rows, so only one block is held in memory at a time.
+    With preserve_sum=True (for rasters of counts, e.g. population) the value of each source pixel is split evenly among
+    the output pixels it is resampled into, so that the total of the raster is preserved. Only upsampling (a finer
+    output resolution) is supported in this mode."""
+    import rasterio
+    from rasterio.windows import Window
     with rasterio.open(input_path) as src:
-        # Define the resampling method (e.g., cubic for cubic convolution)
-        # Resampling documentation: https://rasterio.readthedocs.io/en/stable/topics/resampling.html
-        resampling_method = Resampling.nearest
+        # Size of the output raster
+        width = int(src.width * src.res[0] / x_resolution)
+        height = int(src.height * src.res[1] / y_resolution)
 
-        # Set the desired resolution
-        target_resolution = (x_resolution, y_resolution)  # Set your desired resolution here
+        if preserve_sum and (width < src.width or height < src.height):
+            raise ValueError('Sum preserving resampling is only supported for a finer output resolution.')
 
-        # Resample the raster
-        data = src.read(out_shape = (src.count,
-                                     int(src.height * src.res[0] / target_resolution[0]),
-                                     int(src.width * src.res[1] / target_resolution[1]),),
-                        resampling = resampling_method)
+        # Source pixel of each output column and row
+        col_index = _nearest_index(src.width, width)
+        row_index = _nearest_index(src.height, height)
 
         # Update the metadata
-        transform = rasterio.transform.from_origin(
-            src.bounds.left, src.bounds.top, target_resolution[0], target_resolution[1])
+        transform = rasterio.transform.from_origin(src.bounds.left, src.bounds.top, x_resolution, y_resolution)
 
         kwargs = src.meta.copy()
         kwargs.update({'crs': src.crs,
                        'transform': transform,
-                       'width': int(src.width * src.res[1] / target_resolution[1]),
-                       'height': int(src.height * src.res[0] / target_resolution[0])})
+                       'width': width,
+                       'height': height})
 
-        # Write the resampled data to the output raster file
-        with rasterio.open(output_path, 'w', **kwargs) as dst:
-            dst.write(data)
+        if preserve_sum:
+            # Number of output pixels each source column/row is split into
+            col_count = np.bincount(col_index, minlength=src.width)[col_index]
+            row_count = np.bincount(row_index, minlength=src.height)[row_index]
+            if not np.issubdtype(np.dtype(src.dtypes[0]), np.floating):
+                kwargs.update({'dtype': 'float32'})
 
-def raster_to_shp_point(input_raster, output_shp, field_name:str):
-    """This function converts a raster file into a point shapefile.
-    Negative or null values in the raster input will be deleted in the shp output."""
+        # Write the resampled data to the output raster file, block by block
+        with rasterio.open(output_path, 'w', **kwargs) as dst:
+            for row_off in range(0, height, block_rows):
+                rows = row_index[row_off:row_off + block_rows]
+                src_window = Window(0, int(rows[0]), src.width, int(rows[-1] - rows[0] + 1))
+                data = src.read(window=src_window)[:, rows - rows[0]][:, :, col_index]
+
+                if preserve_sum:
+                    data = data.astype(kwargs['dtype'])
+                    counts = (row_count[row_off:row_off + block_rows, None] * col_count[None, :]).astype(data.dtype)
+                    split = data / counts
+                    if src.nodata is not None:
+                        split = np.where(data == src.nodata, data, split)  # keep the NoData value
+                    data = split
+
+                dst.write(data, window=Window(0, row_off, width, len(rows)))
+
+def raster_values(input_raster, chunk_rows=None):
+    """This function is a generator of (x, y, values) arrays: the centre coordinates and the values of the raster
+    pixels, without any geometry object. Negative, null or NoData pixels are filtered out. The raster is read in blocks
+    of chunk_rows rows (all at once if chunk_rows is None), so only one block is held in memory at a time."""
+    import rasterio
+    from rasterio.windows import Window
     with rasterio.open(input_raster) as src:
-        raster_data = src.read(1)  # Read the raster data and mask out any NoData values
         transform = src.transform  # Get the transformation matrix to convert pixel coordinates to geographic coordinates
-        raster_crs = src.crs
-
-    # Get the number of rows and columns in the raster:
-    num_rows, num_cols = raster_data.shape
-
-    # Create a regular grid of points based on the raster's extent and resolution:
-    x_coords, y_coords = np.meshgrid(np.arange(0, num_cols), np.arange(0, num_rows))
-    points = np.c_[x_coords.ravel(), y_coords.ravel()]
-
-    # Transform the grid of points from pixel coordinates to geographic coordinates
-    lon, lat = rasterio.transform.xy(transform, points[:, 1], points[:, 0])
-
-    # Get the raster values at each point location
-    raster_values = raster_data.ravel()
-
-    # Create a GeoDataFrame with the points and set the CRS to match the raster
-    geometry = [Point(lon[i], lat[i]) for i in range(len(lon))]
-    gdf_pop = gpd.GeoDataFrame({'geometry': geometry, field_name: raster_values}, crs=raster_crs)
-
-    # Turn the negative values (e.g. -999 values) into zeros:
-    # gdf_pop[field_name] = np.where(gdf_pop['field_name'] < 0, 0, int(gdf_pop['field_name']))
-
-    # Remove the negative values:
-    gdf_pop = gdf_pop[gdf_pop[field_name] > 0]
+        block_rows = chunk_rows or src.height
+
+        for row_off in range(0, src.height, block_rows):
+            window = Window(0, row_off, src.width, min(block_rows, src.height - row_off))
+            raster_data = src.read(1, window=window)
+
+            # Keep only the pixels with a positive value (e.g. -999 values and NoData are removed)
+            valid = raster_data > 0
+            if src.nodata is not None:
+                valid &= raster_data != src.nodata
+            rows, cols = np.nonzero(valid)
+
+            # Pixel centres from pixel coordinates to geographic coordinates
+            lon, lat = transform * (cols + 0.5, rows + row_off + 0.5)
+            yield lon, lat, raster_data[rows, cols]
+
+def raster_points(input_raster, field_name:str, chunk_rows=None):
+    """This function is a generator of point GeoDataFrames, one point at the centre of each raster pixel (see
+    raster_values for the pixels kept and the blocks they're read in)."""
+    import rasterio
+    with rasterio.open(input_raster) as src:
+        crs = src.crs
 
-    # Convert values to integers and divide by 100 (because of change of resolution):
-    gdf_pop[field_name] = gdf_pop[field_name]/100
+    for lon, lat, values in raster_values(input_raster, chunk_rows):
+        yield gpd.GeoDataFrame({'geometry': gpd.points_from_xy(lon, lat), field_name: values}, crs=crs)
 
-    gdf_pop.to_file(output_shp)
+def raster_to_shp_point(input_raster, output_shp, field_name:str, chunk_rows=None):
+    """This function converts a raster file into a point vector file (any format handled by storage.py).
+    Negative or null values in the raster input will be deleted in the output.
+    If chunk_rows is given, the points are written to the output in blocks of chunk_rows raster rows and nothing is
+    returned, otherwise the whole point GeoDataFrame is returned."""
+    if chunk_rows is None:
+        gdf_pop = next(raster_points(input_raster, field_name))
+        storage.write_vector(gdf_pop, output_shp)
+        return gdf_pop
 
-    return gdf_pop
+    storage.write_vector_chunks(raster_points(input_raster, field_name, chunk_rows), output_shp)
 
 def merge_raster_files(list_of_raster_files, output_file):
     """This function merges a list of input raster files into a single output"""
+    import rasterio
+    from rasterio.merge import merge
     src_files_to_merge = []  # initialise empty list
     for file in list_of_raster_files:
         src = rasterio.open(file)
@@ -106,6 +141,9 @@ def merge_raster_files(list_of_raster_files, output_file):
 
 def reproject_raster(input_file, dst_crs:str, output_file):
     """This function reproject a raster file given an input, an output and a coordinate system"""
+    import rasterio
+    from rasterio.enums import Resampling
+    from rasterio.warp import calculate_default_transform, reproject
     with rasterio.open(input_file) as src:
         transform, width, height = calculate_default_transform(
             src.crs, dst_crs, src.width, src.height, *src.bounds)
@@ -126,6 +164,9 @@ def reproject_raster(input_file, dst_crs:str, output_file):
                           resampling=Resampling.nearest)
 
 def clip_raster_file(input_file, clip_shp, output_file):
+    import rasterio
+    from rasterio.mask import mask
+
     # Read in GHSL raster to be clipped
     with rasterio.open(input_file) as src:
         raster_meta = src.meta
@@ -148,41 +189,50 @@ def clip_raster_file(input_file, clip_shp, output_file):
     with rasterio.open(output_file, 'w', **clipped_meta) as dst:
         dst.write(clipped_raster)
 
-def raster_to_shp_poly(input_file, output_file, target_classes=None, dissolve=True):
+def raster_to_shp_poly(input_file, output_file, target_classes=None, dissolve=True, dissolved_output_file=None):
+    """This function converts the pixels of the target classes of a raster into polygons (all the classes if
+    target_classes is None). The other pixels are masked out before tracing, and the polygons are repaired in bulk.
+    If dissolved_output_file is given, the polygons are written to output_file and their dissolved version (a single
+    feature) to dissolved_output_file, both from the same tracing; otherwise output_file gets the dissolved or the raw
+    polygons according to dissolve."""
+    import rasterio
+    from rasterio.features import shapes
     # Read in raster:
     with rasterio.open(input_file) as src:
         raster_data = src.read(1).astype(np.float32)  # use 'astype' to ensure values are in a format that can be used by shapely
         transform = src.transform  # Get the transformation matrix to convert pixel coordinates to geographic coordinates
         raster_crs = src.crs
 
-    # Get shapes and values from the raster
-    shapes_gen = shapes(raster_data, transform=transform)
+    # Trace only the pixels of the target classes
+    class_mask = None if target_classes is None else np.isin(raster_data, target_classes)
+    shapes_gen = shapes(raster_data, mask=class_mask, transform=transform)
 
-    # Create a list of features with the 'target_class' attribute
-    features = []
+    geometries, values = [], []
     for geom, val in shapes_gen:
-        if val in target_classes:
-            feature = {
-                'geometry': shape(geom).buffer(0),
-                'LU_class': val
-            }
-            features.append(feature)
-
-    # Create a GeoDataFrame directly from the list of features
-    gdf = gpd.GeoDataFrame(features, crs=raster_crs)
-    
-    if dissolve==True:
+        geometries.append(shape(geom))
+        values.append(val)
+
+    # Create a GeoDataFrame with the 'LU_class' attribute (polygons repaired all at once)
+    gdf = gpd.GeoDataFrame({'geometry': shapely.buffer(np.array(geometries, dtype=object), 0), 'LU_class': values},
+                           crs=raster_crs)
+
+    if dissolve==True or dissolved_output_file is not None:
         # Dissolve geometries into a single feature
         gdf['dissolve_id'] = 1  # Create a new column with a constant value (ensures all dissolved into a single feature)
         dissolved_gdf = gdf.dissolve(by='dissolve_id', as_index=False)
         dissolved_gdf.drop(columns='dissolve_id', inplace=True)  # Remove the 'dissolve_id' column (optional)
+        gdf.drop(columns='dissolve_id', inplace=True)
         print('Vector file dissolved into single feature.\n')
 
-        dissolved_gdf.to_file(output_file)
-    else: gdf.to_file(output_file)
+    if dissolved_output_file is not None:
+        storage.write_vector(gdf, output_file)
+        storage.write_vector(dissolved_gdf, dissolved_output_file)
+    elif dissolve==True:
+        storage.write_vector(dissolved_gdf, output_file)
+    else: storage.write_vector(gdf, output_file)
 
-def split_vector_layer(input_gdf, field_name:str, output_directory):
-    """This function splits a vector layer (input GeoDtaFrame) into different polygons layers"""
+def split_vector_layer(input_gdf, field_name:str, output_directory, ext='.shp'):
+    """This function splits a vector layer (input GeoDtaFrame) into different polygons layers (files with extension ext)"""
     # Group the GeoDataFrame by the specified field
     grouped = input_gdf.groupby(field_name)
 
@@ -194,7 +244,322 @@ def split_vector_layer(input_gdf, field_name:str, output_directory):
         output_gdf = gpd.GeoDataFrame(group_data)
 
         # Define the output file path for the group
-        output_file_path = f"{output_directory}/{group_name}.shp"
+        output_file_path = f"{output_directory}/{group_name}{ext}"
+
+        # Save the group's GeoDataFrame to file
+        storage.write_vector(output_gdf, output_file_path)
+
+def feature_hashes(input_gdf, field_name:str):
+    """This function returns a dictionary with a hash of the geometries and attributes of the features of each value of
+    field_name (e.g. a tank id): the hash of a value changes if any of its features is added, removed or edited."""
+    geometries = shapely.to_wkb(input_gdf.geometry.values)
+    attributes = input_gdf.drop(columns=input_gdf.geometry.name)
+    digests = {}
+    for key, geometry, values in zip(input_gdf[field_name], geometries,
+                                     attributes.itertuples(index=False, name=None)):
+        digest = digests.setdefault(key, hashlib.sha256())
+        digest.update(geometry if geometry is not None else b'')
+        digest.update(repr(values).encode())
+    return {key: digest.hexdigest() for key, digest in digests.items()}
+
+def clip_union(geometries, clip_geom):
+    """This function returns the union of the parts of the polygons that fall within clip_geom (the same as clipping
+    their union with clip_geom). The polygons within clip_geom are kept whole and only the ones crossing its boundary
+    are clipped; lines and points left by polygons only touching clip_geom are dropped."""
+    geometries = np.asarray(geometries, dtype=object)
+    shapely.prepare(clip_geom)
+    inside = shapely.covered_by(geometries, clip_geom)
+    pieces = np.concatenate([geometries[inside], shapely.intersection(geometries[~inside], clip_geom)])
+
+    # Keep only the polygonal parts
+    parts = shapely.get_parts(pieces)
+    parts = parts[np.isin(shapely.get_type_id(parts), [3, 6])]  # Polygon, MultiPolygon
+    return shapely.union_all(parts)
+
+def mask_raster(input_file, mask_gdf, output_file):
+    """This function sets to zero every pixel of a raster whose centre falls outside the polygons of mask_gdf.
+    The output keeps the extent and resolution of the input, so it can be used in place of the input raster."""
+    import rasterio
+    from rasterio.mask import mask
+    with rasterio.open(input_file) as src:
+        raster_meta = src.meta.copy()
+        mask_shapes = mask_gdf.to_crs(src.crs).geometry if mask_gdf.crs is not None else mask_gdf.geometry
+        masked_raster, _ = mask(dataset=src,
+                                shapes=mask_shapes,
+                                crop=False,  # keep the extent of the input raster
+                                nodata=0,  # sets the value for pixels outside the vector boundaries
+                                all_touched=False)  # only the pixels whose centre is within the polygons are kept
+
+    raster_meta.update({'nodata': 0})
+
+    with rasterio.open(output_file, 'w', **raster_meta) as dst:
+        dst.write(masked_raster)
+
+def sample_raster(input_raster, x, y):
+    """This function returns the values of the raster pixels containing the points (x, y), given in the CRS of the
+    raster. Points outside the raster get the NoData value (0 if the raster has none)."""
+    import rasterio
+    with rasterio.open(input_raster) as src:
+        raster_data = src.read(1)
+        fill = src.nodata if src.nodata is not None else 0
+        cols, rows = ~src.transform * (np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+
+    cols = np.floor(cols).astype(np.int64)
+    rows = np.floor(rows).astype(np.int64)
+    inside = (cols >= 0) & (cols < raster_data.shape[1]) & (rows >= 0) & (rows < raster_data.shape[0])
+
+    values = np.full(len(cols), fill, dtype=raster_data.dtype)
+    values[inside] = raster_data[rows[inside], cols[inside]]
+    return values
+
+def reproject_to_grid(input_raster, grid_raster):
+    """This function returns the values of a raster on the grid (extent, resolution and CRS) of grid_raster: every
+    output pixel takes the value of the input pixel containing its centre (nearest neighbour resampling)."""
+    import rasterio
+    from rasterio.enums import Resampling
+    from rasterio.warp import reproject
+    with rasterio.open(grid_raster) as grid:
+        dst_shape, dst_transform, dst_crs = (grid.height, grid.width), grid.transform, grid.crs
 
-        # Save the group's GeoDataFrame to a shapefile
-        output_gdf.to_file(output_file_path)
+    with rasterio.open(input_raster) as src:
+        fill = src.nodata if src.nodata is not None else 0
+        destination = np.full(dst_shape, fill, dtype=src.dtypes[0])
+        reproject(source=rasterio.band(src, 1),
+                  destination=destination,
+                  dst_transform=dst_transform,
+                  dst_crs=dst_crs,
+                  dst_nodata=fill,
+                  resampling=Resampling.nearest)
+    return destination
+
+def mask_raster_by_classes(input_file, class_raster, target_classes, output_file):
+    """This function sets to zero every pixel of a raster whose centre falls outside the pixels of the target classes
+    of class_raster (and its NoData pixels). It's the pixel lookup equivalent of mask_raster with the polygonized target
+    classes (no polygons are created); the output keeps the extent and resolution of the input."""
+    import rasterio
+    classes = reproject_to_grid(class_raster, input_file)
+
+    with rasterio.open(input_file) as src:
+        raster_meta = src.meta.copy()
+        raster_data = src.read()
+        keep = np.isin(classes, target_classes)[np.newaxis]
+        if src.nodata is not None:
+            keep = keep & (raster_data != src.nodata)  # NoData pixels are set to zero too
+
+    masked_raster = np.where(keep, raster_data, 0).astype(raster_data.dtype)
+    raster_meta.update({'nodata': 0})
+
+    with rasterio.open(output_file, 'w', **raster_meta) as dst:
+        dst.write(masked_raster)
+
+def _window_from_bounds(transform, width, height, bounds):
+    """Return the raster window (clipped to the raster extent) covering the given bounds, or None if they don't overlap."""
+    from rasterio.windows import Window
+    col_min, row_min = ~transform * (bounds[0], bounds[3])
+    col_max, row_max = ~transform * (bounds[2], bounds[1])
+    col_min, col_max = sorted((col_min, col_max))
+    row_min, row_max = sorted((row_min, row_max))
+
+    col_off = max(int(np.floor(col_min)), 0)
+    row_off = max(int(np.floor(row_min)), 0)
+    col_end = min(int(np.ceil(col_max)), width)
+    row_end = min(int(np.ceil(row_max)), height)
+
+    if col_end <= col_off or row_end <= row_off:
+        return None
+    return Window(col_off, row_off, col_end - col_off, row_end - row_off)
+
+def coverage_fraction(geom, out_shape, transform):
+    """Return an array with the fraction of each pixel's area covered by a polygon.
+    Pixels crossed by the polygon boundary get the exact intersection area, all the others are either 0 or 1."""
+    from rasterio.features import rasterize
+    inside = rasterize([(geom, 1)], out_shape=out_shape, transform=transform, fill=0, dtype='uint8')
+    edge = rasterize([(geom.boundary, 1)], out_shape=out_shape, transform=transform, fill=0, all_touched=True,
+                     dtype='uint8')
+
+    coverage = inside.astype(np.float64)
+    rows, cols = np.nonzero(edge)
+    if len(rows) > 0:
+        # Pixel boxes of the boundary pixels (north-up grids only)
+        x_min = transform.c + cols * transform.a
+        y_max = transform.f + rows * transform.e
+        boxes = shapely.box(x_min, y_max + transform.e, x_min + transform.a, y_max)
+        pixel_area = abs(transform.a * transform.e)
+        coverage[rows, cols] = shapely.area(shapely.intersection(boxes, geom)) / pixel_area
+
+    return coverage
+
+def zonal_sum(input_raster, zones_gdf, scale=1.0, fractional=False, overlapping=False):
+    """This function sums the positive values of a raster within each polygon of a GeoDataFrame.
+    A pixel counts towards a zone when its centre falls within it: this gives the same totals as a spatial join between
+    the zones and the points created by raster_to_shp_point (negative and null values are discarded in both cases).
+    With fractional=True the pixels crossed by a zone boundary are weighted by the share of their area inside the zone.
+    Non-overlapping zones are rasterized together onto the raster grid in a single pass; set overlapping=True for
+    layers whose polygons overlap (e.g. tank buffers), so that each zone is rasterized on its own window.
+    Returns a numpy array with one total per zone, in the order of the GeoDataFrame."""
+    import rasterio
+    from rasterio.features import rasterize
+    totals = np.zeros(len(zones_gdf), dtype=np.float64)
+
+    with rasterio.open(input_raster) as src:
+        if zones_gdf.crs is not None and src.crs is not None and zones_gdf.crs != src.crs:
+            zones_gdf = zones_gdf.to_crs(src.crs)
+        geometries = zones_gdf.geometry.values
+        valid = np.flatnonzero(~(shapely.is_missing(geometries) | shapely.is_empty(geometries)))
+
+        # Group the zones that can be rasterized together onto the same window
+        if fractional or overlapping:
+            groups = [[i] for i in valid]
+        else:
+            groups = [valid] if len(valid) > 0 else []
+
+        for group in groups:
+            group_geoms = geometries[group]
+            window = _window_from_bounds(src.transform, src.width, src.height, shapely.total_bounds(group_geoms))
+            if window is None:
+                continue
+
+            values = src.read(1, window=window, masked=True).filled(0).astype(np.float64)
+            values[values <= 0] = 0  # negative values (e.g. -99999 nodata) are not population
+            window_transform = src.window_transform(window)
+
+            if fractional:
+                totals[group[0]] = (coverage_fraction(group_geoms[0], values.shape, window_transform) * values).sum()
+            else:
+                labels = rasterize(((geom, n + 1) for n, geom in enumerate(group_geoms)),
+                                   out_shape=values.shape, transform=window_transform, fill=0, dtype='int32')
+                sums = np.bincount(labels.ravel(), weights=values.ravel(), minlength=len(group) + 1)
+                totals[group] = sums[1:]
+
+    return totals * scale
+
+def zone_labels(zones_gdf, grid_raster):
+    """This function returns the label of every pixel of the grid of grid_raster: the position in zones_gdf of the
+    polygon containing the pixel centre (-1 for none, the last polygon for pixels within more of them). It's the rule
+    of zonal_sum, so grouped sums over the labels give the zonal_sum totals of non-overlapping zones."""
+    import rasterio
+    from rasterio.features import rasterize
+    with rasterio.open(grid_raster) as src:
+        out_shape, transform, crs = (src.height, src.width), src.transform, src.crs
+
+    if zones_gdf.crs is not None and crs is not None and zones_gdf.crs != crs:
+        zones_gdf = zones_gdf.to_crs(crs)
+    geometries = zones_gdf.geometry.values
+    valid = np.flatnonzero(~(shapely.is_missing(geometries) | shapely.is_empty(geometries)))
+    if len(valid) == 0:
+        return np.full(out_shape, -1, dtype=np.int32)
+    return rasterize(((geometries[k], k) for k in valid), out_shape=out_shape, transform=transform, fill=-1,
+                     dtype='int32')
+
+def write_label_raster(grid_raster, labels, output_file):
+    """This function writes labels (a dictionary of label name: array on the grid of grid_raster) as the bands of an
+    integer raster, with the label names as band descriptions."""
+    import rasterio
+    with rasterio.open(grid_raster) as src:
+        raster_meta = src.meta.copy()
+    raster_meta.update({'count': len(labels), 'dtype': 'int32', 'nodata': None, 'compress': 'deflate'})
+
+    with rasterio.open(output_file, 'w', **raster_meta) as dst:
+        for band, (name, values) in enumerate(labels.items(), start=1):
+            dst.write(np.asarray(values, dtype=np.int32), band)
+            dst.set_band_description(band, name)
+
+def grouped_sums(label_raster, value_rasters, chunk_rows=None):
+    """This function sums the positive values of rasters (a dictionary of column name: raster file, on the grid of
+    label_raster) over the groups of pixels sharing the same labels (see write_label_raster). The rasters are read in
+    blocks of chunk_rows rows (all at once if chunk_rows is None).
+    Returns a DataFrame with a column per label and per value raster and a row per group of labels with positive
+    values, sorted by labels."""
+    import rasterio
+    from rasterio.windows import Window
+    with rasterio.open(label_raster) as labels_src:
+        label_names = list(labels_src.descriptions)
+        sources = {name: rasterio.open(path) for name, path in value_rasters.items()}
+        try:
+            block_rows = chunk_rows or labels_src.height
+            blocks = []
+            for row_off in range(0, labels_src.height, block_rows):
+                window = Window(0, row_off, labels_src.width, min(block_rows, labels_src.height - row_off))
+                values = {}
+                for name, src in sources.items():
+                    values[name] = src.read(1, window=window, masked=True).filled(0).astype(np.float64).ravel()
+                    values[name][values[name] <= 0] = 0  # negative values (e.g. -99999 nodata) are not population
+                keep = np.logical_or.reduce([v > 0 for v in values.values()])
+                labels = labels_src.read(window=window).reshape(len(label_names), -1)[:, keep]
+
+                block = pd.DataFrame({**dict(zip(label_names, labels)), **{k: v[keep] for k, v in values.items()}})
+                blocks.append(block.groupby(label_names, as_index=False).sum())
+        finally:
+            for src in sources.values():
+                src.close()
+
+    return pd.concat(blocks, ignore_index=True).groupby(label_names, as_index=False).sum()
+
+def raster_cells(input_raster, geom, scale=1.0):
+    """This function returns the centre coordinates and values (x, y, values) of the pixels of a raster with a positive
+    value whose centre falls within a polygon (given in the raster CRS)."""
+    import rasterio
+    from rasterio.features import rasterize
+    with rasterio.open(input_raster) as src:
+        window = _window_from_bounds(src.transform, src.width, src.height, geom.bounds)
+        if window is None:
+            return np.empty(0), np.empty(0), np.empty(0)
+
+        values = src.read(1, window=window, masked=True).filled(0)
+        window_transform = src.window_transform(window)
+
+    inside = rasterize([(geom, 1)], out_shape=values.shape, transform=window_transform, fill=0, dtype='uint8')
+    rows, cols = np.nonzero((inside == 1) & (values > 0))
+    x, y = window_transform * (cols + 0.5, rows + 0.5)
+
+    return x, y, values[rows, cols].astype(np.float64) * scale
+
+def signed_distances(x, y, geom):
+    """This function returns the planar distance (in the units of the coordinates) between each point and the boundary
+    of a polygon layer: positive for the points outside the polygons, negative for the points inside.
+    A point is within a buffer of radius r of the polygons if its signed distance is <= r, and within the inward buffer
+    of radius r (negative buffer) if its signed distance is <= -r."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if len(x) == 0:
+        return np.empty(0)
+
+    # Split the polygons boundaries into single segments, so that the nearest segment of each point can be found with
+    # a spatial index instead of measuring the distance from whole (very large) rings
+    parts = shapely.get_parts(geom)
+    parts = parts[shapely.get_type_id(parts) == 3]  # polygons only (e.g. drop lines left by a clip)
+    coords, ring_index = shapely.get_coordinates(shapely.get_rings(parts), return_index=True)
+    same_ring = ring_index[1:] == ring_index[:-1]
+    segments = shapely.linestrings(np.stack([coords[:-1][same_ring], coords[1:][same_ring]], axis=1))
+    if len(segments) == 0:
+        return np.full(len(x), np.inf)
+
+    tree = shapely.STRtree(segments)
+    (point_index, _), distances = tree.query_nearest(shapely.points(x, y), return_distance=True, all_matches=False)
+    boundary_distance = np.empty(len(x))
+    boundary_distance[point_index] = distances
+
+    polygons = shapely.multipolygons(parts)
+    shapely.prepare(polygons)
+    inside = shapely.intersects_xy(polygons, x, y)
+
+    return np.where(inside, -boundary_distance, boundary_distance)
+
+def nearest_allocation(points_gdfs, field_name:str, polygons_gdf, max_distance, metric_crs):
+    """This function assigns each point to its nearest polygon within max_distance (in the units of metric_crs, where
+    distances are measured) and sums the field_name values of the points assigned to each polygon. Points within a
+    polygon are assigned to it; every point is counted once at most (a point equidistant from two polygons goes to one of
+    them). points_gdfs is an iterable of point GeoDataFrames (e.g. the chunks of a layer): the values are added up in
+    the order of the points, so the totals don't depend on how the points are split.
+    Returns a numpy array with one total per polygon, in the order of polygons_gdf."""
+    polygons = polygons_gdf.geometry.to_crs(metric_crs).values
+    tree = shapely.STRtree(polygons)
+    totals = np.zeros(len(polygons), dtype=np.float64)
+
+    for points_gdf in points_gdfs:
+        points = points_gdf.geometry.to_crs(metric_crs).values
+        values = np.nan_to_num(points_gdf[field_name].to_numpy(dtype=np.float64))
+        point_index, polygon_index = tree.query_nearest(points, max_distance=max_distance, all_matches=False)
+        np.add.at(totals, polygon_index, values[point_index])
+
+    return totals
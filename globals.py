@@ -9,24 +9,38 @@ import os
 inputFolder = "./input-data"
 modelRunsDir = "./generated-files"
 outputFolder = "./output-data"
+epochs_dir = "./epochs" # Folder of the epochs of the batch runs: one folder per epoch, with its own generated-files and output-data (see pipeline/epochs.py)
 
 ind_dist_boundaries_filepath = modelRunsDir + "/individual-districts-boundaries" # Folder containing districts boundaries
 ind_dists_filepath = modelRunsDir + "/individual-districts" # Folder containing single districts files
 ag_lands_only_path = modelRunsDir + "/ag_lands_only"
 buffers_path = modelRunsDir + "/buffers"
 
+# Format of the intermediate vector layers (see storage.py): '.parquet' (GeoParquet), '.fgb' (FlatGeobuf) or '.shp'.
+# The model outputs (see config.py) are always shapefiles.
+vector_ext = ".parquet"
+
 # Files
 Resampled_pop_raster = os.path.join(modelRunsDir,"100m_resampled_pop.tif") # Worldpop rasted resampled to 100m resolution
-pop_points_shp = os.path.join(modelRunsDir, "100m_pop_point.shp") # Point shp with population at 100m
+pop_points_shp = os.path.join(modelRunsDir, "100m_pop_point" + vector_ext) # Points with population at 100m
 ghsl_merged = os.path.join(modelRunsDir,"GHSL_sri_lanka.tif") # Merged GHSL raster
 ghsl_merged_wgs84 = os.path.join(modelRunsDir,"GHSL_sl_wgs84.tif") # Merged GHSL raster in WGS84
 ghsl_merged_clipped = os.path.join(modelRunsDir,"GHSL_sl_wgs84_clipped.tif") # GHSL raster in WGS84 clipped to Sri Lanka
-ghsl_poly = os.path.join(modelRunsDir,"GHSL_sl.shp") # GHSL layer polygon
-ghsl_poly_dissolved = os.path.join(modelRunsDir,"GHSL_sl_dissolved.shp") # GHSL raster in WGS84 clipped to Sri Lanka
-ag_lands = os.path.join(modelRunsDir, "ag_lands_only.shp") # Agricultural lands polygons (only agricultural lands - got rid of all other land uses)
-ag_lands_dissolved = os.path.join(modelRunsDir, "ag_lands_dissolved.shp") # Dissolved agricultural lands polygons
-rur_points_shp = os.path.join(modelRunsDir, "WP_points_ghsl.shp") # Rural population point shapefile (GHSL layer join)
+ghsl_poly = os.path.join(modelRunsDir,"GHSL_sl" + vector_ext) # GHSL layer polygon
+ghsl_poly_dissolved = os.path.join(modelRunsDir,"GHSL_sl_dissolved" + vector_ext) # GHSL raster in WGS84 clipped to Sri Lanka
+ag_lands = os.path.join(modelRunsDir, "ag_lands_only" + vector_ext) # Agricultural lands polygons (only agricultural lands - got rid of all other land uses)
+rur_points_shp = os.path.join(modelRunsDir, "WP_points_ghsl" + vector_ext) # Rural population points (GHSL layer join)
+pop_store = os.path.join(modelRunsDir, "pop_store") # Population cells as memory-mapped columns with rural flag, district and DSD ids (see pointstore.py)
+Pop_labels_raster = os.path.join(modelRunsDir, "100m_pop_labels.tif") # District, DSD and GHSL class of every 100m population cell (one band each)
+pop_groups_csv = os.path.join(modelRunsDir, "pop_groups.csv") # Total and rural population by district, DSD and GHSL class
+Rural_pop_raster = os.path.join(modelRunsDir, "100m_rural_pop.tif") # 100m population raster masked to the GHSL rural classes
 pop_count_comparison_csv = os.path.join(modelRunsDir, "pop_df_hies.csv") # csv file contaning district level comparisons among pop counts
 agland_buffers_radii_csv = os.path.join(modelRunsDir, "agland_buffer_radii.csv") # csv file with the final buffer radius value for each district
-ag_lands_and_buffers = os.path.join(modelRunsDir, "ag_lands_and_buffers.shp") # Merged layer of all agricultural lands' buffers
-tanks_buffers = os.path.join(modelRunsDir, "tanks_buffers.shp") # Buffers around water tanks
\ No newline at end of file
+ag_lands_and_buffers = os.path.join(modelRunsDir, "ag_lands_and_buffers" + vector_ext) # Merged layer of all agricultural lands' buffers
+tanks_buffers = os.path.join(modelRunsDir, "tanks_buffers" + vector_ext) # Buffers around water tanks
+tanks_buffers_state = os.path.join(modelRunsDir, "tanks_buffers_state.json") # Key of the last tanks buffers run (see the tanks_incremental parameter)
+tanks_pop_state = os.path.join(modelRunsDir, "tanks_buffers_pop_state.json") # Tanks hashes and population counts of the last tanks count (see the tanks_incremental parameter)
+spill_dir = os.path.join(modelRunsDir, "spill") # Files spilled to disk by the stages run in partitioned mode (see the point_tile_size parameter), removed at the end of each stage
+stage_manifest = os.path.join(modelRunsDir, "stage_manifest.json") # Hashes of the inputs, parameters and code of the last run of each stage
+run_report = os.path.join(modelRunsDir, "run_report.json") # Telemetry of the stages run by the last run of the model
+profiles_dir = os.path.join(modelRunsDir, "profiles") # cProfile files of the stages (when the profile parameter is set)
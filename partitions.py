@@ -0,0 +1,85 @@
+"""
+partitions.py
+
+Partitioned (out-of-core) processing of point layers too large to be held in memory. The points, read a chunk at a time,
+are spilled to disk in the square tiles of a grid, and the tiles are processed one at a time in spatial order (the
+Z-order of the grid), so that every tile only meets the polygons around it (e.g. a clip mask is only built for the area
+of a tile). The results are spilled again and given back in the order of the input points: the output is the same as
+processing the whole layer at once, while only one tile or one chunk is held in memory.
+
+Spilled files are GeoParquet files in a spill folder (one file per tile and input chunk), removed once the layer has
+been processed.
+"""
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+def grid_keys(x, y, tile_size):
+    """Key of the tile of every point: its column and row in a grid of tile_size squares anchored to the origin,
+    packed into a single integer."""
+    cols = np.floor(np.asarray(x, dtype=np.float64) / tile_size).astype(np.int64)
+    rows = np.floor(np.asarray(y, dtype=np.float64) / tile_size).astype(np.int64)
+    return (cols + 2**31) * 2**32 + (rows + 2**31)
+
+def spatial_order(keys):
+    """Tile keys sorted by the Z-order (Morton code) of their column and row, so that consecutive tiles are close."""
+    keys = np.asarray(keys, dtype=np.int64)
+    cols, rows = keys // 2**32, keys % 2**32
+    cols, rows = (cols - cols.min(), rows - rows.min()) if len(keys) > 0 else (cols, rows)
+    codes = np.zeros(len(keys), dtype=np.int64)
+    for bit in range(31):
+        codes |= ((cols >> bit) & 1) << (2 * bit)
+        codes |= ((rows >> bit) & 1) << (2 * bit + 1)
+    return [int(k) for k in keys[np.argsort(codes, kind='stable')]]
+
+def spill_tiles(chunks, tile_size, directory):
+    """Spill point chunks (GeoDataFrames) to a folder, one file per tile and chunk, with the position of every point
+    in the layer as index. Returns the number of chunks, the keys of the tiles (spatially sorted) and an empty
+    GeoDataFrame with the columns of the points."""
+    os.makedirs(directory, exist_ok=True)
+    tiles, n_chunks, start, empty = set(), 0, 0, None
+    for gdf in chunks:
+        gdf = gdf.set_axis(pd.RangeIndex(start, start + len(gdf)))
+        empty = gdf.iloc[:0] if empty is None else empty
+        keys = grid_keys(gdf.geometry.x.values, gdf.geometry.y.values, tile_size)
+        for key in np.unique(keys):
+            gdf[keys == key].to_parquet(os.path.join(directory, '%d_%d.parquet' % (key, n_chunks)), index=True)
+            tiles.add(int(key))
+        start += len(gdf)
+        n_chunks += 1
+    return n_chunks, spatial_order(sorted(tiles)), empty
+
+def map_tiles(chunks, func, tile_size, spill_directory):
+    """Generator of the results of func(tile points) over the tiles of point chunks, given back a chunk at a time in
+    the order of the input points. func returns a selection of the points of a tile (a GeoDataFrame keeping their
+    index, with any columns). The points and the results are spilled to spill_directory, removed at the end."""
+    input_directory = os.path.join(spill_directory, 'input')
+    output_directory = os.path.join(spill_directory, 'output')
+    shutil.rmtree(spill_directory, ignore_errors=True)
+    try:
+        n_chunks, tiles, empty = spill_tiles(chunks, tile_size, input_directory)
+        os.makedirs(output_directory)
+
+        # Process the tiles in spatial order, spilling the results by input chunk
+        written = set()
+        for key in tiles:
+            parts = [(c, os.path.join(input_directory, '%d_%d.parquet' % (key, c))) for c in range(n_chunks)]
+            parts = [(c, gpd.read_parquet(path)) for c, path in parts if os.path.isfile(path)]
+            result = func(pd.concat([gdf for _, gdf in parts]))
+            for c, gdf in parts:
+                chunk_result = result[result.index.isin(gdf.index)]
+                if len(chunk_result) > 0:
+                    chunk_result.to_parquet(os.path.join(output_directory, '%d_%d.parquet' % (c, key)), index=True)
+                    written.add(c)
+
+        # Results of every chunk, in the order of the input points
+        for c in sorted(written):
+            paths = [os.path.join(output_directory, f) for f in os.listdir(output_directory) if f.startswith('%d_' % c)]
+            yield pd.concat([gpd.read_parquet(path) for path in paths]).sort_index().reset_index(drop=True)
+        if not written and empty is not None:
+            yield func(empty).reset_index(drop=True)  # empty result, with the columns of the results
+    finally:
+        shutil.rmtree(spill_directory, ignore_errors=True)
@@ -0,0 +1,14 @@
+"""
+Pipeline of the model: the stages (stages.py), the stage graph that runs the out of date ones (graph.py) and the
+command line interface (cli.py, run with 'python -m pipeline'). Batch runs over several input epochs are in epochs.py.
+"""
+from pipeline.graph import Stage, run_stages, downstream_stages
+from pipeline.layers import read_layer, set_memory_budget
+from pipeline.stages import build_stages
+from pipeline.epochs import run_epochs
+
+def run_pipeline(parameters, selected=None):
+    """Run all the stages of the model whose inputs, parameters or code changed since their last run, or only the
+    'selected' stages (names of stages) if given."""
+    run_stages(build_stages(parameters), parameters, workers=parameters["stage_workers"],
+               initializer=set_memory_budget, initargs=(parameters["layer_cache_mb"],), selected=selected)
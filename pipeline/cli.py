@@ -0,0 +1,86 @@
+"""
+cli.py
+
+Command line interface of the model. Without options, all the out of date stages are run (as main.py does):
+
+    python -m pipeline
+    python -m pipeline --stage tank-index              # run only the prioritisation index stage
+    python -m pipeline --from buffers                  # run the buffers stage and all the stages depending on it
+    python -m pipeline --list                          # list the stages, in run order, with their inputs
+    python -m pipeline --set tank_buffer=1500 --from tanks-buffers
+    python -m pipeline --epochs                        # batch run of all the input epochs (see epochs.py)
+    python -m pipeline --epochs 2015 2020              # batch run of some of them
+
+Selected stages are always run; the other stages are left as they are and their outputs must exist. The libraries
+used by the stages (rasterio in particular) are only imported by the stages that need them.
+"""
+import argparse
+import json
+
+def parse_parameters(settings, parameters):
+    """Copy of the parameters with the NAME=VALUE settings applied (values in JSON, e.g. tank_buffer=1500)."""
+    parameters = dict(parameters)
+    for setting in settings:
+        name, _, value = setting.partition('=')
+        if name not in parameters:
+            raise Exception('ERROR: unknown parameter ' + name)
+        try:
+            parameters[name] = json.loads(value)
+        except ValueError:
+            parameters[name] = value  # plain strings can be given without quotes
+    return parameters
+
+def list_stages(stages):
+    from pipeline.graph import stage_dependencies, topological_order
+    dependencies = stage_dependencies(stages)
+    for stage in topological_order(stages, dependencies):
+        print(stage.name + (' (after ' + ', '.join(dependencies[stage.name]) + ')' if dependencies[stage.name] else ''))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pipeline',
+                                     description='Sri Lanka tank rejuvenation priority index model.')
+    parser.add_argument('--stage', action='append', default=[], metavar='NAME',
+                        help='run this stage only (can be repeated)')
+    parser.add_argument('--from', dest='from_stages', action='append', default=[], metavar='NAME',
+                        help='run this stage and all the stages depending on it (can be repeated)')
+    parser.add_argument('--list', action='store_true', help='list the stages and exit')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='model parameter to change (JSON value)')
+    parser.add_argument('--workers', type=int, help='number of independent stages run concurrently')
+    parser.add_argument('--epochs', nargs='*', metavar='NAME',
+                        help='batch run of these input epochs (all of them if no name is given), see epochs.py')
+    args = parser.parse_args(argv)
+
+    from config import parameters
+    from pipeline import build_stages, downstream_stages, run_epochs, run_pipeline
+
+    parameters = parse_parameters(args.set, parameters)
+    if args.workers is not None:
+        parameters["stage_workers"] = args.workers
+    stages = build_stages(parameters)
+
+    if args.list:
+        list_stages(stages)
+        return
+
+    names = {stage.name for stage in stages}
+    for name in args.stage + args.from_stages:
+        if name not in names:
+            parser.error('unknown stage %s (see --list)' % name)
+
+    if args.epochs is not None:
+        if args.stage or args.from_stages:
+            parser.error('--epochs runs all the stages of the epochs: it can\'t be used with --stage or --from')
+        unknown = set(args.epochs) - set(parameters["epochs"])
+        if unknown:
+            parser.error('unknown epochs %s (see the epochs parameter)' % ', '.join(sorted(unknown)))
+        run_epochs(parameters, args.epochs or None)
+        return
+
+    selected = None
+    if args.stage or args.from_stages:
+        selected = set(args.stage) | downstream_stages(stages, args.from_stages)
+    run_pipeline(parameters, selected)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+epochs.py
+
+Batch runs of the model over several input epochs (e.g. WorldPop and GHSL years, see 'epochs' in config.py). Every
+epoch replaces some of the model inputs. The stages that read none of them, directly or through other stages (district
+boundaries, agricultural lands partitions, tanks buffers...), give the same outputs for every epoch: they're run once,
+in the model folder. The other stages are run for every epoch in a folder of its own (epochs/<epoch name>), with its
+own generated-files and output-data folders, stage manifest and run report: an epoch's outputs never overwrite the
+ones of another epoch, and epochs are run again incrementally like the model itself.
+
+The outputs of the invariant stages are linked (or copied where links can't be created) into every epoch folder, so
+the epoch stages find them at their usual paths, and the keys of the invariant stages recorded in the stage manifest of
+the model folder stand for these outputs in the keys of the epoch stages (a change of an invariant stage runs the epoch
+stages again). Epochs are run in parallel, each in a process of its own started from
+scratch (the paths of the model are relative to the folder a process runs in).
+"""
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+from config import inputs
+from globals import epochs_dir
+from storage import shp_extensions
+from pipeline.graph import downstream_stages, load_manifest, run_stages, selected_upstream_keys
+from pipeline.layers import set_memory_budget
+from pipeline.stages import build_stages
+
+def epoch_stage_names(stages, epochs):
+    """Names of the stages whose outputs depend on the epoch: the stages reading an input replaced by an epoch, and all
+    the stages depending on them."""
+    epoch_inputs = {os.path.normpath(inputs[name]) for overrides in epochs.values() for name in overrides}
+    readers = [stage.name for stage in stages if any(os.path.normpath(i) in epoch_inputs for i in stage.inputs)]
+    return downstream_stages(stages, readers)
+
+def epoch_inputs(overrides, root):
+    """Model inputs of an epoch, as absolute paths (the epoch stages run in the epoch folder)."""
+    unknown = set(overrides) - set(inputs)
+    if unknown:
+        raise Exception('ERROR: unknown epoch inputs ' + ', '.join(sorted(unknown)))
+    return {name: os.path.normpath(os.path.join(root, overrides.get(name, path))) for name, path in inputs.items()}
+
+def link_files(paths, root, directory):
+    """Link the files (and the component files of shapefiles, and the files of folders) of the root folder into another
+    folder, at the same relative paths. Files are copied where links can't be created."""
+    for path in paths:
+        if os.path.isdir(os.path.join(root, path)):
+            link_files([os.path.join(path, name) for name in os.listdir(os.path.join(root, path))], root, directory)
+            continue
+        file_root, ext = os.path.splitext(path)
+        components = [file_root + e for e in shp_extensions] if ext.lower() == '.shp' else [path]
+        for component in components:
+            source = os.path.join(root, component)
+            if not os.path.isfile(source):
+                continue
+            link = os.path.join(directory, component)
+            os.makedirs(os.path.dirname(link), exist_ok=True)
+            if os.path.lexists(link):
+                os.remove(link)
+            try:
+                os.symlink(os.path.abspath(source), link)
+            except OSError:
+                shutil.copy2(source, link)
+
+def _init_epoch_process(epoch_paths, memory_budget):
+    """Initializer of the processes running the stages of an epoch (processes that aren't forked don't get the epoch
+    inputs from the process starting them)."""
+    inputs.update(epoch_paths)
+    set_memory_budget(memory_budget)
+
+def run_epoch(name, overrides, root, parameters, invariant_outputs, invariant_keys):
+    """Run the epoch stages of an epoch in its folder (in a process of its own, see run_epochs). invariant_keys gives
+    the keys of the invariant stages by the paths of their outputs."""
+    directory = os.path.join(root, epochs_dir, name)
+    os.makedirs(directory, exist_ok=True)
+    link_files(invariant_outputs, root, directory)
+    os.chdir(directory)
+    epoch_paths = epoch_inputs(overrides, root)
+    inputs.update(epoch_paths)
+
+    print('Running epoch', name, 'in', directory)
+    print()
+    stages = build_stages(parameters)
+    names = epoch_stage_names(stages, parameters["epochs"])
+    run_stages([stage for stage in stages if stage.name in names], parameters, workers=parameters["stage_workers"],
+               initializer=_init_epoch_process, initargs=(epoch_paths, parameters["layer_cache_mb"]),
+               upstream_keys=invariant_keys)
+    return name
+
+def run_epochs(parameters, names=None):
+    """Run the model for the epochs of parameters["epochs"] (or only the named ones): the invariant stages once, in the
+    model folder, then the epoch stages of up to parameters["epoch_workers"] epochs at a time."""
+    epochs = parameters["epochs"]
+    names = list(epochs) if names is None else list(names)
+    unknown = set(names) - set(epochs)
+    if unknown:
+        raise Exception('ERROR: unknown epochs ' + ', '.join(sorted(unknown)))
+
+    stages = build_stages(parameters)
+    epoch_names = epoch_stage_names(stages, epochs)
+    invariant = [stage for stage in stages if stage.name not in epoch_names]
+    print('Stages run once for all the epochs:', ', '.join(stage.name for stage in invariant))
+    print()
+    run_stages(invariant, parameters, workers=parameters["stage_workers"], initializer=set_memory_budget,
+               initargs=(parameters["layer_cache_mb"],))
+
+    root = os.getcwd()
+    invariant_outputs = [output for stage in invariant for output in stage.outputs]
+    invariant_keys = selected_upstream_keys(stages, epoch_names, load_manifest())
+    with ProcessPoolExecutor(max_workers=max(min(parameters["epoch_workers"], len(names)), 1),
+                             mp_context=multiprocessing.get_context('spawn'), max_tasks_per_child=1) as executor:
+        futures = [executor.submit(run_epoch, name, epochs[name], root, parameters, invariant_outputs, invariant_keys)
+                   for name in names]
+        for future in futures:
+            print('Epoch', future.result(), 'completed.')  # future.result() raises the epoch exception, if any
+            print()
@@ -0,0 +1,315 @@
+"""
+graph.py
+
+Stage graph of the model. Every stage declares the files it reads, the files it writes and the parameters it uses
+(stages writing one file per district declare the folder of the files, so that the graph is built without reading the
+districts layer).
+The key of a stage is a hash of the content of its input files (or of the keys of the stages producing them), of the
+values of its parameters and of the source code of the stage function (and of the project functions and classes it
+uses, with their methods).
+A stage is run only if its key differs from the one recorded at its last successful run or if one of its outputs is
+missing. Stages that don't depend on each other are run concurrently. A selection of stages can also be run on its own
+(e.g. from the command line, see cli.py), reading the outputs of the other stages as they are.
+"""
+import hashlib
+import inspect
+import json
+import os
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+
+from globals import modelRunsDir, stage_manifest, run_report, profiles_dir
+from storage import shp_extensions
+from pipeline import telemetry
+
+# Project root: functions defined in modules under this folder are part of the code version of a stage
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@dataclass
+class Stage:
+    name: str
+    func: types.FunctionType
+    inputs: list = field(default_factory=list)  # files (or folders) read by the stage
+    outputs: list = field(default_factory=list)  # files (or folders) written by the stage
+    params: list = field(default_factory=list)  # names of the parameters used by the stage
+
+def _is_project_object(obj):
+    """True if the function or module is defined within the project folder (i.e. not in a library)."""
+    module = inspect.getmodule(obj)
+    module_file = getattr(module, '__file__', None)
+    return module_file is not None and os.path.abspath(module_file).startswith(project_dir + os.sep)
+
+def _code_names(code):
+    """Names referenced by a code object, including the ones in nested code objects (comprehensions, lambdas...)."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _code_names(const)
+    return names
+
+def _project_objects(obj):
+    """Project functions and classes an object referenced by a function stands for: the object itself, the class of an
+    instance of a project class, or the ones held by a container (e.g. a dictionary of storage backends)."""
+    values = obj.values() if isinstance(obj, dict) else obj if isinstance(obj, (list, tuple)) else [obj]
+    for value in values:
+        if isinstance(value, (types.FunctionType, type)):
+            if _is_project_object(value):
+                yield value
+        elif not isinstance(value, types.ModuleType) and _is_project_object(type(value)):
+            yield type(value)
+
+def _class_functions(cls):
+    """Functions defined by a class (methods, static and class methods, properties)."""
+    for value in vars(cls).values():
+        if isinstance(value, (staticmethod, classmethod)):
+            value = value.__func__
+        elif isinstance(value, property):
+            value = value.fget
+        if isinstance(value, types.FunctionType):
+            yield value
+
+def code_hash(func):
+    """Hash of the source code of a function and of all the project functions and classes (with their methods) it
+    (recursively) uses."""
+    sources = {}
+    pending = [func]
+    while pending:
+        f = pending.pop()
+        qualified_name = f.__module__ + '.' + f.__qualname__
+        if qualified_name in sources:
+            continue
+        sources[qualified_name] = inspect.getsource(f)
+
+        # Look the names used by the function (or by the methods of the class) up in its module and in the project
+        # modules it imports
+        module = inspect.getmodule(f)
+        namespaces = [module] + [m for m in vars(module).values()
+                                 if isinstance(m, types.ModuleType) and _is_project_object(m)]
+        codes = [g.__code__ for g in _class_functions(f)] if isinstance(f, type) else [f.__code__]
+        for name in set().union(*[_code_names(code) for code in codes]):
+            for namespace in namespaces:
+                pending.extend(_project_objects(getattr(namespace, name, None)))
+
+    digest = hashlib.sha256()
+    for qualified_name in sorted(sources):
+        digest.update(qualified_name.encode())
+        digest.update(sources[qualified_name].encode())
+    return digest.hexdigest()
+
+def file_hash(path, file_cache):
+    """Hash of the content of a file (of all its component files for a shapefile). The hashes are cached in file_cache
+    by path, size and modification time, so unchanged files are not read again."""
+    root, ext = os.path.splitext(path)
+    components = [root + e for e in shp_extensions] if ext.lower() == '.shp' else [path]
+
+    digest = hashlib.sha256()
+    for component in components:
+        if not os.path.isfile(component):
+            digest.update(('missing:' + os.path.basename(component)).encode())
+            continue
+
+        stat = os.stat(component)
+        cached = file_cache.get(component)
+        if cached is not None and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime_ns:
+            component_hash = cached['hash']
+        else:
+            component_digest = hashlib.sha256()
+            with open(component, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    component_digest.update(block)
+            component_hash = component_digest.hexdigest()
+            file_cache[component] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': component_hash}
+
+        digest.update(os.path.basename(component).encode())
+        digest.update(component_hash.encode())
+    return digest.hexdigest()
+
+def load_manifest():
+    if os.path.isfile(stage_manifest):
+        with open(stage_manifest) as f:
+            return json.load(f)
+    return {'stages': {}, 'files': {}}
+
+def save_manifest(manifest):
+    if not os.path.exists(modelRunsDir):
+        os.makedirs(modelRunsDir)
+    tmp_file = stage_manifest + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, stage_manifest)
+
+def stage_dependencies(stages):
+    """Return a dictionary with the names of the stages each stage depends on (the producers of its inputs)."""
+    producers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            producers[os.path.normpath(output)] = stage.name
+
+    dependencies = {}
+    for stage in stages:
+        dependencies[stage.name] = sorted({producers[os.path.normpath(i)] for i in stage.inputs
+                                           if os.path.normpath(i) in producers} - {stage.name})
+    return dependencies
+
+def topological_order(stages, dependencies):
+    """Sort the stages so that every stage comes after the stages it depends on."""
+    by_name = {stage.name: stage for stage in stages}
+    ordered, visiting, visited = [], set(), set()
+
+    def visit(name):
+        if name in visited:
+            return
+        if name in visiting:
+            raise Exception('ERROR: circular dependency between stages involving ' + name)
+        visiting.add(name)
+        for dependency in dependencies[name]:
+            visit(dependency)
+        visiting.discard(name)
+        visited.add(name)
+        ordered.append(by_name[name])
+
+    for stage in stages:
+        visit(stage.name)
+    return ordered
+
+def downstream_stages(stages, names):
+    """Names of the given stages and of all the stages depending on them, directly or not."""
+    dependencies = stage_dependencies(stages)
+    selected = set(names)
+    for stage in topological_order(stages, dependencies):
+        if any(d in selected for d in dependencies[stage.name]):
+            selected.add(stage.name)
+    return selected
+
+def stage_keys(stages, parameters, dependencies, file_cache, upstream_keys=None):
+    """Compute the key of every stage from its code, parameters and inputs. upstream_keys gives the keys of the
+    stages outside 'stages' by the (normalised) paths of their outputs: inputs found there aren't hashed."""
+    producers = {os.path.normpath(output): stage.name for stage in stages for output in stage.outputs}
+    upstream_keys = upstream_keys or {}
+    keys = {}
+    for stage in topological_order(stages, dependencies):
+        digest = hashlib.sha256()
+        digest.update(stage.name.encode())
+        digest.update(code_hash(stage.func).encode())
+        digest.update(json.dumps({p: parameters[p] for p in stage.params}, sort_keys=True, default=str).encode())
+        for path in sorted(os.path.normpath(i) for i in stage.inputs):
+            digest.update(path.encode())
+            if path in producers and producers[path] != stage.name:
+                digest.update(keys[producers[path]].encode())
+            elif path in upstream_keys:
+                digest.update(upstream_keys[path].encode())
+            else:
+                digest.update(file_hash(path, file_cache).encode())
+        keys[stage.name] = digest.hexdigest()
+    return keys
+
+def out_of_date(stages, keys, manifest):
+    """Names of the stages whose key changed since their last run or whose outputs are missing."""
+    stale = set()
+    for stage in stages:
+        record = manifest['stages'].get(stage.name)
+        if record is None or record['key'] != keys[stage.name] \
+                or not all(os.path.exists(output) for output in stage.outputs):
+            stale.add(stage.name)
+    return stale
+
+def selected_upstream_keys(stages, selected, manifest):
+    """Keys of the stages that are not selected, by the paths of their outputs, as recorded at their last run.
+    Raise an exception if an output read by a selected stage is missing."""
+    producers = {os.path.normpath(output): stage for stage in stages for output in stage.outputs}
+    for stage in stages:
+        if stage.name not in selected:
+            continue
+        for path in stage.inputs:
+            producer = producers.get(os.path.normpath(path))
+            if producer is not None and producer.name not in selected and not os.path.exists(path):
+                raise Exception('ERROR: ' + path + ' (read by stage ' + stage.name + ') is missing: run stage '
+                                + producer.name + ' first')
+
+    upstream_keys = {}
+    for stage in stages:
+        record = manifest['stages'].get(stage.name)
+        if stage.name not in selected and record is not None:
+            for output in stage.outputs:
+                upstream_keys[os.path.normpath(output)] = record['key']
+    return upstream_keys
+
+def run_stages(stages, parameters, workers=1, initializer=None, initargs=(), selected=None, upstream_keys=None):
+    """Run the out of date stages of the graph, up to 'workers' independent stages at a time.
+    If 'selected' is given (names of stages), only those stages are run, whether they're out of date or not: the
+    other stages are neither run nor checked, and their outputs are read as they are.
+    upstream_keys gives the keys of stages run elsewhere, by the paths of their outputs (see stage_keys).
+    If given, initializer(*initargs) is called once in every process running stages.
+    The telemetry of the stages run is written to the run report (see telemetry.py)."""
+    manifest = load_manifest()
+    if selected is not None:
+        unknown = set(selected) - {stage.name for stage in stages}
+        if unknown:
+            raise Exception('ERROR: unknown stages ' + ', '.join(sorted(unknown)))
+        upstream_keys = dict(upstream_keys or {}, **selected_upstream_keys(stages, selected, manifest))
+        stages = [stage for stage in stages if stage.name in selected]
+
+    dependencies = stage_dependencies(stages)
+    keys = stage_keys(stages, parameters, dependencies, manifest['files'], upstream_keys)
+    stale = out_of_date(stages, keys, manifest) if selected is None else {stage.name for stage in stages}
+    save_manifest(manifest)  # store the file hashes computed for the keys
+
+    order = [stage.name for stage in topological_order(stages, dependencies)]
+    for name in order:
+        if name not in stale:
+            print('Stage', name, 'is up to date.')
+    print()
+
+    # Create the output directories if they don't exist
+    for stage in stages:
+        for output in stage.outputs:
+            directory = os.path.dirname(output)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+
+    by_name = {stage.name: stage for stage in stages}
+    done = {stage.name for stage in stages} - stale
+    pending = set(stale)
+    profile_dir = profiles_dir if parameters.get("profile") else None
+    report = {'started': time.time(), 'workers': workers, 'parameters': parameters,
+              'selected': sorted(selected) if selected is not None else None,
+              'up_to_date': [name for name in order if name not in stale], 'stages': []}
+
+    def ready_stages():
+        return [name for name in order if name in pending and all(d in done for d in dependencies[name])]
+
+    def stage_completed(name, record):
+        pending.discard(name)
+        done.add(name)
+        manifest['stages'][name] = {'key': keys[name], 'outputs': by_name[name].outputs}
+        save_manifest(manifest)
+        print(telemetry.stage_summary(record))
+        print()
+        report['stages'].append(record)
+        telemetry.save_report(report, run_report)
+
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        while pending:
+            for name in ready_stages():
+                print('Running stage', name)
+                stage_completed(name, telemetry.run_stage(by_name[name], parameters, profile_dir))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+            running = {}
+            while pending:
+                for name in ready_stages():
+                    if name not in running.values() and len(running) < workers:
+                        print('Running stage', name)
+                        running[executor.submit(telemetry.run_stage, by_name[name], parameters, profile_dir)] = name
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    stage_completed(name, future.result())  # future.result() raises the stage exception, if any
+
+    report['finished'] = time.time()
+    report['wall_s'] = report['finished'] - report['started']
+    telemetry.save_report(report, run_report)
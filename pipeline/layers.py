@@ -0,0 +1,74 @@
+"""
+layers.py
+
+In-process registry of the vector layers read by the stages. Each layer is read from file once and kept in memory
+(together with its spatial index, built the first time it's used) so that the following reads of the same file are
+served from memory. A layer is read again if its file has been rewritten in the meantime. When the layers held exceed
+the memory budget, the least recently used ones are evicted.
+
+The layers returned are shared: callers that modify a layer must work on a copy (read_layer(path, copy=True)).
+"""
+import os
+from collections import OrderedDict
+
+import numpy as np
+import shapely
+
+import storage
+
+memory_budget = 2048 * 2**20 # bytes, see set_memory_budget
+
+_layers = OrderedDict() # path -> (file signature, GeoDataFrame, estimated size in bytes)
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+def set_memory_budget(megabytes):
+    """Set the maximum memory (in MB) taken by the layers held in the registry (0 disables the registry)."""
+    global memory_budget
+    memory_budget = megabytes * 2**20
+    _evict()
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+def layer_size(gdf):
+    """Estimate of the memory taken by a GeoDataFrame: attribute columns plus geometries (coordinates and per-object
+    overhead)."""
+    attributes_size = gdf.drop(columns=gdf.geometry.name).memory_usage(deep=True).sum()
+    geometries = gdf.geometry.values
+    geometries_size = 16 * np.sum(shapely.get_num_coordinates(geometries)) + 100 * len(geometries)
+    return int(attributes_size + geometries_size)
+
+def _evict():
+    total = sum(size for _, _, size in _layers.values())
+    # The most recently used layer is always kept, even if it doesn't fit in the budget on its own
+    while len(_layers) > 1 and total > memory_budget or memory_budget <= 0 and _layers:
+        _, (_, _, size) = _layers.popitem(last=False)
+        total -= size
+        _stats['evictions'] += 1
+
+def read_layer(path, copy=False):
+    """Return the GeoDataFrame of a vector file (any format handled by storage.py), reading it only if it's not already held in the registry."""
+    key = os.path.normpath(path)
+    signature = _file_signature(path)
+
+    cached = _layers.get(key)
+    if cached is not None and cached[0] == signature:
+        _layers.move_to_end(key)
+        _stats['hits'] += 1
+        gdf = cached[1]
+    else:
+        gdf = storage.read_vector(path)
+        _stats['misses'] += 1
+        _layers[key] = (signature, gdf, layer_size(gdf))
+        _evict()
+
+    return gdf.copy() if copy else gdf
+
+def clear():
+    """Remove all the layers from the registry."""
+    _layers.clear()
+
+def cache_info():
+    """Number of hits, misses and evictions of the registry and memory currently taken by the layers held."""
+    return dict(_stats, layers=len(_layers), size=sum(size for _, _, size in _layers.values()))
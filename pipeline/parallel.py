@@ -0,0 +1,50 @@
+"""
+parallel.py
+
+Execution of the per-district tasks of a stage on a pool of processes. The districts are independent, so each task
+reads its inputs, writes its own district files and returns its result; results are returned in the order of the
+districts, whatever the order the tasks complete in. The workers report their memory peak with every result, so
+that the stage telemetry measures the peak of the stage's own workers.
+"""
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from pipeline import layers, telemetry
+
+def _init_worker(memory_budget, shared_layers):
+    telemetry.reset_peak_rss()  # forked workers would start from the peak of the stage process
+    layers.memory_budget = memory_budget
+    for path in shared_layers:
+        layers.read_layer(path)
+
+def _run_task(task, district):
+    """Result of a task and memory peak of the worker running it."""
+    return task(district), telemetry.peak_rss()
+
+def map_districts(func, districts, workers=1, shared_layers=(), **kwargs):
+    """Call func(district, **kwargs) for every district on up to 'workers' processes and return the list of results.
+    shared_layers are the vector files read (read-only) by every task: they are loaded in the layer registry before the
+    workers start, so that forked workers share the parent's copy instead of each reading its own (where processes
+    can't be forked, each worker reads them once when it starts)."""
+    task = functools.partial(func, **kwargs)
+    if workers <= 1 or len(districts) <= 1:
+        return [task(district) for district in districts]
+
+    for path in shared_layers:
+        layers.read_layer(path)
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+        initargs = (layers.memory_budget, ())  # the layers are inherited from this process
+    else:
+        context = multiprocessing.get_context()
+        initargs = (layers.memory_budget, tuple(shared_layers))
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(districts)), mp_context=context,
+                             initializer=_init_worker, initargs=initargs) as executor:
+        results = []
+        for result, peak in executor.map(functools.partial(_run_task, task), districts):
+            telemetry.record_pool_peak(peak)
+            results.append(result)
+        return results
@@ -0,0 +1,1078 @@
+"""
+stages.py
+
+Stages of the model. Each stage is a function reading the files produced by the previous stages (or the model inputs)
+and writing its own outputs. Which stages need to run is decided by the stage graph (see graph.py), so stages don't
+check whether their outputs already exist.
+"""
+import hashlib
+import json
+import os
+
+from config import *
+from globals import *
+import geocomputation as gcpt
+import partitions
+import pointstore
+import prioritisation
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import storage
+
+from pipeline.graph import Stage, code_hash, file_hash
+from pipeline.layers import read_layer
+from pipeline.parallel import map_districts
+
+########################################################################################################################
+# Districts (administrative units) of the model, discovered from the districts layer. The per district files are named
+# after the district names.
+district_field = 'ADM2_EN' # field of the districts layer with the district names
+district_code_field = 'ADM2_PCODE' # field of the districts layer with the district codes
+
+def district_units():
+    """Districts of the districts layer: a Series of district codes indexed by district name, sorted by name."""
+    districts_gdf = read_layer(inputs["SL_Districts"])
+    units = pd.Series(districts_gdf[district_code_field].values, index=districts_gdf[district_field].values,
+                      name='dist_code')
+    return units[~units.index.duplicated()].sort_index()
+
+def district_file(directory, name, suffix=''):
+    """Path of the file of a district (e.g. its agricultural lands)."""
+    return os.path.join(directory, name + suffix + vector_ext)
+
+########################################################################################################################
+# Preprocessing of the 1km Unconstrained WorldPop data to be 100m resolution
+
+def resample_pop_raster(parameters):
+    # Resample the WorldPop raster from 1km resolution to 100m
+    # (the population of each 1km pixel is split evenly among the 100m pixels it's resampled into)
+    gcpt.resample_raster(inputs["WorldPop_1km_raster"], Resampled_pop_raster,
+                         parameters["x_resolution"], parameters["y_resolution"], preserve_sum=True)
+    print("Raster resampling completed.")
+    print()
+
+def pop_raster_to_points(parameters):
+    # Convert the 100m WoldPop raster to a point layer:
+    gcpt.raster_to_shp_point(Resampled_pop_raster, pop_points_shp, 'pop_count',
+                             chunk_rows=parameters["point_chunk_rows"])
+    print('WorldPop raster converted into points')
+    print()
+
+########################################################################################################################
+# CREATION OF GHSL LAYER
+
+# Create the GHSL layer ready to be joined by location (attributes) with 100m population points
+
+def merge_ghsl(parameters):
+    # Merge together the components of the GHSL layer
+    ghsl_to_merge = [inputs["GHSL_raw_1"], inputs["GHSL_raw_2"], inputs["GHSL_raw_3"], inputs["GHSL_raw_4"]]
+
+    print('Merging GHSL input layers...')
+    print()
+    gcpt.merge_raster_files(ghsl_to_merge, ghsl_merged)
+    print('GHSL inputs merged into a single raster file.\n')
+    print()
+
+def reproject_ghsl(parameters):
+    # Convert crs of merged sri lanka file:
+    st_crs = 'EPSG:4326' # WGS84 projection
+    gcpt.reproject_raster(ghsl_merged, st_crs, ghsl_merged_wgs84)
+    print('GHSL raster converted to CRS EPSG:4326.\n')
+    print()
+
+def clip_ghsl(parameters):
+    # Now clip the shape to sri lanka boundaries:
+    districts_shp = read_layer(inputs["SL_Districts"])
+    gcpt.clip_raster_file(ghsl_merged_wgs84, districts_shp, ghsl_merged_clipped)
+    print('GHSL raster clipped to state boundaries and exported as .tif.\n')
+    print()
+
+def polygonize_ghsl(parameters):
+    # Transform the raster GHSL layer into polygons (raw and dissolved layers from the same polygonization)
+    target_classes = parameters["ghsl_target_classes"] # Target classes value to be filtered out during shp creation
+    gcpt.raster_to_shp_poly(ghsl_merged_clipped, ghsl_poly, target_classes, dissolved_output_file=ghsl_poly_dissolved)
+    print('GHSL polygon layers created.')
+    print()
+
+########################################################################################################################
+# INDIVIDUAL DISTRICT FILES CREATION
+
+def split_districts(parameters):
+    # Create individual district boundaries shapefiles
+    # (these will be used later for populations assignment to ag lands and ind districts)
+    print('Creating individual district border shapefiles...')
+    print()
+    # run individual districts polygons creation function:
+    districts_gdf = read_layer(inputs["SL_Districts"])
+    gcpt.split_vector_layer(districts_gdf, district_field, ind_dist_boundaries_filepath, vector_ext)
+
+########################################################################################################################
+# AGRICULTURAL LAND FILES CREATION
+
+def create_ag_lands(parameters):
+    print('Creating agricultural lands shapefile...')
+    print()
+    # bring in the ag lands file and replace the agland types specified with agland categories
+    print('Recategorising agricultural lands.')
+    print()
+
+    # Shall we consider home gardens as agricultural lands? Yes=True, No=False
+    Home_Gardens = parameters["Home_Gardens"]
+    if Home_Gardens == True:
+        agland_types = ['Chena', 'Coconut', 'Other (Mango, etc)', 'Paddy', 'Other plantations', 'Rubber', 'Tea', 'Uncultivated lands', 'Home Garden']
+    else:
+        agland_types = ['Chena', 'Coconut', 'Other (Mango, etc)', 'Paddy', 'Other plantations', 'Rubber', 'Tea', 'Uncultivated lands']
+
+    land_use_gdf = gpd.read_file(inputs["land_use"]) # read geodataframe using geopandas
+
+    # Initialise ag_lands to zero
+    land_use_gdf['ag_lands'] = 0
+
+    # Replace aglands with 1 for all those classified as such
+    for i in agland_types:
+        land_use_gdf.loc[land_use_gdf['LU'] == i,'ag_lands'] = 1
+
+    # Export new gdf to file
+    storage.write_vector(land_use_gdf, ag_lands)
+
+def clip_ag_lands_district(district, attributes):
+    # Union of the agricultural lands of a district, clipped to the district boundary
+    y, partition = district  # district name and positions of the agricultural lands polygons intersecting it
+    district_boundary = read_layer(district_file(ind_dist_boundaries_filepath, y))
+    ag_lands_gdf = read_layer(ag_lands)
+
+    geometry = gcpt.clip_union(ag_lands_gdf.geometry.values[partition], district_boundary.geometry.union_all())
+    if geometry.is_empty:
+        clipped_result = gpd.GeoDataFrame(columns=['geometry'] + list(attributes.index), geometry='geometry',
+                                          crs=ag_lands_gdf.crs)
+    else:
+        clipped_result = gpd.GeoDataFrame({'geometry': [geometry], **{k: [v] for k, v in attributes.items()}},
+                                          crs=ag_lands_gdf.crs)
+
+    # Save the clipped result
+    storage.write_vector(clipped_result, district_file(ind_dists_filepath, y, '_ag_lands'))
+
+    # Extract features with 'ag_lands' equal to 1
+    ag_lands_only = clipped_result[clipped_result['ag_lands'] == 1].copy()
+
+    # Add district name
+    ag_lands_only["dist_name"] = y
+
+    # Save the selection as a separate file
+    storage.write_vector(ag_lands_only, district_file(ag_lands_only_path, y, '_ag_lands_only'))
+
+def clip_ag_lands_to_districts(parameters):
+    # Now clip agricultural lands to each individual district
+    print('Clipping agricultural lands to individual districts...')
+    print()
+
+    os.makedirs(ind_dists_filepath, exist_ok=True)
+    os.makedirs(ag_lands_only_path, exist_ok=True)
+    dist_names = list(district_units().index)
+    dist_boundaries_files = [district_file(ind_dist_boundaries_filepath, y) for y in dist_names]
+
+    # Partition the agricultural lands polygons by district with a single query of the spatial index
+    # (polygons crossing district borders belong to more partitions)
+    ag_lands_gdf = read_layer(ag_lands)
+    district_geoms = [read_layer(path).geometry.union_all() for path in dist_boundaries_files]
+    district_index, polygon_index = ag_lands_gdf.sindex.query(district_geoms, predicate='intersects')
+    is_ag_land = (ag_lands_gdf['ag_lands'] == 1).to_numpy()
+    district_index, polygon_index = district_index[is_ag_land[polygon_index]], polygon_index[is_ag_land[polygon_index]]
+    partitions = [polygon_index[district_index == i] for i in range(len(dist_names))]
+
+    # Attributes of the district layers: the ones of the first agricultural lands polygon (as in a dissolve)
+    attributes = ag_lands_gdf[is_ag_land].drop(columns=ag_lands_gdf.geometry.name)
+    attributes = attributes.groupby(np.zeros(len(attributes))).first().iloc[0]
+
+    # Union and clip the agricultural lands of each district (in parallel)
+    map_districts(clip_ag_lands_district, list(zip(dist_names, partitions)), parameters["district_workers"],
+                  shared_layers=[ag_lands] + dist_boundaries_files, attributes=attributes)
+
+    print('Agricultural lands to individual district clipping completed.')
+    print()
+
+########################################################################################################################
+# Join by attributes, summary of population points to: (a) district boundaries and (b) agricultural lands
+# Join the urban/rural information from GHSL data to the population points
+
+def rural_points(pop_points, ghsl_merged_dissolved, parameters):
+    """Rural population points of a chunk (or tile) of the population points, keeping their index."""
+    if ghsl_merged_dissolved is None:
+        # Look the GHSL class of every point up in the GHSL raster
+        target_classes = parameters["ghsl_target_classes"]
+        ghsl_class = gcpt.sample_raster(ghsl_merged_clipped, pop_points.geometry.x.values, pop_points.geometry.y.values)
+        rural = np.isin(ghsl_class, target_classes)
+        joined_gdf = pop_points[rural].copy()
+        joined_gdf['index_righ'] = 0
+        joined_gdf['LU_class'] = ghsl_class[rural].astype(np.float64)
+    else:
+        # Perform the spatial join
+        joined_gdf = gpd.sjoin(pop_points, ghsl_merged_dissolved, how="inner", predicate="intersects")
+        # Keep the shapefile name of the join index field (it's in the ag-dep population output, and
+        # 'index_right' would clash with the following spatial joins)
+        joined_gdf = joined_gdf.rename(columns={'index_right': 'index_righ'})
+    return joined_gdf
+
+def map_points(chunks, func, parameters, stage_name):
+    """Generator of func(points) over chunks of points: chunk by chunk, or tile by tile in partitioned mode (see the
+    point_tile_size parameter and partitions.py), with the results in the order of the points in both cases."""
+    if parameters["point_tile_size"] > 0:
+        return partitions.map_tiles(chunks, func, parameters["point_tile_size"], os.path.join(spill_dir, stage_name))
+    return (func(chunk) for chunk in chunks)
+
+def join_rural_points(parameters):
+    # Filter out urban population:
+    print('Joining land types to population points...')
+    print()
+    ghsl_merged_dissolved = read_layer(ghsl_poly_dissolved) if parameters["rural_classification"] != 'pixels' else None
+    # The population points are read, joined and written a chunk (or tile) at a time
+    chunks = storage.read_vector_chunks(pop_points_shp, parameters["point_chunk_size"])
+    rural_chunks = map_points(chunks, lambda points: rural_points(points, ghsl_merged_dissolved, parameters),
+                              parameters, 'rural-points')
+    storage.write_vector_chunks(rural_chunks, rur_points_shp)
+
+def build_pop_store(parameters):
+    # Population cells store (see pointstore.py) with the rural flag, district, DSD and GHSL class of every cell, used by
+    # the points engine
+    print('Creating the population cells store...')
+    print()
+    blocks = list(gcpt.raster_values(Resampled_pop_raster, parameters["point_chunk_rows"]))
+    x, y, pop = [np.concatenate([block[k] for block in blocks]) for k in range(3)]
+    districts_gdf = read_layer(inputs["SL_Districts"])
+    dsd_gdf = read_layer(inputs["SL_DSD"])
+    store = pointstore.create_store(x, y, pop, districts_gdf.crs, districts_gdf[district_field], dsd_gdf['ADM3_PCODE'])
+
+    # GHSL class of every cell
+    store['ghsl_class'][:] = gcpt.sample_raster(ghsl_merged_clipped, x, y)
+    if parameters["rural_classification"] == 'pixels':
+        store['rural'][:] = np.isin(store['ghsl_class'], parameters["ghsl_target_classes"])
+    else:
+        # Cells within the GHSL rural polygons
+        for geom in read_layer(ghsl_poly_dissolved).geometry.values:
+            store['rural'][store.query_polygon(geom)] = True
+
+    # District and DSD of every cell (the first one for the cells on a boundary)
+    for column, zones_gdf in [('district', districts_gdf), ('dsd', dsd_gdf)]:
+        labels = store[column]
+        for k, geom in enumerate(zones_gdf.geometry.values):
+            index = store.query_polygon(geom)
+            labels[index[labels[index] == -1]] = k
+
+    pointstore.write_store(store, pop_store)
+
+def create_rural_pop_raster(parameters):
+    # Rural population raster (population pixels within the GHSL rural classes), used by the raster engine
+    if parameters["rural_classification"] == 'pixels':
+        gcpt.mask_raster_by_classes(Resampled_pop_raster, ghsl_merged_clipped, parameters["ghsl_target_classes"],
+                                    Rural_pop_raster)
+    else:
+        ghsl_merged_dissolved = read_layer(ghsl_poly_dissolved)
+        gcpt.mask_raster(Resampled_pop_raster, ghsl_merged_dissolved, Rural_pop_raster)
+    print('Rural population raster created.')
+    print()
+
+def label_pop_raster(parameters):
+    # District, DSD and GHSL class of every cell of the population raster, used by the raster engine (the points engine
+    # keeps them in the population cells store)
+    print('Labelling the population cells with their district, DSD and GHSL class...')
+    print()
+    labels = {'district': gcpt.zone_labels(read_layer(inputs["SL_Districts"]), Resampled_pop_raster),
+              'dsd': gcpt.zone_labels(read_layer(inputs["SL_DSD"]), Resampled_pop_raster),
+              'ghsl_class': gcpt.reproject_to_grid(ghsl_merged_clipped, Resampled_pop_raster)}
+    gcpt.write_label_raster(Resampled_pop_raster, labels, Pop_labels_raster)
+
+def sum_pop_groups(parameters):
+    # Total and rural population of the cells of every district, DSD and GHSL class: the district totals are grouped
+    # sums of this table (a single pass over the cells instead of one per district)
+    print('Summing the population by district, DSD and GHSL class...')
+    print()
+    if parameters["pop_engine"] == 'raster':
+        groups = gcpt.grouped_sums(Pop_labels_raster, {'pop': Resampled_pop_raster, 'rur_pop': Rural_pop_raster},
+                                   parameters["point_chunk_rows"])
+        districts = read_layer(inputs["SL_Districts"])[district_field]
+        dsds = read_layer(inputs["SL_DSD"])['ADM3_PCODE']
+    else:
+        store = pointstore.open_store(pop_store)
+        pop = store['pop'].astype(np.float64)
+        cells = pd.DataFrame({'district': store['district'], 'dsd': store['dsd'], 'ghsl_class': store['ghsl_class'],
+                              'pop': pop, 'rur_pop': np.where(store['rural'], pop, 0.0)})
+        groups = cells.groupby(['district', 'dsd', 'ghsl_class'], as_index=False).sum()
+        districts, dsds = store.districts, store.dsds
+
+    # District and DSD names in place of their ids (empty for the cells outside all of them)
+    groups['district'] = pd.Series(list(districts), dtype=object).reindex(groups['district']).to_numpy()
+    groups['dsd'] = pd.Series(list(dsds), dtype=object).reindex(groups['dsd']).to_numpy()
+    groups.to_csv(pop_groups_csv, index=False)
+
+def agland_rural_pop_task(y, pop_engine):
+    print('Joining ag populations to individual aglands boundaries (rural only) for', y)
+    print()
+
+    # Load the district agricultural lands
+    district_gdf = read_layer(district_file(ag_lands_only_path, y, '_ag_lands_only'), copy=True)
+
+    if pop_engine == 'raster':
+        # Sum the rural population pixels within the agricultural lands
+        district_rural_pop = gcpt.zonal_sum(Rural_pop_raster, district_gdf).sum()
+    else:
+        # Sum the rural population cells within the agricultural lands (cells within more lands count for each)
+        district_rural_pop = pointstore.open_store(pop_store).polygons_sum(district_gdf.geometry.values,
+                                                                           where='rural').sum()
+
+    # Store the agricultural lands rural population in a new field of the district_gdf
+    district_gdf['agland_pop'] = district_rural_pop
+    district_gdf = district_gdf[['GFCODE', 'NAME_1', 'LU', 'Name', 'ag_lands', 'geometry', 'agland_pop']]  # Filter only the useful fields
+    storage.write_vector(district_gdf, district_file(ind_dists_filepath, y, '_aglands_rur_pop'))
+
+def agland_rural_pop(parameters):
+    # POPULATION WITHIN AGRICULTURAL LAND FILES
+    pop_engine = parameters["pop_engine"]
+    os.makedirs(ind_dists_filepath, exist_ok=True)
+    map_districts(agland_rural_pop_task, list(district_units().index), parameters["district_workers"],
+                  pop_engine=pop_engine)
+
+########################################################################################################################
+# COMPARISON BETWEEN DISTRICT LEVEL STATISTICS AND GENERATED LOCAL POPULATION COUNTS
+
+def compare_pop_counts(parameters):
+    threshold = parameters["threshold"] # Acceptable % difference among pop counts
+
+    # Join dataframes together at the district level so each observation is a district
+    # variables in this dataframe are:
+    # (1) district population
+    # (2) agland population
+    # (3) % agland population
+    # (4) hies estimate for ag population (%)
+    # (5) % difference between aglands population & hies
+
+    print('Starting comparison among local and global pop counts.')
+    print()
+
+    # create dataframe for population values
+    pop_df = pd.DataFrame(columns=['dist_names', 'dist_pop', 'ag_lands_pop'])
+
+    units = district_units()
+    dist_names = list(units.index) # district names
+    ag_lands_pop = [] # district population within agricultural lands
+
+    # District total and rural populations: grouped sums of the population by district, DSD and GHSL class
+    district_pops = pd.read_csv(pop_groups_csv).groupby('district')[['pop', 'rur_pop']].sum()
+    district_pops = district_pops.reindex(dist_names, fill_value=0.0)
+
+    for y in dist_names:
+        ag_lands_pop_dbf = district_file(ind_dists_filepath, y, '_aglands_rur_pop') # agricultural lands polygons file path
+        t_ag_lands_pop_dbf = storage.read_vector(ag_lands_pop_dbf, ['agland_pop']) # import only the fields needed
+        pdf_ag_lands_pop = pd.DataFrame(t_ag_lands_pop_dbf) # turn the geopandas object into a pandas dataframe
+        ag_lands_pop.append(pdf_ag_lands_pop['agland_pop'].values[0]) # append the population count within agricultural lands to the ag_lands_pop list
+
+    # Add hies data
+    hies_df = pd.read_csv(inputs["hies_pop_csv"]) # read the aggregate (district level) agricultural dependent population from csv
+
+    # Make column with matching name
+    hies_df['dist_names'] = hies_df['ADM2_EN']
+    # Replace Numwara Eliya which has a wrong spelling with a "-" instead of a space
+    hies_df.loc[hies_df['dist_names'] == 'Nuwara-eliya', 'dist_names'] = 'Nuwara Eliya'
+
+    # Filter only the relevant columns
+    hies_df = hies_df[['dist_names', 'pop_ag_ind_or_ag_income_1plus', 'pop_ag_reliant_income']]
+
+    # Populate the pop_df with the lists from the previous loop (population counts)
+    pop_df['dist_names'] = dist_names
+    pop_df['dist_pop'] = district_pops['pop'].values
+    #pop_df['dist_pop'] = pop_df['dist_pop'].astype(np.int64)
+    pop_df['dist_rur_pop'] = district_pops['rur_pop'].values
+    pop_df['ag_lands_pop'] = ag_lands_pop
+    pop_df['dist_code'] = units.values
+
+    # join the hies data merging on district name
+    pop_df = pd.merge(pop_df, hies_df, on='dist_names', how='left')
+
+    pop_df['hies_ag_dep_pop_%'] = pop_df['pop_ag_ind_or_ag_income_1plus'] / 100  # % of agricultural dependent population - HIES data (column N) - new one to use
+
+    # Create stats on comparison between hies ag land pop
+    pop_df['aglands_pop_%'] = pop_df['ag_lands_pop'] / pop_df['dist_pop']  # Turning the population count in agricultural lands into a %
+
+    pop_df['diff_hies_aglands_%'] = pop_df['aglands_pop_%'] - pop_df['hies_ag_dep_pop_%']  # calculating difference between aggregate input data and disaggregate modelled data (column N) for agricultural lands polygons buffers
+
+    pop_df['use_aglands?'] = ''
+
+    pop_df.loc[(pop_df['diff_hies_aglands_%'] > threshold), 'use_aglands?'] = 'too big'
+    pop_df.loc[(pop_df['diff_hies_aglands_%'] < - threshold), 'use_aglands?'] = 'too small'
+
+    # Identify agricultural lands population counts whose difference aggregate/disaggregate is < 10%
+    pop_df.loc[(pop_df['diff_hies_aglands_%'] < threshold) & (pop_df['diff_hies_aglands_%'] > -threshold), 'use_aglands?'] = 'OK'
+
+    # export dataframe to excel file
+    # pop_df.to_excel(map_intermediate + 'pop_df_hies_no_hg.xlsx', index=True)
+
+    # export dataframe to csv
+    pop_df.to_csv(pop_count_comparison_csv)
+
+########################################################################################################################
+# BUFFER GENERATION
+
+deg_per_metre = 0.00001 / 1.11 # conversion of buffer radii from metres to degrees
+
+def district_rural_cells(district_geom, pop_engine):
+    """Coordinates and population (x, y, pop) of the rural population cells within a district."""
+    if pop_engine == 'raster':
+        return gcpt.raster_cells(Rural_pop_raster, district_geom)
+
+    store = pointstore.open_store(pop_store)
+    index = store.query_polygon(district_geom)
+    index = index[store['rural'][index]]
+    return store['x'][index], store['y'][index], store['pop'][index].astype(np.float64)
+
+def solve_buffer_radius(signed_dist, pop, direction, r_increment, hies_pop_ag_dep, hies_dist_pop, dist_rur_pop, threshold):
+    """Return the smallest buffer radius (100m, 100m + r_increment, ...) that makes the population within the buffer of
+    the agricultural lands match the HIES agricultural dependent population. direction is 1 for outward buffers
+    ('too small' districts) and -1 for inward buffers ('too big' districts).
+    The population within a buffer of radius r is the population of the cells whose signed distance from the agricultural
+    lands is <= r (outward) or <= -r (inward): with the distances sorted, it's a lookup in their cumulative sum."""
+    order = np.argsort(signed_dist)
+    sorted_dist = signed_dist[order]
+    cum_pop = np.concatenate([[0.0], np.cumsum(pop[order])])
+
+    # Largest radius that needs checking: beyond it the buffer population doesn't change any more
+    # (all the cells are within the outward buffer, or none is within the inward buffer)
+    extreme = (sorted_dist[-1] if direction == 1 else -sorted_dist[0]) if len(sorted_dist) > 0 else 0
+    n_radii = max(int(np.ceil((extreme / deg_per_metre - 100) / r_increment)), 0) + 2
+    radii = 100 + r_increment * np.arange(n_radii)
+
+    buffer_pop_count = cum_pop[np.searchsorted(sorted_dist, direction * radii * deg_per_metre, side='right')]
+
+    if direction == 1:
+        buffer_ok = (buffer_pop_count / hies_dist_pop) - hies_pop_ag_dep > -threshold # '> -threshold' means buffer ok
+    else:
+        buffer_ok = (buffer_pop_count / hies_dist_pop) - hies_pop_ag_dep < threshold # '< threshold' means buffer ok
+    # whole rural population already contained in the buffer (with a threshold error acceptance)
+    buffer_ok |= np.abs(buffer_pop_count - dist_rur_pop) < threshold
+
+    if not buffer_ok.any():
+        raise Exception('ERROR: no buffer radius matches the HIES population. Check the pop counts csv file.')
+    return int(radii[np.argmax(buffer_ok)])
+
+def agland_buffer_task(district, pop_engine, r_increment, threshold):
+    """Find the buffer radius of a district, save its buffer and return the radius (negative for inward buffers)."""
+    y, use_aglands, hies_pop_ag_dep, hies_dist_pop, dist_rur_pop = district
+    direction = 1 if use_aglands == 'too small' else -1 # 'too big': inward buffer
+
+    aglands = read_layer(district_file(ag_lands_only_path, y, '_ag_lands_only'))
+    district_boundary = read_layer(district_file(ind_dist_boundaries_filepath, y))
+
+    # Signed distance of every rural population cell of the district from its agricultural lands
+    # (the buffers are clipped to the district boundaries, so only the cells within the district count)
+    x, y_coords, pop = district_rural_cells(district_boundary.geometry.union_all(), pop_engine)
+    signed_dist = gcpt.signed_distances(x, y_coords, aglands.geometry.union_all())
+
+    buffer_radius = solve_buffer_radius(signed_dist, pop, direction, r_increment, hies_pop_ag_dep, hies_dist_pop,
+                                        dist_rur_pop, threshold)
+    print('Creating ' + str(direction * buffer_radius) + 'm buffer on ag lands for district: ' + y)
+    print()
+
+    # Buffer creation
+    d_buffer = aglands['geometry'].buffer(direction * buffer_radius * deg_per_metre)
+    d_buffer.name = 'geometry'
+    buffered_gdf = gpd.GeoDataFrame(d_buffer, crs="EPSG:4326", geometry='geometry')
+    buffered_gdf['dist_name'] = y
+    buffered_gdf = buffered_gdf.dissolve()
+
+    # Save to file the generated buffer
+    storage.write_vector(buffered_gdf, district_file(buffers_path, y, '_ag_lands_' + str(direction * buffer_radius) + 'm_buffer'))
+
+    return direction * buffer_radius
+
+def create_agland_buffers(parameters):
+    threshold = parameters["threshold"] # Acceptable % difference among pop counts
+    pop_engine = parameters["pop_engine"]
+
+    print("Creating agricultural lands buffers...")
+    print()
+    if not os.path.exists(buffers_path):
+        os.makedirs(buffers_path)
+    # According to the information contained in the csv file created in the previous section (comparison between global
+    # and local pop counts), different buffers will be created:
+    # (indexed by district name)
+    pop_df = pd.read_csv(pop_count_comparison_csv).set_index('dist_names')
+
+    r_increment = parameters["r_increment"] # progressive increment of buffer radius (in metres)
+
+    # Final buffer radius of every district, initialised with zero values
+    units = district_units()
+    buffer_radii = pd.Series(0, index=units.index)
+
+    # Districts needing a buffer with their population counts
+    districts = []
+    for y, district in pop_df.loc[units.index].iterrows():
+        use_aglands = district['use_aglands?']
+        if use_aglands == 'OK':
+            continue
+        elif use_aglands not in ['too small', 'too big']:
+            raise Exception('ERROR: something went wrong! Check the values of the use_aglands? column of pop counts csv file.')
+
+        # check value from HIES ag pop (ag dep pop, tot pop and rur pop of district y)
+        districts.append((y, use_aglands, district['hies_ag_dep_pop_%'], district['dist_pop'], district['dist_rur_pop']))
+
+    # Find the buffer radius of each district (in parallel)
+    radii = map_districts(agland_buffer_task, districts, parameters["district_workers"], pop_engine=pop_engine,
+                          r_increment=r_increment, threshold=threshold)
+    buffer_radii[[district[0] for district in districts]] = radii
+
+    # Create Pandas data frame (df row=district, df column=buffer radius)
+    buffer_r_df = pd.DataFrame({'buffer_radius': buffer_radii.values, 'district_name': units.index,
+                                'dist_code': units.values})
+    # Export data frame to csv
+    buffer_r_df.to_csv(agland_buffers_radii_csv)
+
+def merge_agland_buffers(parameters):
+    # Now let's create an agricultural dependent population layer by overlapping the rural population and the buffers
+    # Read final buffer radii dimensions from csv file
+    buffer_radii = pd.read_csv(agland_buffers_radii_csv, usecols=['district_name', 'buffer_radius'],
+                               index_col='district_name')['buffer_radius']
+
+    # Merge the buffers into a single layer to be overlapped to the rural pop layer
+    # Create a list of input files. Select different files according to the buffer radius
+    input_layers_list = []
+    for y in district_units().index:
+        b_r = buffer_radii[y] # numeric value of buffer
+        if b_r == 0:
+            input_layers_list.append(district_file(ag_lands_only_path, y, '_ag_lands_only'))
+        elif b_r > 0 or b_r < 0:
+            input_layers_list.append(district_file(buffers_path, y, '_ag_lands_' + str(b_r) + 'm_buffer'))
+        else: raise Exception('ERROR: something went wrong! Check agland_buffers_radii_csv values data type.')
+
+    print('Merging buffer layers...')
+    print()
+    # Load all input layers into a list of GeoDataFrames
+    input_gdfs = [storage.read_vector(layer) for layer in input_layers_list]
+
+    # Concatenate (merge) the GeoDataFrames into a single GeoDataFrame
+    merged_gdf = gpd.GeoDataFrame(pd.concat(input_gdfs, ignore_index=True), crs=input_gdfs[0].crs)
+
+    # Create a spatial index
+    merged_gdf.sindex
+
+    # Save the merged GeoDataFrame to the output file
+    storage.write_vector(merged_gdf, ag_lands_and_buffers)
+    print('Merged buffers layer and spatial index created.')
+    print()
+
+def clip_ag_dep_pop(parameters):
+    # Clip the rural population to ag land + buffer layer
+    print("Clipping rural population to agricultural lands' buffers...")
+    print()
+    # Same points as gpd.clip (the points intersecting the union of the buffers), in the order of the rural points: the
+    # rural points are read, clipped and written a chunk at a time
+    buffers_gdf = read_layer(ag_lands_and_buffers)
+    if parameters["point_tile_size"] > 0:
+        # Partitioned mode: the points of a tile are queried against the spatial index of the buffers (no union)
+        def clip_points(points):
+            point_index, _ = buffers_gdf.sindex.query(points.geometry.values, predicate='intersects')
+            return points.iloc[np.unique(point_index)]
+    else:
+        mask = buffers_gdf.geometry.union_all()
+        shapely.prepare(mask)
+        def clip_points(points):
+            return points[shapely.intersects(mask, points.geometry.values)]
+
+    chunks = storage.read_vector_chunks(rur_points_shp, parameters["point_chunk_size"])
+    storage.write_vector_chunks(map_points(chunks, clip_points, parameters, 'ag-dep-pop'), outputs["ag_dep_pop_shp"])
+
+########################################################################################################################
+# ATTRIBUTION OF AGRICULTURAL DEPENDENT POPULATION TO TANKS
+
+def load_state(path):
+    """State saved by the last run of an incremental stage (None if there's none)."""
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def save_state(state, path):
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_file, path)
+
+def state_key(func, params, files):
+    """Key of the results an incremental stage can reuse: they stay valid as long as the code of the stage, the given
+    parameters and the content of the given files don't change."""
+    digest = hashlib.sha256()
+    digest.update(code_hash(func).encode())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    for path in files:
+        digest.update(file_hash(path, {}).encode())
+    return digest.hexdigest()
+
+def buffer_tanks(tanks_polygons, DSD_zones, tank_buffer):
+    """Buffers of the tanks, with their DSD and district (one buffer per DSD intersected by a tank)."""
+    # Add DSD and District level information: Perform the spatial join
+    tanks_w_dsd = gpd.sjoin(tanks_polygons, DSD_zones, predicate='intersects', how='left')
+    # Only keep fields that we need:
+    tanks_w_dsd = tanks_w_dsd[['Tank_Name', 'Map_id', 'District', 'ASC_', 'GND', 'River_B_na', 'DSD', 'Ownership',
+                               'silt_p', 'max_soil_d', 'cascade', 'renovat', 'functional', 'Shape_Leng_left', # Silt = 0 no silted, Silt = 1 very much silted
+                               'Shape_Area_left', 'geometry', 'ADM3_EN', 'ADM3_PCODE', 'ADM2_EN', 'ADM2_PCODE']]
+    # Create GeoSeries
+    tanks_series = tanks_w_dsd['geometry']
+
+    # Buffer creation
+    t_buffer = tanks_series.buffer(tank_buffer * (0.00001 / 1.11)) # conversion to deg
+    t_buffer.name = 'geometry'
+    buffered_gdf = gpd.GeoDataFrame(t_buffer, crs="EPSG:4326", geometry='geometry')
+    return buffered_gdf.join(tanks_w_dsd.drop('geometry', axis=1))
+
+def create_tanks_buffers(parameters):
+    # Create a buffer around tanks
+    tank_buffer = parameters["tank_buffer"] # tank buffer in metres
+
+    print('Creating tanks buffers...')
+    print()
+
+    tanks_polygons = read_layer(inputs["tanks_polygons"])
+    DSD_zones = read_layer(inputs["SL_DSD"])
+
+    # Hash of each tank (all its polygons) and number of each polygon within its tank, stored with the buffers so that
+    # the next runs can find the tanks that changed
+    tank_hashes = gcpt.feature_hashes(tanks_polygons, 'Map_id')
+    tank_part = tanks_polygons.groupby('Map_id').cumcount()
+    key = state_key(buffer_tanks, {'tank_buffer': tank_buffer}, [inputs["SL_DSD"]])
+    state = load_state(tanks_buffers_state)
+
+    if parameters["tanks_incremental"] and state is not None and state['key'] == key and os.path.isfile(tanks_buffers):
+        # Keep the buffers of the unchanged tanks, buffer the new and edited ones
+        previous_gdf = storage.read_vector(tanks_buffers)
+        kept_gdf = previous_gdf[previous_gdf['Map_id'].map(tank_hashes).values == previous_gdf['tank_hash'].values]
+        changed = ~tanks_polygons['Map_id'].isin(kept_gdf['Map_id'])
+        print('Buffering', tanks_polygons.loc[changed, 'Map_id'].nunique(), 'new or changed tanks out of',
+              len(tank_hashes))
+        print()
+        changed_gdf = buffer_tanks(tanks_polygons[changed], DSD_zones, tank_buffer)
+        changed_gdf['tank_hash'] = changed_gdf['Map_id'].map(tank_hashes)
+        changed_gdf['tank_part'] = tank_part.loc[changed_gdf.index].values
+        buffered_gdf = pd.concat([kept_gdf, changed_gdf], ignore_index=True)
+
+        # Same order as buffering all the tanks: the order of the tanks polygons
+        tank_rows = pd.MultiIndex.from_arrays([tanks_polygons['Map_id'], tank_part])
+        order = tank_rows.get_indexer(pd.MultiIndex.from_arrays([buffered_gdf['Map_id'], buffered_gdf['tank_part']]))
+        buffered_gdf = buffered_gdf.iloc[np.argsort(order, kind='stable')].reset_index(drop=True)
+    else:
+        buffered_gdf = buffer_tanks(tanks_polygons, DSD_zones, tank_buffer)
+        buffered_gdf['tank_hash'] = buffered_gdf['Map_id'].map(tank_hashes)
+        buffered_gdf['tank_part'] = tank_part.loc[buffered_gdf.index].values
+
+    # Create a spatial index
+    buffered_gdf.sindex
+
+    # Save to file
+    storage.write_vector(buffered_gdf, tanks_buffers)
+    save_state({'key': key}, tanks_buffers_state)
+
+def buffers_pop(tanks_buffers_gdf, pop_engine):
+    """Population within each tank buffer (people within more buffers are counted for each of them)."""
+    if pop_engine == 'raster':
+        # Sum the rural population pixels within each tank buffer (tanks buffers overlap each other)
+        return gcpt.zonal_sum(Rural_pop_raster, tanks_buffers_gdf, overlapping=True)
+    # Sum the rural population cells within each tank buffer
+    return pointstore.open_store(pop_store).polygons_sum(tanks_buffers_gdf.geometry.values, where='rural')
+
+def count_tanks_buffers_pop(parameters):
+    # Count served population by each tank
+    pop_engine = parameters["pop_engine"]
+    tank_allocation = parameters["tank_allocation"]
+
+    print('Counting agricultural dependent population within tanks buffers...')
+    print()
+    tanks_buffers_gdf = read_layer(tanks_buffers)
+    result_gdf = tanks_buffers_gdf.drop(columns=['tank_hash', 'tank_part'])
+
+    if tank_allocation == 'nearest':
+        # Voronoi split: every ag-dependent point is served by its nearest tank within the tank buffer
+        # (a tank change moves people from or to its neighbours, so all the tanks are recounted)
+        tanks_polygons = read_layer(inputs["tanks_polygons"])
+        if parameters["point_tile_size"] > 0:
+            # Partitioned mode: the ag-dependent points are read a chunk at a time
+            ag_dep_points = storage.read_vector_chunks(outputs["ag_dep_pop_shp"], parameters["point_chunk_size"])
+        else:
+            ag_dep_points = [read_layer(outputs["ag_dep_pop_shp"])]
+        tanks_pop = gcpt.nearest_allocation(ag_dep_points, 'pop_count', tanks_polygons,
+                                            parameters["tank_buffer"], parameters["metric_crs"])
+        tanks_pop = pd.Series(tanks_pop, index=tanks_polygons['Map_id'].values).groupby(level=0).sum()
+        result_gdf['pop_count'] = tanks_buffers_gdf['Map_id'].map(tanks_pop).fillna(0).values
+
+    else:
+        # Not using Voronoi split: people within more tanks buffers are counted for each of them. The count of a tank
+        # only depends on its own buffers, so in incremental mode only the new and changed tanks are counted.
+        map_ids = tanks_buffers_gdf['Map_id'].values
+        tank_hashes = tanks_buffers_gdf['tank_hash'].values
+        # (the tank hashes only cover the tanks polygons: the buffers also depend on the buffer radius and the DSDs)
+        key = state_key(buffers_pop, {'pop_engine': pop_engine, 'tank_buffer': parameters["tank_buffer"]},
+                        [inputs["SL_DSD"]] +
+                        ([Rural_pop_raster] if pop_engine == 'raster' else pointstore.store_files(pop_store)))
+        state = load_state(tanks_pop_state)
+        counted = {}
+        if parameters["tanks_incremental"] and state is not None and state['key'] == key:
+            counted = state['tanks']
+        known = np.array([counted.get(str(m), [None])[0] == h for m, h in zip(map_ids, tank_hashes)], dtype=bool)
+
+        if not known.all():
+            if known.any():
+                print('Counting the population of', len(set(map_ids[~known])), 'new or changed tanks out of',
+                      len(set(map_ids)))
+                print()
+            # Summarise by Map_id (a tank intersecting more than one DSD has one buffer per DSD)
+            pop = pd.Series(buffers_pop(tanks_buffers_gdf[~known], pop_engine)).groupby(map_ids[~known]).sum()
+            counted = dict(counted, **{str(m): [h, pop[m]] for m, h in zip(map_ids[~known], tank_hashes[~known])})
+
+        result_gdf['pop_count'] = [counted[str(m)][1] for m in map_ids]
+        save_state({'key': key, 'tanks': {str(m): counted[str(m)] for m in map_ids}}, tanks_pop_state)
+
+    # Create a spatial index
+    result_gdf.sindex
+
+    # Save to file
+    result_gdf.to_file(outputs["tanks_buffers_pop"])
+
+def sweep_tank_radii(parameters):
+    # Population within each radius of the sweep of every tank (for a tank within a single DSD, the population counted
+    # by tanks-buffers-pop at every buffer radius, plus the cells between the polygon of the buffer and the exact
+    # radius), from a single query per tank at the largest radius
+    radii = parameters["tank_buffer_sweep"]
+    print('Counting agricultural dependent population within', len(radii), 'radii of the tanks...')
+    print()
+    tanks_polygons = read_layer(inputs["tanks_polygons"])
+
+    if parameters["pop_engine"] == 'raster':
+        # In-memory store of the rural population cells (no district or DSD ids needed)
+        blocks = list(gcpt.raster_values(Rural_pop_raster, parameters["point_chunk_rows"]))
+        x, y, pop = [np.concatenate([block[k] for block in blocks]) for k in range(3)]
+        store, where = pointstore.create_store(x, y, pop), None
+    else:
+        store, where = pointstore.open_store(pop_store), 'rural'
+
+    # Radii in degrees as the tanks buffers, summarised by Map_id (a tank can have more than one polygon)
+    sums = store.radius_sums(tanks_polygons.geometry.values, np.asarray(radii) * deg_per_metre, where=where)
+    sweep_df = pd.DataFrame(sums, columns=['pop_' + str(r) + 'm' for r in radii])
+    sweep_df = sweep_df.groupby(tanks_polygons['Map_id'].values, sort=False).sum()
+    sweep_df.index.name = 'Map_id'
+    sweep_df.to_csv(outputs["tanks_radius_sweep_csv"])
+
+########################################################################################################################
+# CREATION OF PRIORITISATION INDEX
+
+def create_prioritisation_index(parameters):
+    ## Joining small tanks > siltation information > rock structure > rainfall variability
+
+    ## SUPPLY SIDE INDEX CREATION ######################################################################################
+    # Input the tanks polygons
+    tanks_polygons = read_layer(inputs["tanks_polygons"], copy=True)
+
+    # Create scaled version of silt_score
+    tanks_polygons['silt_score'] = tanks_polygons.silt_p / tanks_polygons.silt_p.max()
+
+    # Check it
+    silt_table = tanks_polygons['silt_score'].value_counts()
+    # (1: less than 1 foot, 2: 1-3 feet, 3: more than 3 feet)
+    #print(silt_table)
+    #print()
+
+    # Create a soil erosion normalized score (continuous)
+    tanks_polygons['soil_score'] = tanks_polygons.max_soil_d / tanks_polygons.max_soil_d.max()
+    # Check it
+    soil_table = tanks_polygons['soil_score'].value_counts()
+    #print(soil_table)
+    #print()
+
+    # Create the supply side index
+    tanks_polygons['tank_supply_score'] = tanks_polygons.silt_score * tanks_polygons.soil_score
+    #print(tanks_polygons['tank_supply_score'])
+    #print()
+
+    # Normalise
+    tanks_polygons['supply_index'] = tanks_polygons.tank_supply_score / tanks_polygons.tank_supply_score.max()
+
+    # Check it
+    tank_supply_table = tanks_polygons['supply_index'].value_counts()
+    #print(tank_supply_table)
+    #print()
+
+    # Functionality score generation
+    tanks_polygons['func_score'] = None
+    tanks_polygons['func_score'] = np.where(tanks_polygons['functional']=="Abandoned", 0, np.nan )
+    tanks_polygons.loc[tanks_polygons['functional'] == "Damaged", 'func_score']= 1
+    tanks_polygons.loc[tanks_polygons['functional'] == "Functioning", 'func_score']= 2
+
+    func_table = tanks_polygons['functional'].value_counts()
+    #print(func_table)
+    #print()
+
+    ## DEMAND SIDE INDEX CREATION ######################################################################################
+
+    # Import agricultural dependent population output
+    adp = gpd.read_file(outputs["tanks_buffers_pop"])
+
+    # Create a normalized ag dep pop for weighting at the dsd level
+    adp['norm_adp'] = adp.pop_count / adp.pop_count.max()
+
+    # Check it
+    adp_table = adp['norm_adp'].value_counts()
+    #print(adp_table)
+    #print()
+
+    # Import cov rainfall at tank level
+    cov = gpd.read_file(inputs["cov_rainfall"])
+
+    # Normalise the values
+    cov['norm_cov'] = cov.gridcode_m / cov.gridcode_m.max()
+
+    # Create a new df with only the columns that we need for the following merge
+    cov_filtered = cov[["Map_id", "norm_cov"]]
+
+    # Check it
+    cov_table = cov['norm_cov'].value_counts()
+    # print(cov_table)
+    # print()
+
+    # Join the two datasets together on the Map_id (TankID) variable
+    demand_data = adp.merge(cov_filtered, on="Map_id", how='left')
+    # print(demand_data[['norm_adp', 'norm_cov']])
+    # print()
+
+    # Compute the tank demand index (cov rainfall weighted by adp)
+    demand_data['demand_index'] = demand_data.norm_adp * demand_data.norm_cov
+    # print(demand_data[['norm_adp', 'norm_cov', 'demand_index']])
+    # print()
+
+    ## UTILITY OF REJUVENATION #########################################################################################
+    rock_structure = gpd.read_file(inputs["rock_structure"])
+    # print(rock_structure)
+
+    # Generate pump yield variable
+    rock_structure['pump_yield'] = None
+
+    rock_structure.loc[rock_structure['AquName'] == "Shallow alluvial aquifer", 'pump_yield'] = 920
+    rock_structure.loc[rock_structure['AquName'] == "Deep confined aquifer", 'pump_yield'] = 585
+    rock_structure.loc[rock_structure['AquName'] == "Shallow karstic acquifer", 'pump_yield'] = 400
+    rock_structure.loc[rock_structure['AquName'] == "Shallow sandy aquifer", 'pump_yield'] = 225
+    rock_structure.loc[rock_structure['AquName'] == "Basement regolith aquifer", 'pump_yield'] = 150
+    rock_structure.loc[rock_structure['AquName'] == "Regolith or fractured aquifer", 'pump_yield'] = 75
+    rock_structure.loc[rock_structure['AquName'] == "Laterite (cabook) aquifer", 'pump_yield'] = 70
+
+    # Check it
+    rock_table = rock_structure['pump_yield'].value_counts()
+    # print(rock_table)
+    # print()
+
+    # Generate ranks
+    rock_structure['geo_rank'] = None
+
+    rock_structure.loc[rock_structure['pump_yield'] == 920, 'geo_rank'] = 7
+    rock_structure.loc[rock_structure['pump_yield'] == 585, 'geo_rank'] = 6
+    rock_structure.loc[rock_structure['pump_yield'] == 400, 'geo_rank'] = 5
+    rock_structure.loc[rock_structure['pump_yield'] == 225, 'geo_rank'] = 4
+    rock_structure.loc[rock_structure['pump_yield'] == 150, 'geo_rank'] = 3
+    rock_structure.loc[rock_structure['pump_yield'] == 75, 'geo_rank'] = 2
+    rock_structure.loc[rock_structure['pump_yield'] == 70, 'geo_rank'] = 1
+
+    # Normalise the values
+    rock_structure['n_geo_rank'] = rock_structure.geo_rank / rock_structure.geo_rank.max()
+
+    # Create a new rock_structure df with only the columns we need for the following merge:
+    rock_structure_filtered = rock_structure[['Map_id', 'AquName', 'pump_yield', 'geo_rank', 'n_geo_rank']]
+
+    # Create a new tanks_polygons df with only the columns we need for the following merge:
+    tanks_polygons_filtered = tanks_polygons[['Map_id', 'silt_p', 'max_soil_d', 'geometry', 'silt_score', 'soil_score', 'tank_supply_score', 'supply_index',  'func_score']]
+
+    # Create a new demand data df with only the columns we need for the following merge:
+    demand_data_filtered = demand_data[['Map_id', 'pop_count', 'norm_adp', 'norm_cov', 'demand_index', 'ADM3_PCODE']]
+
+    ## COMBINED INDEX CREATION #########################################################################################
+
+    # Merge this into one df with both demand and supply information
+    tanks_polygons_filtered = tanks_polygons_filtered.merge(demand_data_filtered, on="Map_id", how='left')
+
+    # Create the supply*demand prioritisation index:
+    tanks_polygons_filtered['SuppDem_index'] = tanks_polygons_filtered.demand_index * tanks_polygons_filtered.supply_index
+
+    # Identify the top XXX% SuppDem_index scoring tanks
+    selection = parameters["selection"] # top 10%
+
+    # Filter the df and only keep the selection:
+    tanks_polygons_filtered['Rank'] = tanks_polygons_filtered.SuppDem_index.rank(method='max', ascending=False).astype(int)
+    top_tanks = tanks_polygons_filtered.sort_values('Rank').head(int(selection * tanks_polygons_filtered.shape[0]))
+
+    # Merge the df with the rock structure one:
+    top_tanks = top_tanks.merge(rock_structure_filtered, on="Map_id", how='left')
+
+    # Apply the groundwater recharge (GWR) potential prioritisation on top of the supply*demand index:
+    top_tanks['GWR_Comb_index'] = top_tanks.SuppDem_index * top_tanks.geo_rank
+    top_tanks.GWR_Comb_index = top_tanks.GWR_Comb_index.astype(float)
+
+    # Now we can collapse/group by DSD and District
+    dsd_level_two_part = tanks_polygons_filtered.dissolve(
+                by='ADM3_PCODE',
+                aggfunc={'demand_index': "mean",
+                         'supply_index': "mean",
+                         'SuppDem_index': "mean",
+                         'Map_id': "count"})
+
+    dsd_level_GWR = top_tanks.dissolve(
+        by='ADM3_PCODE',
+        aggfunc={'GWR_Comb_index': "mean",
+                 'Map_id': "count"})
+
+    DSD_zones = read_layer(inputs["SL_DSD"])
+    DSD_zones = DSD_zones[["ADM3_PCODE", "geometry"]]
+
+    dsd_level_two_part = dsd_level_two_part.reset_index()
+    dsd_level_GWR = dsd_level_GWR.reset_index()
+
+    dsd_level_two_part_filtered = dsd_level_two_part[['demand_index', 'supply_index', 'SuppDem_index', 'ADM3_PCODE', 'Map_id']]
+    dsd_level_GWR_filtered = dsd_level_GWR[['GWR_Comb_index', 'ADM3_PCODE', 'Map_id']]
+
+    # Merge to change the output geometry
+    dsd_level_two_part_ng = DSD_zones.merge(dsd_level_two_part_filtered, on='ADM3_PCODE', how='left')
+    dsd_level_GWR_ng = DSD_zones.merge(dsd_level_GWR_filtered, on='ADM3_PCODE', how='left')
+
+    # Drop the DSD areas with no tanks
+    dsd_level_two_part_ng.dropna(inplace=True)
+    dsd_level_GWR_ng.dropna(inplace=True)
+
+    ## EXPORT FILES CREATION ###########################################################################################
+    # Save the DSD level geodataframes to file
+    dsd_level_two_part_ng.to_file(outputs["tanks_two_part_dsd_level"])
+    dsd_level_GWR_ng.to_file(outputs["tanks_GWR_dsd_level"])
+
+    # Create a csv with the DSD level aggregate information
+    dsd_level_two_part_ng.drop('geometry', axis=1).to_csv(outputs["tanks_two_part_dsd_level_csv"])
+    dsd_level_GWR_ng.drop('geometry', axis=1).to_csv(outputs["tanks_GWR_dsd_level_csv"])
+
+    # Export the tank-level dataframes to csv
+    tanks_polygons_filtered.drop('geometry', axis=1).to_csv(outputs["two_part_index_tank_level_csv"])
+    top_tanks.drop('geometry', axis=1).to_csv(outputs["three_part_index_tank_level_csv"])
+
+    # Save to file the tank-level indexes dataframes
+    tanks_polygons_filtered.to_file(outputs["two_part_index_tank_level"])
+    top_tanks.to_file(outputs["three_part_index_tank_level"])
+
+def run_index_scenarios(parameters):
+    # Sensitivity of the prioritisation index: random variants of its weights, selection, normalisation and geo ranks
+    n = parameters["index_scenarios"]
+    print('Evaluating', n, 'prioritisation index scenarios...')
+    print()
+
+    tank_attributes = prioritisation.load_tank_attributes(inputs["tanks_polygons"], outputs["tanks_buffers_pop"],
+                                                          inputs["cov_rainfall"], inputs["rock_structure"])
+    base = prioritisation.base_scenario(parameters)
+    scenarios = prioritisation.sample_scenarios(n, base, parameters["scenario_weight_range"],
+                                                parameters["scenario_selections"], prioritisation.normalisations,
+                                                list(prioritisation.geo_mappings))
+    scenario_results, tank_results = prioritisation.run_scenarios(tank_attributes, scenarios, base)
+
+    print('Median correlation of the scenario ranks with the index ranks:',
+          round(scenario_results.rank_correlation.median(), 3))
+    print()
+
+    scenario_results.to_csv(outputs["index_scenarios_csv"], index_label='scenario')
+    tank_results.to_csv(outputs["index_rank_stability_csv"], index=False)
+
+########################################################################################################################
+# STAGE GRAPH
+
+def build_stages(parameters):
+    """Return the list of stages of the model, with the files each of them reads and writes and the parameters it uses."""
+    # Population layers the population totals are computed on, and layers of the population cells labelled with their
+    # district, DSD and GHSL class (see the pop_engine parameter)
+    if parameters["pop_engine"] == 'raster':
+        rur_pop_layers = [Rural_pop_raster]
+        pop_labels_layers = [Pop_labels_raster, Resampled_pop_raster, Rural_pop_raster, inputs["SL_Districts"],
+                             inputs["SL_DSD"]]
+    else:
+        rur_pop_layers = pop_labels_layers = pointstore.store_files(pop_store)
+
+    # Layers the tanks population is counted on (see the tank_allocation parameter)
+    if parameters["tank_allocation"] == 'nearest':
+        tanks_pop_inputs = [tanks_buffers, inputs["tanks_polygons"], outputs["ag_dep_pop_shp"]]
+        tanks_pop_params = ['tank_allocation', 'tank_buffer', 'metric_crs']
+    else:
+        tanks_pop_inputs = [tanks_buffers, inputs["SL_DSD"]] + rur_pop_layers
+        tanks_pop_params = ['tank_allocation', 'pop_engine', 'tank_buffer', 'tanks_incremental']
+
+    # GHSL layer the population is classified on (see the rural_classification parameter)
+    if parameters["rural_classification"] == 'pixels':
+        ghsl_layer, ghsl_params = ghsl_merged_clipped, ['rural_classification', 'ghsl_target_classes']
+    else:
+        ghsl_layer, ghsl_params = ghsl_poly_dissolved, ['rural_classification']
+
+    ghsl_inputs = [inputs["GHSL_raw_1"], inputs["GHSL_raw_2"], inputs["GHSL_raw_3"], inputs["GHSL_raw_4"]]
+    index_outputs = [outputs["tanks_two_part_dsd_level"], outputs["tanks_GWR_dsd_level"],
+                     outputs["tanks_two_part_dsd_level_csv"], outputs["tanks_GWR_dsd_level_csv"],
+                     outputs["two_part_index_tank_level_csv"], outputs["three_part_index_tank_level_csv"],
+                     outputs["two_part_index_tank_level"], outputs["three_part_index_tank_level"]]
+
+    stages = [
+        Stage('resample-pop', resample_pop_raster, [inputs["WorldPop_1km_raster"]], [Resampled_pop_raster],
+              ['x_resolution', 'y_resolution']),
+        Stage('pop-points', pop_raster_to_points, [Resampled_pop_raster], [pop_points_shp]),
+        Stage('ghsl-merge', merge_ghsl, ghsl_inputs, [ghsl_merged]),
+        Stage('ghsl-reproject', reproject_ghsl, [ghsl_merged], [ghsl_merged_wgs84]),
+        Stage('ghsl-clip', clip_ghsl, [ghsl_merged_wgs84, inputs["SL_Districts"]], [ghsl_merged_clipped]),
+        Stage('district-boundaries', split_districts, [inputs["SL_Districts"]], [ind_dist_boundaries_filepath]),
+        Stage('ag-lands', create_ag_lands, [inputs["land_use"]], [ag_lands], ['Home_Gardens']),
+        Stage('ag-lands-districts', clip_ag_lands_to_districts,
+              [ag_lands, ind_dist_boundaries_filepath, inputs["SL_Districts"]], [ag_lands_only_path]),
+        Stage('rural-points', join_rural_points, [pop_points_shp, ghsl_layer], [rur_points_shp],
+              ghsl_params + ['point_chunk_size', 'point_tile_size']),
+        Stage('pop-groups', sum_pop_groups, pop_labels_layers, [pop_groups_csv], ['pop_engine']),
+        Stage('agland-pop', agland_rural_pop, rur_pop_layers + [ag_lands_only_path, inputs["SL_Districts"]],
+              [ind_dists_filepath], ['pop_engine']),
+        Stage('pop-comparison', compare_pop_counts,
+              [pop_groups_csv, inputs["SL_Districts"], ind_dists_filepath, inputs["hies_pop_csv"]],
+              [pop_count_comparison_csv], ['threshold']),
+        Stage('buffers', create_agland_buffers,
+              [pop_count_comparison_csv, inputs["SL_Districts"], ag_lands_only_path, ind_dist_boundaries_filepath]
+              + rur_pop_layers, [agland_buffers_radii_csv], ['threshold', 'r_increment', 'pop_engine']),
+        Stage('buffers-merge', merge_agland_buffers,
+              [agland_buffers_radii_csv, inputs["SL_Districts"], ag_lands_only_path], [ag_lands_and_buffers]),
+        Stage('ag-dep-pop', clip_ag_dep_pop, [rur_points_shp, ag_lands_and_buffers], [outputs["ag_dep_pop_shp"]],
+              ['point_chunk_size', 'point_tile_size']),
+        Stage('tanks-buffers', create_tanks_buffers, [inputs["tanks_polygons"], inputs["SL_DSD"]], [tanks_buffers],
+              ['tank_buffer', 'tanks_incremental']),
+        Stage('tanks-buffers-pop', count_tanks_buffers_pop, tanks_pop_inputs, [outputs["tanks_buffers_pop"]],
+              tanks_pop_params),
+        Stage('tank-index', create_prioritisation_index,
+              [inputs["tanks_polygons"], outputs["tanks_buffers_pop"], inputs["cov_rainfall"],
+               inputs["rock_structure"], inputs["SL_DSD"]],
+              index_outputs, ['selection']),
+    ]
+
+    if parameters["tank_buffer_sweep"]:
+        stages.append(Stage('tanks-radius-sweep', sweep_tank_radii, [inputs["tanks_polygons"]] + rur_pop_layers,
+                            [outputs["tanks_radius_sweep_csv"]], ['tank_buffer_sweep', 'pop_engine']))
+
+    if parameters["index_scenarios"] > 0:
+        stages.append(Stage('index-scenarios', run_index_scenarios,
+                            [inputs["tanks_polygons"], outputs["tanks_buffers_pop"], inputs["cov_rainfall"],
+                             inputs["rock_structure"]],
+                            [outputs["index_scenarios_csv"], outputs["index_rank_stability_csv"]],
+                            ['index_scenarios', 'selection', 'scenario_weight_range', 'scenario_selections']))
+
+    if parameters["rural_classification"] != 'pixels':
+        stages.append(Stage('ghsl-poly', polygonize_ghsl, [ghsl_merged_clipped], [ghsl_poly, ghsl_poly_dissolved],
+                            ['ghsl_target_classes']))
+
+    if parameters["pop_engine"] == 'points':
+        stages.append(Stage('pop-store', build_pop_store,
+                            [Resampled_pop_raster, ghsl_merged_clipped, ghsl_layer, inputs["SL_Districts"],
+                             inputs["SL_DSD"]],
+                            pointstore.store_files(pop_store), ghsl_params))
+
+    if parameters["pop_engine"] == 'raster':
+        stages.append(Stage('rural-pop-raster', create_rural_pop_raster, [Resampled_pop_raster, ghsl_layer],
+                            [Rural_pop_raster], ghsl_params))
+        stages.append(Stage('pop-labels', label_pop_raster,
+                            [Resampled_pop_raster, ghsl_merged_clipped, inputs["SL_Districts"], inputs["SL_DSD"]],
+                            [Pop_labels_raster]))
+
+    return stages
@@ -0,0 +1,180 @@
+"""
+telemetry.py
+
+Measurements of the stages of the model. Every stage run produces a record with its wall and CPU time, its memory
+peak, the number of rows (features) of the vector files it reads and writes, the size of its input and output files
+and the bytes it actually read and wrote. The records of a run are collected in a JSON report (run_report in
+globals.py). If the 'profile' parameter is set, every stage is also run under cProfile and its profile is saved in
+the profiles folder (one .prof file per stage, to be opened with pstats, snakeviz or turned into a flamegraph).
+The per-district tasks run on process pools are not profiled: set district_workers to 1 to profile them too.
+
+Memory and I/O counters come from the operating system where it provides them (Linux gives per-stage values;
+elsewhere the memory peak is the peak of the whole process and the I/O counters are missing). The memory peak of the
+per-district process pools of a stage is the largest peak reported by their workers (see parallel.py).
+"""
+import cProfile
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from storage import shp_extensions
+
+vector_extensions = ['.shp', '.parquet', '.fgb', '.gpkg', '.dbf']
+
+def _maxrss_bytes(who):
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(who).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024  # kilobytes on Linux
+
+def reset_peak_rss():
+    """Reset the memory peak of this process (Linux only), so that the peak measured afterwards is the stage's."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss():
+    """Memory peak of this process since the last reset (Linux) or since it started."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    return _maxrss_bytes(resource.RUSAGE_SELF)
+
+_pool_peak = None # largest memory peak of the pool workers of the running stage
+
+def record_pool_peak(peak):
+    """Record the memory peak of a process pool worker of the running stage."""
+    global _pool_peak
+    if peak is not None:
+        _pool_peak = peak if _pool_peak is None else max(_pool_peak, peak)
+
+def _io_counters():
+    """Bytes read and written by this process through system calls (Linux only)."""
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def _children_times():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def file_rows(path):
+    """Number of rows of a vector file (features) or of a csv file, None for other files or missing files."""
+    if not os.path.isfile(path):
+        return None
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        if ext == '.parquet':
+            import pyarrow.parquet as pq
+            return pq.read_metadata(path).num_rows
+        if ext in vector_extensions:
+            import pyogrio
+            return pyogrio.read_info(path)['features']
+        if ext == '.csv':
+            with open(path, 'rb') as f:
+                return max(sum(1 for _ in f) - 1, 0)
+    except Exception:
+        return None
+    return None
+
+def _files(paths):
+    """Files of a list of paths, with the files of the folders listed."""
+    for path in paths:
+        if os.path.isdir(path):
+            yield from sorted(os.path.join(path, name) for name in os.listdir(path))
+        else:
+            yield path
+
+def files_bytes(paths):
+    """Total size of files (with all the component files of shapefiles and all the files of folders)."""
+    size = 0
+    for path in _files(paths):
+        root, ext = os.path.splitext(path)
+        components = [root + e for e in shp_extensions] if ext.lower() == '.shp' else [path]
+        size += sum(os.path.getsize(c) for c in components if os.path.isfile(c))
+    return size
+
+def _rows(paths):
+    rows = [file_rows(path) for path in _files(paths)]
+    rows = [r for r in rows if r is not None]
+    return sum(rows) if rows else None
+
+def run_stage(stage, parameters, profile_dir=None):
+    """Run a stage and return its telemetry record. If profile_dir is given, the stage is run under cProfile and its
+    profile is saved in profile_dir/<stage name>.prof."""
+    record = {'stage': stage.name, 'pid': os.getpid(), 'rows_in': _rows(stage.inputs),
+              'bytes_in': files_bytes(stage.inputs)}
+
+    global _pool_peak
+    _pool_peak = None
+    peak_is_per_stage = reset_peak_rss()
+    io_start = _io_counters()
+    children_start = _children_times()
+    cpu_start = time.process_time()
+    record['started'] = time.time()
+    wall_start = time.perf_counter()
+
+    profiler = cProfile.Profile() if profile_dir is not None else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        stage.func(parameters)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(profile_dir, exist_ok=True)
+            record['profile'] = os.path.join(profile_dir, stage.name + '.prof')
+            profiler.dump_stats(record['profile'])
+
+    record['wall_s'] = time.perf_counter() - wall_start
+    record['cpu_s'] = time.process_time() - cpu_start
+    record['children_cpu_s'] = _children_times() - children_start  # district process pools
+    record['peak_rss_bytes'] = peak_rss()
+    record['peak_rss_per_stage'] = peak_is_per_stage
+    record['children_peak_rss_bytes'] = _pool_peak  # None if the stage ran no process pool
+
+    io_end = _io_counters()
+    if io_start is not None and io_end is not None:
+        record['bytes_read'], record['bytes_written'] = io_end[0] - io_start[0], io_end[1] - io_start[1]
+    else:
+        record['bytes_read'] = record['bytes_written'] = None
+
+    record['rows_out'] = _rows(stage.outputs)
+    record['bytes_out'] = files_bytes(stage.outputs)
+    return record
+
+def stage_summary(record):
+    """One line summary of a stage record."""
+    summary = 'Stage %s completed in %.1f s (CPU %.1f s' % (record['stage'], record['wall_s'],
+                                                         record['cpu_s'] + record['children_cpu_s'])
+    if record['peak_rss_bytes'] is not None:
+        summary += ', peak memory %.0f MB' % (record['peak_rss_bytes'] / 2**20)
+    if record['rows_out'] is not None:
+        summary += ', %d rows written' % record['rows_out']
+    return summary + ')'
+
+def save_report(report, path):
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    os.replace(tmp_file, path)
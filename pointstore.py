@@ -0,0 +1,199 @@
+"""
+pointstore.py
+
+Store of the population cells (the 100m population points) as memory-mapped NumPy columns: x, y, pop, rural flag,
+district id, DSD id and GHSL class, one .npy file per column in the store folder, with a meta.json file holding the names of the
+districts and DSDs (the ids are their positions in these lists, -1 for none) and the grid of the spatial index.
+
+The spatial index is a grid of square buckets: 'order' lists the cells bucket by bucket and 'offsets' gives where each
+bucket starts in it. Cells are queried by bounding box or by polygon with coordinate arithmetic and
+shapely.intersects_xy, so no geometry objects are built for them. The columns are opened read-only with mmap: worker
+processes share the operating system's copy of the files instead of each holding their own, and a store costs about
+40 bytes per cell in memory (a GeoDataFrame of points takes several hundred).
+"""
+import json
+import os
+
+import numpy as np
+import shapely
+
+column_types = {'x': np.float64, 'y': np.float64, 'pop': np.float32, 'rural': np.bool_, 'district': np.int16,
+                'dsd': np.int32, 'ghsl_class': np.int16}
+meta_file = 'meta.json'
+
+class PointStore:
+    """Population cells: columns (arrays, memory-mapped for a store opened from its folder), spatial index and meta
+    data (see index_cells)."""
+    def __init__(self, columns, order, offsets, meta):
+        self.columns = columns
+        self.order = order
+        self.offsets = offsets
+        self.meta = meta
+        self.districts = meta['districts']
+        self.dsds = meta['dsds']
+
+    def __len__(self):
+        return len(self.columns['x'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def _bucket_range(self, low, high, origin, n):
+        size = self.meta['bucket_size']
+        return (int(np.clip(np.floor((low - origin) / size), 0, n - 1)),
+                int(np.clip(np.floor((high - origin) / size), 0, n - 1)))
+
+    def query_bbox(self, xmin, ymin, xmax, ymax):
+        """Indices (sorted) of the cells within a bounding box (boundary included)."""
+        if len(self) == 0 or xmax < xmin or ymax < ymin:
+            return np.empty(0, dtype=np.int64)
+        nx, ny = self.meta['nx'], self.meta['ny']
+        bx0, bx1 = self._bucket_range(xmin, xmax, self.meta['x0'], nx)
+        by0, by1 = self._bucket_range(ymin, ymax, self.meta['y0'], ny)
+
+        # The buckets of a row of the grid are contiguous in 'order'
+        candidates = np.concatenate([self.order[self.offsets[by * nx + bx0]:self.offsets[by * nx + bx1 + 1]]
+                                     for by in range(by0, by1 + 1)])
+        x, y = self.columns['x'][candidates], self.columns['y'][candidates]
+        inside = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+        return np.sort(candidates[inside])
+
+    def query_polygon(self, geom):
+        """Indices (sorted) of the cells intersecting a polygon (the cells of a spatial join with 'intersects')."""
+        if geom is None or shapely.is_empty(geom):
+            return np.empty(0, dtype=np.int64)
+        candidates = self.query_bbox(*geom.bounds)
+        shapely.prepare(geom)
+        return candidates[shapely.intersects_xy(geom, self.columns['x'][candidates], self.columns['y'][candidates])]
+
+    def _bucket_boxes(self):
+        """Numbers of the non-empty buckets of the grid and their boxes (widened by a rounding margin, so that they hold
+        every cell of their bucket)."""
+        nx, size = self.meta['nx'], self.meta['bucket_size']
+        buckets = np.flatnonzero(np.diff(self.offsets))
+        bx, by = buckets % nx, buckets // nx
+        margin = size * 1e-9
+        x0, y0 = self.meta['x0'] + bx * size - margin, self.meta['y0'] + by * size - margin
+        return buckets, shapely.box(x0, y0, x0 + size + 2 * margin, y0 + size + 2 * margin)
+
+    def polygons_sum(self, geometries, column='pop', where=None, chunk_size=1 << 22):
+        """Sum of a column over the cells intersecting each polygon (cells within more polygons count for each of them).
+        where is an optional boolean column (e.g. 'rural') selecting the cells summed.
+        All the polygons are queried at once against the boxes of the buckets of the grid (in an STRtree): every
+        (polygon, bucket) pair gives (polygon, cell) candidate pairs, tested with shapely.intersects_xy about chunk_size
+        pairs at a time, and the values of the matching cells are accumulated per polygon with np.bincount."""
+        geometries = np.asarray(geometries, dtype=object)
+        totals = np.zeros(len(geometries), dtype=np.float64)
+        if len(self) == 0 or len(geometries) == 0:
+            return totals
+        buckets, boxes = self._bucket_boxes()
+        pair_polygon, pair_bucket = shapely.STRtree(boxes).query(geometries, predicate='intersects')
+        pair_start = self.offsets[buckets[pair_bucket]]
+        pair_size = self.offsets[buckets[pair_bucket] + 1] - pair_start
+        pair_end = np.cumsum(pair_size)
+        shapely.prepare(geometries)
+        values, x, y = self.columns[column], self.columns['x'], self.columns['y']
+
+        start = 0
+        while start < len(pair_polygon):
+            stop = max(int(np.searchsorted(pair_end, pair_end[start] - pair_size[start] + chunk_size, side='right')),
+                       start + 1)
+            sizes = pair_size[start:stop]
+            # Cells of the pairs: the positions of their buckets in 'order'
+            first = np.cumsum(sizes) - sizes
+            positions = np.arange(sizes.sum()) + np.repeat(pair_start[start:stop] - first, sizes)
+            polygon_index, cells = np.repeat(pair_polygon[start:stop], sizes), self.order[positions]
+            if where is not None:
+                selected = self.columns[where][cells]
+                polygon_index, cells = polygon_index[selected], cells[selected]
+            inside = shapely.intersects_xy(geometries[polygon_index], x[cells], y[cells])
+            totals += np.bincount(polygon_index[inside], weights=values[cells[inside]].astype(np.float64),
+                                  minlength=len(geometries))
+            start = stop
+        return totals
+
+    def radius_sums(self, geometries, radii, column='pop', where=None):
+        """Sum of a column over the cells within each distance of radii (in CRS units) of each geometry (cells within a
+        polygon are at distance 0). Every geometry is queried once, at the largest distance: the cumulative sum of the
+        values of its cells sorted by distance is then looked up at each distance. Returns an array with a row per
+        geometry and a column per distance."""
+        radii = np.asarray(radii, dtype=np.float64)
+        values = self.columns[column]
+        totals = np.zeros((len(geometries), len(radii)), dtype=np.float64)
+        if len(radii) == 0:
+            return totals
+        max_radius = radii.max()
+        for k, geom in enumerate(geometries):
+            if geom is None or shapely.is_empty(geom):
+                continue
+            xmin, ymin, xmax, ymax = geom.bounds
+            index = self.query_bbox(xmin - max_radius, ymin - max_radius, xmax + max_radius, ymax + max_radius)
+            if where is not None:
+                index = index[self.columns[where][index]]
+            distances = shapely.distance(geom, shapely.points(self.columns['x'][index], self.columns['y'][index]))
+            order = np.argsort(distances)
+            cum_values = np.concatenate([[0.0], np.cumsum(values[index][order].astype(np.float64))])
+            totals[k] = cum_values[np.searchsorted(distances[order], radii, side='right')]
+        return totals
+
+def index_cells(x, y, bucket_size=None):
+    """Grid index of cells: 'order' and 'offsets' arrays and the grid meta data. bucket_size is the side of the buckets
+    (in CRS units); by default it gives about 64 cells per bucket."""
+    n = len(x)
+    x0, y0 = (float(np.min(x)), float(np.min(y))) if n > 0 else (0.0, 0.0)
+    width, height = (float(np.max(x)) - x0, float(np.max(y)) - y0) if n > 0 else (0.0, 0.0)
+    if bucket_size is None:
+        bucket_size = max(float(np.sqrt(width * height * 64 / max(n, 1))), 1e-9)
+    nx, ny = int(width // bucket_size) + 1, int(height // bucket_size) + 1
+
+    # Cells sorted by bucket (row by row of the grid), and start of every bucket in that order
+    bucket = (np.minimum(((y - y0) // bucket_size).astype(np.int64), ny - 1) * nx
+              + np.minimum(((x - x0) // bucket_size).astype(np.int64), nx - 1))
+    order = np.argsort(bucket, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(bucket, minlength=nx * ny))])
+    return order, offsets, {'x0': x0, 'y0': y0, 'nx': nx, 'ny': ny, 'bucket_size': bucket_size}
+
+def create_store(x, y, pop, crs=None, districts=(), dsds=(), bucket_size=None):
+    """In-memory store of cells, with the rural flags set to False and the district and DSD ids and GHSL classes to -1
+    (they can be set, e.g. with the store's own queries, before it's written with write_store)."""
+    n = len(x)
+    columns = {'x': x, 'y': y, 'pop': pop, 'rural': np.zeros(n, dtype=bool), 'district': np.full(n, -1),
+               'dsd': np.full(n, -1), 'ghsl_class': np.full(n, -1)}
+    columns = {name: np.asarray(columns[name], dtype=dtype) for name, dtype in column_types.items()}
+    order, offsets, grid = index_cells(columns['x'], columns['y'], bucket_size)
+    meta = dict(grid, cells=n, crs=str(crs) if crs is not None else None, districts=list(districts), dsds=list(dsds))
+    return PointStore(columns, order, offsets, meta)
+
+def write_store(store, directory):
+    """Write a store in a folder, one .npy file per column."""
+    os.makedirs(directory, exist_ok=True)
+    for name in column_types:
+        np.save(os.path.join(directory, name + '.npy'), store.columns[name])
+    np.save(os.path.join(directory, 'order.npy'), np.asarray(store.order, dtype=np.int64))
+    np.save(os.path.join(directory, 'offsets.npy'), np.asarray(store.offsets, dtype=np.int64))
+    with open(os.path.join(directory, meta_file), 'w') as f:
+        json.dump(store.meta, f, indent=2)
+
+def load_store(directory):
+    """Store of a folder, with its columns memory-mapped (read-only)."""
+    with open(os.path.join(directory, meta_file)) as f:
+        meta = json.load(f)
+    columns = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r') for name in column_types}
+    return PointStore(columns, np.load(os.path.join(directory, 'order.npy'), mmap_mode='r'),
+                      np.load(os.path.join(directory, 'offsets.npy'), mmap_mode='r'), meta)
+
+def store_files(directory):
+    """Files of a store."""
+    return [os.path.join(directory, name + '.npy') for name in list(column_types) + ['order', 'offsets']] + \
+           [os.path.join(directory, meta_file)]
+
+_stores = {}
+
+def open_store(directory):
+    """The store of a folder, opened once per process (and again if the store is rewritten)."""
+    meta_path = os.path.join(directory, meta_file)
+    signature = os.stat(meta_path).st_mtime_ns
+    cached = _stores.get(directory)
+    if cached is None or cached[0] != signature:
+        cached = _stores[directory] = (signature, load_store(directory))
+    return cached[1]
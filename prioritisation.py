@@ -0,0 +1,217 @@
+"""
+prioritisation.py
+
+Scenario engine of the tank prioritisation index. The per-tank attributes used by the index (siltation, soil erosion,
+agricultural dependent population, rainfall variability and aquifer type) are read once into arrays, and any number
+of variants of the index (scenarios) are then evaluated together, a batch of scenarios at a time, with NumPy.
+
+The index is the one of the tank-index stage:
+    supply_index = silt * soil (normalised by its maximum)
+    demand_index = adp * cov
+    SuppDem_index = demand_index * supply_index
+    GWR_Comb_index = SuppDem_index * geo_rank (for the top 'selection' fraction of the tanks by SuppDem_index)
+The index is a product, so the weight of each attribute is its exponent (weighted geometric combination): all weights
+equal to 1, 'max' normalisation, the 'rank' geo mapping and the selection parameter give the index of the stage.
+A scenario sets:
+- the weights of silt, soil, adp, cov and geo
+- the selection fraction
+- the normalisation of the attributes: 'max' (value / maximum), 'minmax' ((value - minimum) / (maximum - minimum))
+  or 'rank' (fraction of the tanks with a lower or equal value)
+- the geo mapping: the name of a mapping of the aquifer types to geo_rank values (see geo_mappings)
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+# Aquifer types of the rock structure layer, with their pump yield
+pump_yields = {"Shallow alluvial aquifer": 920,
+               "Deep confined aquifer": 585,
+               "Shallow karstic acquifer": 400,
+               "Shallow sandy aquifer": 225,
+               "Basement regolith aquifer": 150,
+               "Regolith or fractured aquifer": 75,
+               "Laterite (cabook) aquifer": 70}
+aquifer_types = list(pump_yields)
+
+# geo_rank value of each aquifer type
+geo_mappings = {'rank': dict(zip(aquifer_types, range(len(aquifer_types), 0, -1))), # 7 (highest yield) to 1
+                'pump_yield': dict(pump_yields),
+                'uniform': dict.fromkeys(aquifer_types, 1)}
+
+normalisations = ['max', 'minmax', 'rank']
+attributes = ['silt', 'soil', 'adp', 'cov'] # normalised tank attributes
+weights = attributes + ['geo']
+
+def load_tank_attributes(tanks_polygons_file, tanks_buffers_pop_file, cov_rainfall_file, rock_structure_file):
+    """Read the tank attributes used by the index. Returns a dictionary with one array per attribute, one value per row
+    of the tank-level table of the tank-index stage (tanks intersecting more DSDs have a row per DSD), the Map_id and
+    ADM3_PCODE of the rows, the code of their aquifer type (index in aquifer_types, -1 if unknown) and, for each
+    attribute, the sorted values of the table the stage normalises it on."""
+    tanks = gpd.read_file(tanks_polygons_file, columns=['Map_id', 'silt_p', 'max_soil_d'], ignore_geometry=True)
+    adp = gpd.read_file(tanks_buffers_pop_file, columns=['Map_id', 'pop_count', 'ADM3_PCODE'], ignore_geometry=True)
+    cov = gpd.read_file(cov_rainfall_file, columns=['Map_id', 'gridcode_m'], ignore_geometry=True)
+    rock = gpd.read_file(rock_structure_file, columns=['Map_id', 'AquName'], ignore_geometry=True)
+
+    # Same rows as the stage: tanks, joined with their buffers (and rainfall) on the Map_id
+    demand = adp.merge(cov, on='Map_id', how='left')
+    rows = tanks.merge(demand[['Map_id', 'pop_count', 'gridcode_m', 'ADM3_PCODE']], on='Map_id', how='left')
+    rows = rows.merge(rock.drop_duplicates('Map_id'), on='Map_id', how='left')
+
+    aquifer_codes = {name: code for code, name in enumerate(aquifer_types)}
+    sources = {'silt': tanks.silt_p, 'soil': tanks.max_soil_d, 'adp': adp.pop_count, 'cov': cov.gridcode_m}
+    return {'Map_id': rows.Map_id.to_numpy(),
+            'ADM3_PCODE': rows.ADM3_PCODE.to_numpy(),
+            'silt': rows.silt_p.to_numpy(float),
+            'soil': rows.max_soil_d.to_numpy(float),
+            'adp': rows.pop_count.to_numpy(float),
+            'cov': rows.gridcode_m.to_numpy(float),
+            'aquifer': rows.AquName.map(aquifer_codes).fillna(-1).to_numpy(np.int64),
+            'sources': {name: np.sort(values.dropna().to_numpy(float)) for name, values in sources.items()}}
+
+def normalise(values, source, method):
+    """Normalise values with the statistics of source (sorted values)."""
+    if method == 'max':
+        return values / source[-1]
+    if method == 'minmax':
+        return (values - source[0]) / (source[-1] - source[0])
+    if method == 'rank':
+        return np.where(np.isnan(values), np.nan, np.searchsorted(source, values, side='right') / len(source))
+    raise Exception('ERROR: unknown normalisation ' + method)
+
+def base_scenario(parameters):
+    """The scenario of the tank-index stage."""
+    scenario = dict.fromkeys(weights, 1.0)
+    scenario.update(selection=parameters["selection"], normalisation='max', geo_mapping='rank')
+    return scenario
+
+def scenario_grid(base, **options):
+    """All the combinations of the given options (lists of values of the scenario fields), as a DataFrame with a row per
+    scenario. Fields not given take the value of the base scenario, e.g. scenario_grid(base, adp=[0.5, 1, 2])."""
+    fields = dict(base, **options)
+    values = [v if isinstance(v, (list, tuple, np.ndarray)) else [v] for v in fields.values()]
+    return pd.DataFrame(list(itertools.product(*values)), columns=list(fields))
+
+def sample_scenarios(n, base, weight_range=(0.5, 1.5), selections=None, normalisation=None, geo_mapping=None, seed=1):
+    """n random scenarios around the base one: weights drawn uniformly from weight_range, and the selection fraction,
+    normalisation and geo mapping drawn from the given lists (the base values if not given)."""
+    rng = np.random.default_rng(seed)
+    scenarios = {w: rng.uniform(*weight_range, n) for w in weights}
+    scenarios['selection'] = rng.choice(selections or [base['selection']], n)
+    scenarios['normalisation'] = rng.choice(normalisation or [base['normalisation']], n)
+    scenarios['geo_mapping'] = rng.choice(geo_mapping or [base['geo_mapping']], n)
+    return pd.DataFrame(scenarios)
+
+def descending_ranks(index):
+    """Rank of every value of each row of index, from the highest (rank 1), with ties taking the highest rank of their
+    group (as pandas rank(method='max', ascending=False)). NaN values come last. Also returns the order of the values
+    (highest first, ties in their original order)."""
+    values = np.where(np.isnan(index), -np.inf, index)
+    order = np.argsort(-values, axis=1, kind='stable')
+    ordered = np.take_along_axis(values, order, axis=1)
+
+    # Rank of a value: position (+ 1) of the last value of its group of ties in the ordered row
+    n = index.shape[1]
+    group_end = np.ones(ordered.shape, dtype=bool)
+    group_end[:, :-1] = ordered[:, :-1] != ordered[:, 1:]
+    last = np.where(group_end, np.arange(n), n)
+    last = np.minimum.accumulate(last[:, ::-1], axis=1)[:, ::-1]
+
+    ranks = np.empty(index.shape, dtype=np.int64)
+    np.put_along_axis(ranks, order, last + 1, axis=1)
+    return ranks, order
+
+def evaluate(tank_attributes, scenarios):
+    """Evaluate a batch of scenarios (DataFrame, see scenario_grid). Returns a dictionary of arrays with a row per
+    scenario and a column per tank row: supply_index, demand_index, SuppDem_index, Rank, top (True for the tanks in the
+    selection) and GWR_Comb_index (NaN out of the selection)."""
+    n = len(tank_attributes['Map_id'])
+    for field, names in [('normalisation', normalisations), ('geo_mapping', list(geo_mappings))]:
+        unknown = set(scenarios[field]) - set(names)
+        if unknown:
+            raise Exception('ERROR: unknown ' + field + ' ' + ', '.join(sorted(map(str, unknown))))
+    norm_codes = scenarios['normalisation'].map({m: k for k, m in enumerate(normalisations)}).to_numpy(np.int64)
+
+    # Attributes normalised with the methods used by the scenarios (one row per method), raised to the weights
+    used = np.unique(norm_codes)
+    components = {}
+    for name in attributes:
+        normalised = np.full((len(normalisations), n), np.nan)
+        for code in used:
+            normalised[code] = normalise(tank_attributes[name], tank_attributes['sources'][name], normalisations[code])
+        components[name] = np.power(normalised[norm_codes], scenarios[name].to_numpy(float)[:, None])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        supply_score = components['silt'] * components['soil']
+        supply_index = supply_score / np.nanmax(supply_score, axis=1, keepdims=True)
+        demand_index = components['adp'] * components['cov']
+        index = demand_index * supply_index
+
+    ranks, order = descending_ranks(index)
+    selected = (scenarios['selection'].to_numpy(float) * n).astype(np.int64)
+    top = np.zeros(index.shape, dtype=bool)
+    np.put_along_axis(top, order, np.arange(n) < selected[:, None], axis=1)
+
+    # geo_rank of every tank in every scenario (NaN for unknown aquifer types)
+    mappings = np.array([[geo_mappings[m].get(a, np.nan) for a in aquifer_types] + [np.nan]
+                         for m in scenarios['geo_mapping']], dtype=float)
+    geo_rank = mappings[:, tank_attributes['aquifer']]
+    gwr_index = np.where(top, index * np.power(geo_rank, scenarios['geo'].to_numpy(float)[:, None]), np.nan)
+
+    return {'supply_index': supply_index, 'demand_index': demand_index, 'SuppDem_index': index, 'Rank': ranks,
+            'top': top, 'GWR_Comb_index': gwr_index}
+
+def _rank_correlation(ranks, base_ranks):
+    """Pearson correlation of the ranks of every scenario with the base ranks."""
+    centred = ranks - ranks.mean(axis=1, keepdims=True)
+    base_centred = base_ranks - base_ranks.mean()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (centred @ base_centred) / (np.sqrt((centred ** 2).sum(axis=1)) * np.sqrt((base_centred ** 2).sum()))
+
+def run_scenarios(tank_attributes, scenarios, base, batch_size=256):
+    """Evaluate the scenarios (at least one), batch_size scenarios at a time, and compare them with the base scenario.
+    Returns two DataFrames:
+    - one row per scenario: the scenario, the correlation of its ranks with the base ranks, the share of the base
+      selection still selected, the mean SuppDem_index and GWR_Comb_index of the selected tanks
+    - one row per tank: its base rank and the mean, standard deviation, minimum and maximum of its rank over the
+      scenarios, and the share of the scenarios selecting it"""
+    n = len(tank_attributes['Map_id'])
+    base_result = evaluate(tank_attributes, pd.DataFrame([base]))
+    base_ranks, base_top = base_result['Rank'][0], base_result['top'][0]
+
+    rank_sum, rank_squares = np.zeros(n), np.zeros(n)
+    rank_min, rank_max = np.full(n, n + 1, dtype=np.int64), np.zeros(n, dtype=np.int64)
+    top_count = np.zeros(n, dtype=np.int64)
+    summaries = []
+    for start in range(0, len(scenarios), batch_size):
+        batch = scenarios.iloc[start:start + batch_size]
+        result = evaluate(tank_attributes, batch)
+        ranks, top = result['Rank'], result['top']
+
+        rank_sum += ranks.sum(axis=0)
+        rank_squares += (ranks.astype(float) ** 2).sum(axis=0)
+        rank_min = np.minimum(rank_min, ranks.min(axis=0))
+        rank_max = np.maximum(rank_max, ranks.max(axis=0))
+        top_count += top.sum(axis=0)
+
+        with np.errstate(invalid='ignore'):
+            top_index = np.where(top, result['SuppDem_index'], np.nan)
+            summary = pd.DataFrame({'rank_correlation': _rank_correlation(ranks, base_ranks),
+                                    'top_overlap': (top & base_top).sum(axis=1) / max(base_top.sum(), 1),
+                                    'top_tanks': top.sum(axis=1),
+                                    'SuppDem_index': np.nanmean(top_index, axis=1),
+                                    'GWR_Comb_index': np.nanmean(result['GWR_Comb_index'], axis=1)},
+                                   index=batch.index)
+        summaries.append(summary)
+
+    scenario_results = pd.concat([scenarios, pd.concat(summaries)], axis=1)
+    count = len(scenarios)
+    mean_rank = rank_sum / count
+    tank_results = pd.DataFrame({'Map_id': tank_attributes['Map_id'], 'ADM3_PCODE': tank_attributes['ADM3_PCODE'],
+                                 'Rank': base_ranks, 'top': base_top,
+                                 'mean_rank': mean_rank,
+                                 'std_rank': np.sqrt(np.maximum(rank_squares / count - mean_rank ** 2, 0)),
+                                 'min_rank': rank_min, 'max_rank': rank_max,
+                                 'top_share': top_count / count})
+    return scenario_results, tank_results
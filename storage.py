@@ -0,0 +1,147 @@
+"""
+storage.py
+
+Storage of the vector layers written and read by the model. The format of a layer is given by the extension of its
+file name:
+- '.parquet': GeoParquet, columnar (Arrow) format used for the intermediate layers (see vector_ext in globals.py)
+- '.fgb': FlatGeobuf
+- '.shp' (and any other extension): read and written through OGR, as the shapefiles of the model outputs
+
+Other formats can be plugged in by adding a backend to the 'backends' dictionary.
+"""
+import json
+
+import pandas as pd
+import geopandas as gpd
+
+# Files that make up a single shapefile
+shp_extensions = ['.shp', '.shx', '.dbf', '.prj', '.cpg']
+
+class OGRBackend:
+    """Formats read and written by OGR (shapefile, FlatGeobuf, GeoPackage...)."""
+    def __init__(self, driver=None, append=True):
+        self.driver = driver
+        self.append = append  # the driver can append features to an existing file
+
+    def read(self, path, columns=None):
+        return gpd.read_file(path, columns=columns)
+
+    def read_chunks(self, path, chunk_size, columns=None):
+        start = 0
+        while True:
+            gdf = gpd.read_file(path, columns=columns, skip_features=start, max_features=chunk_size)
+            if len(gdf) == 0 and start > 0:
+                return
+            yield gdf
+            start += len(gdf)
+            if len(gdf) < chunk_size:
+                return
+
+    def write(self, gdf, path):
+        gdf.to_file(path, driver=self.driver)
+
+    def write_chunks(self, chunks, path):
+        if not self.append:
+            return _write_concatenated(self, chunks, path)
+        gdf, rows, mode = None, 0, 'w'
+        for gdf in chunks:
+            if len(gdf) > 0:  # an empty first chunk wouldn't have the geometry type of the layer
+                gdf.to_file(path, driver=self.driver, mode=mode)
+                rows += len(gdf)
+                mode = 'a'
+        if mode == 'w' and gdf is not None:  # all the chunks are empty
+            gdf.to_file(path, driver=self.driver)
+        return rows
+
+class GeoParquetBackend:
+    """GeoParquet files: columnar, no limit on the column names or the file size, and only the requested columns are
+    read. The index of the GeoDataFrames is not stored (as for shapefiles)."""
+    def read(self, path, columns=None):
+        if columns is not None and 'geometry' not in columns:
+            columns = list(columns) + ['geometry']
+        return gpd.read_parquet(path, columns=columns)
+
+    def read_chunks(self, path, chunk_size, columns=None):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if columns is not None and 'geometry' not in columns:
+            columns = list(columns) + ['geometry']
+        parquet_file = pq.ParquetFile(path)
+        schema = parquet_file.schema_arrow
+        if parquet_file.metadata.num_rows == 0:
+            yield gpd.read_parquet(path, columns=columns)
+            return
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            table = pa.Table.from_batches([batch]).replace_schema_metadata(schema.metadata)
+            yield gpd.GeoDataFrame.from_arrow(table, geometry='geometry')
+
+    def write(self, gdf, path):
+        gdf.to_parquet(path, index=False)
+
+    def write_chunks(self, chunks, path):
+        import io
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        writer, gdf, rows = None, None, 0
+        try:
+            for gdf in chunks:
+                if len(gdf) == 0:
+                    continue
+                table = pa.table(gdf.to_arrow(index=False))
+                if writer is None:
+                    # GeoParquet metadata of the layer: the one geopandas writes for the first chunk, without its
+                    # bounding box (the one of the chunk, not of the layer: it's optional)
+                    buffer = io.BytesIO()
+                    gdf.iloc[:0].to_parquet(buffer, index=False)
+                    schema = pq.read_schema(pa.BufferReader(buffer.getvalue()))
+                    geo_metadata = json.loads(schema.metadata[b'geo'])
+                    for column_metadata in geo_metadata['columns'].values():
+                        column_metadata.pop('bbox', None)
+                    schema = schema.with_metadata({**schema.metadata, b'geo': json.dumps(geo_metadata).encode()})
+                    writer = pq.ParquetWriter(path, schema)
+                writer.write_table(table.cast(writer.schema))
+                rows += len(gdf)
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is None and gdf is not None:  # all the chunks are empty
+            self.write(gdf, path)
+        return rows
+
+def _write_concatenated(backend, chunks, path):
+    """Write the chunks as a single layer, for formats that can't be appended to."""
+    chunks = list(chunks)
+    if not chunks:
+        return 0
+    gdf = gpd.GeoDataFrame(pd.concat(chunks, ignore_index=True), crs=chunks[0].crs)
+    backend.write(gdf, path)
+    return len(gdf)
+
+backends = {'.parquet': GeoParquetBackend(),
+            '.fgb': OGRBackend('FlatGeobuf', append=False)}
+default_backend = OGRBackend()
+
+def backend(path):
+    """Storage backend of a file, from its extension."""
+    for ext, b in backends.items():
+        if path.lower().endswith(ext):
+            return b
+    return default_backend
+
+def read_vector(path, columns=None):
+    """Read a vector layer (only the given columns, plus the geometry, if columns is not None)."""
+    return backend(path).read(path, columns)
+
+def read_vector_chunks(path, chunk_size, columns=None):
+    """Generator of the features of a vector layer as GeoDataFrames of up to chunk_size rows, in the order of the file
+    (only the given columns, plus the geometry, if columns is not None). An empty layer gives one empty chunk."""
+    return backend(path).read_chunks(path, chunk_size, columns)
+
+def write_vector(gdf, path):
+    """Write a GeoDataFrame to a vector file, replacing it if it exists."""
+    backend(path).write(gdf, path)
+
+def write_vector_chunks(chunks, path):
+    """Write an iterable of GeoDataFrames (with the same columns) to a single vector file, one chunk at a time where
+    the format allows it. Empty chunks are skipped. Returns the number of features written."""
+    return backend(path).write_chunks(chunks, path)
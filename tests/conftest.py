@@ -0,0 +1,25 @@
+import pytest
+
+from benchmarks.synthetic import generate_inputs
+from tests.model_runs import model_folder, run_model, scale
+
+@pytest.fixture(scope='session')
+def synthetic_inputs(tmp_path_factory):
+    """Folder of the synthetic inputs (generated once for all the tests)."""
+    directory = str(tmp_path_factory.mktemp('synthetic'))
+    generate_inputs(directory, scale)
+    return directory
+
+@pytest.fixture(scope='session')
+def raster_run(synthetic_inputs, tmp_path_factory):
+    """Model folder of a run with the default parameters (pop_engine='raster')."""
+    directory = model_folder(synthetic_inputs, tmp_path_factory.mktemp('raster'))
+    run_model(directory)
+    return directory
+
+@pytest.fixture(scope='session')
+def points_run(synthetic_inputs, tmp_path_factory):
+    """Model folder of a run with the population cells store (pop_engine='points')."""
+    directory = model_folder(synthetic_inputs, tmp_path_factory.mktemp('points'))
+    run_model(directory, pop_engine='points')
+    return directory
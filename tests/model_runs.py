@@ -0,0 +1,46 @@
+"""
+model_runs.py
+
+Model runs of the tests on small synthetic inputs (see benchmarks/synthetic.py). Every model run is a
+'python -m pipeline' process in a folder of its own holding a copy of the inputs.
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import pandas as pd
+import geopandas as gpd
+
+from config import inputs, outputs
+
+repository_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+scale = 0.005 # fraction of the area of Sri Lanka of the synthetic inputs
+
+# Outputs of the tank attribution stages
+tank_outputs = ['tanks_buffers_pop', 'two_part_index_tank_level_csv', 'tanks_two_part_dsd_level_csv']
+
+def model_folder(synthetic_inputs, directory):
+    """New model folder with a copy of the synthetic inputs."""
+    input_dir = os.path.dirname(inputs["SL_Districts"])
+    shutil.copytree(os.path.join(synthetic_inputs, input_dir), os.path.join(directory, input_dir))
+    return str(directory)
+
+def run_model(directory, *args, **settings):
+    """Run the model in a folder (with the command line arguments args), with the parameters of config.py changed by
+    settings. Returns the output of the run."""
+    args = [sys.executable, '-m', 'pipeline'] + list(args) + ['--set=%s=%s' % (name, json.dumps(value))
+                                                              for name, value in settings.items()]
+    env = dict(os.environ, PYTHONPATH=repository_dir)
+    result = subprocess.run(args, cwd=directory, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout[-3000:] + result.stderr[-3000:]
+    return result.stdout
+
+def read_output(directory, name):
+    path = os.path.join(directory, outputs[name])
+    return pd.read_csv(path) if path.endswith('.csv') else gpd.read_file(path)
+
+def assert_same_outputs(directory_a, directory_b, names):
+    for name in names:
+        pd.testing.assert_frame_equal(read_output(directory_a, name), read_output(directory_b, name))
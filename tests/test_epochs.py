@@ -0,0 +1,33 @@
+"""
+test_epochs.py
+
+Checks of the batch runs of the model over input epochs (pipeline/epochs.py).
+"""
+import json
+import os
+import shutil
+
+from config import inputs
+from globals import *
+from tests.model_runs import model_folder, run_model
+
+def epoch_stages_run(directory, name):
+    """Names of the stages run by the last run of an epoch."""
+    with open(os.path.join(directory, epochs_dir, name, run_report)) as f:
+        return {stage['stage'] for stage in json.load(f)['stages']}
+
+def test_invariant_change_reruns_epochs(synthetic_inputs, tmp_path):
+    directory = model_folder(synthetic_inputs, tmp_path / 'epochs')
+    epoch_raster = os.path.join(os.path.dirname(inputs["WorldPop_1km_raster"]), 'pop_2015.tif')
+    shutil.copy(os.path.join(directory, inputs["WorldPop_1km_raster"]), os.path.join(directory, epoch_raster))
+    epochs = {'2015': {'WorldPop_1km_raster': epoch_raster}}
+
+    run_model(directory, '--epochs', epochs=epochs)
+    assert 'agland-pop' in epoch_stages_run(directory, '2015')
+    output = run_model(directory, '--epochs', epochs=epochs)
+    assert 'Running stage' not in output
+
+    # A change of an invariant stage (the agricultural lands) runs the epoch stages reading its outputs again
+    output = run_model(directory, '--epochs', epochs=epochs, Home_Gardens=True)
+    assert 'Running stage ag-lands-districts' in output
+    assert {'agland-pop', 'buffers'} <= epoch_stages_run(directory, '2015')
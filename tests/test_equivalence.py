@@ -0,0 +1,155 @@
+"""
+test_equivalence.py
+
+Checks that the incremental and optimised paths of the model give the same outputs as the plain ones, on small
+synthetic inputs (see model_runs.py). Run from the repository folder:
+
+    python -m pytest tests
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pytest
+import shapely
+
+from config import inputs, outputs, parameters
+from globals import *
+import storage
+import geocomputation as gcpt
+import pointstore
+from pipeline.stages import deg_per_metre, district_file, district_field
+from tests.model_runs import model_folder, run_model, read_output, assert_same_outputs, tank_outputs
+
+def edit_tanks(directory):
+    """Move a tank, change the attributes of another one and remove a third one."""
+    path = os.path.join(directory, inputs["tanks_polygons"])
+    tanks = gpd.read_file(path)
+    tanks.loc[0, 'geometry'] = shapely.affinity.translate(tanks.loc[0, 'geometry'], 0.002, 0.001)
+    tanks.loc[1, 'silt_p'] = 4.0 - tanks.loc[1, 'silt_p']
+    tanks.drop(index=2).to_file(path)
+
+def test_incremental_tank_edit(synthetic_inputs, tmp_path):
+    incremental = model_folder(synthetic_inputs, tmp_path / 'incremental')
+    full = model_folder(synthetic_inputs, tmp_path / 'full')
+    run_model(incremental)
+
+    edit_tanks(incremental)
+    edit_tanks(full)
+    run_model(incremental)
+    run_model(full, tanks_incremental=False)
+    assert_same_outputs(incremental, full, tank_outputs)
+
+def test_incremental_radius_change(synthetic_inputs, tmp_path):
+    incremental = model_folder(synthetic_inputs, tmp_path / 'incremental')
+    full = model_folder(synthetic_inputs, tmp_path / 'full')
+    run_model(incremental)
+    pop_1000 = read_output(incremental, 'tanks_buffers_pop')['pop_count'].sum()
+
+    run_model(incremental, tank_buffer=800)
+    run_model(full, tank_buffer=800, tanks_incremental=False)
+    assert_same_outputs(incremental, full, tank_outputs)
+    assert read_output(incremental, 'tanks_buffers_pop')['pop_count'].sum() < pop_1000
+
+def test_pop_engines(raster_run, points_run):
+    # Zonal sums on the population raster and queries of the population cells give the same counts
+    for path in [pop_count_comparison_csv, agland_buffers_radii_csv]:
+        pd.testing.assert_frame_equal(pd.read_csv(os.path.join(raster_run, path)),
+                                      pd.read_csv(os.path.join(points_run, path)))
+    assert_same_outputs(raster_run, points_run, ['ag_dep_pop_shp'] + tank_outputs)
+
+def linear_search_radius(directory, district, rural_points):
+    """Buffer radius of a district found by growing the buffer of its agricultural lands r_increment at a time and
+    counting the rural points within it (clipped to the district), as the model did before solving the radii from
+    signed distances."""
+    threshold, r_increment = parameters["threshold"], parameters["r_increment"]
+    direction = 1 if district['use_aglands?'] == 'too small' else -1
+    aglands = storage.read_vector(os.path.join(directory, district_file(ag_lands_only_path, district.name,
+                                                                        '_ag_lands_only')))
+    boundary = storage.read_vector(os.path.join(directory, district_file(ind_dist_boundaries_filepath, district.name)))
+    points = rural_points.geometry.values
+
+    buffer_radius = 100
+    while True:
+        buffer = aglands.geometry.buffer(direction * buffer_radius * deg_per_metre).union_all()
+        clipped_buffer = shapely.intersection(buffer, boundary.geometry.union_all())
+        buffer_pop_count = rural_points['pop_count'].values[shapely.intersects(clipped_buffer, points)].sum()
+        difference = buffer_pop_count / district['dist_pop'] - district['hies_ag_dep_pop_%']
+        if direction * difference > -threshold or abs(buffer_pop_count - district['dist_rur_pop']) < threshold:
+            return direction * buffer_radius
+        buffer_radius += r_increment
+
+@pytest.mark.filterwarnings('ignore:Geometry is in a geographic CRS')
+def test_buffer_radii(points_run):
+    pop_df = pd.read_csv(os.path.join(points_run, pop_count_comparison_csv)).set_index('dist_names')
+    radii = pd.read_csv(os.path.join(points_run, agland_buffers_radii_csv)).set_index('district_name')['buffer_radius']
+    rural_points = storage.read_vector(os.path.join(points_run, rur_points_shp))
+
+    buffered = pop_df[pop_df['use_aglands?'] != 'OK']
+    assert len(buffered) > 0
+    for name, district in buffered.iterrows():
+        assert radii[name] == linear_search_radius(points_run, district, rural_points), name
+
+def test_pixel_rural_classification(synthetic_inputs, points_run, tmp_path):
+    pixels = model_folder(synthetic_inputs, tmp_path / 'pixels')
+    run_model(pixels, pop_engine='points', rural_classification='pixels')
+
+    # Same rural points and ag-dependent points (LU_class holds the GHSL class in pixel mode) and same tank outputs
+    columns = ['geometry', 'pop_count']
+    pd.testing.assert_frame_equal(storage.read_vector(os.path.join(points_run, rur_points_shp))[columns],
+                                  storage.read_vector(os.path.join(pixels, rur_points_shp))[columns])
+    pd.testing.assert_frame_equal(read_output(points_run, 'ag_dep_pop_shp')[columns],
+                                  read_output(pixels, 'ag_dep_pop_shp')[columns])
+    assert_same_outputs(points_run, pixels, tank_outputs)
+
+def test_pop_groups(raster_run, points_run, monkeypatch):
+    # The district totals of the grouped sums of the population are the zonal sums of the districts
+    monkeypatch.chdir(raster_run)
+    districts = storage.read_vector(inputs["SL_Districts"])
+    rasters = {'pop': Resampled_pop_raster, 'rur_pop': Rural_pop_raster}
+    for chunk_rows in [None, 7]:
+        groups = gcpt.grouped_sums(Pop_labels_raster, rasters, chunk_rows)
+        for name, path in rasters.items():
+            district_sums = groups.groupby('district')[name].sum().reindex(range(len(districts)), fill_value=0)
+            np.testing.assert_allclose(district_sums, gcpt.zonal_sum(path, districts), rtol=1e-9)
+
+    # Same totals with the population cells store
+    for directory in [raster_run, points_run]:
+        district_pops = pd.read_csv(os.path.join(directory, pop_groups_csv)).groupby('district')[['pop', 'rur_pop']].sum()
+        district_pops = district_pops.reindex(districts[district_field], fill_value=0)
+        np.testing.assert_allclose(district_pops['pop'], gcpt.zonal_sum(Resampled_pop_raster, districts), rtol=1e-9)
+        np.testing.assert_allclose(district_pops['rur_pop'], gcpt.zonal_sum(Rural_pop_raster, districts), rtol=1e-9)
+
+def test_radius_sweep(points_run):
+    # For a tank within a single DSD, the sweep at the tank buffer radius is the pop_count of the tank plus the cells
+    # between the polygon of its buffer and the exact radius
+    radius = parameters["tank_buffer"] * deg_per_metre
+    store = pointstore.open_store(os.path.join(points_run, pop_store))
+    buffers = storage.read_vector(os.path.join(points_run, tanks_buffers)).set_index('Map_id')
+    tanks = storage.read_vector(os.path.join(points_run, inputs["tanks_polygons"])).set_index('Map_id')
+    tanks_pop = read_output(points_run, 'tanks_buffers_pop')
+    single = tanks_pop[~tanks_pop['Map_id'].duplicated(keep=False)].set_index('Map_id')
+    sweep = pd.read_csv(os.path.join(points_run, outputs["tanks_radius_sweep_csv"])).set_index('Map_id')
+    column = 'pop_%dm' % parameters["tank_buffer"]
+
+    assert len(single) > 0
+    for map_id, tank in single.iterrows():
+        xmin, ymin, xmax, ymax = tanks.geometry[map_id].bounds
+        index = store.query_bbox(xmin - radius, ymin - radius, xmax + radius, ymax + radius)
+        index = index[store['rural'][index]]
+        x, y = store['x'][index], store['y'][index]
+        edge = (shapely.distance(tanks.geometry[map_id], shapely.points(x, y)) <= radius) & \
+               ~shapely.intersects_xy(buffers.geometry[map_id], x, y)
+        assert sweep.loc[map_id, column] == pytest.approx(tank['pop_count'] + store['pop'][index[edge]].astype(np.float64).sum(), rel=1e-9)
+
+@pytest.mark.parametrize('tank_allocation', ['buffers', 'nearest'])
+def test_partitioned_points(synthetic_inputs, tmp_path, tank_allocation):
+    in_memory = model_folder(synthetic_inputs, tmp_path / 'in-memory')
+    partitioned = model_folder(synthetic_inputs, tmp_path / 'partitioned')
+    run_model(in_memory, tank_allocation=tank_allocation)
+    run_model(partitioned, tank_allocation=tank_allocation, point_tile_size=0.05, point_chunk_size=1000)
+
+    pd.testing.assert_frame_equal(storage.read_vector(os.path.join(in_memory, rur_points_shp)),
+                                  storage.read_vector(os.path.join(partitioned, rur_points_shp)))
+    assert_same_outputs(in_memory, partitioned, ['ag_dep_pop_shp'] + tank_outputs)
@@ -0,0 +1,40 @@
+"""
+test_geocomputation.py
+
+Checks of the geocomputation functions (geocomputation.py) against the plain computations they replace.
+"""
+import os
+
+import numpy as np
+import pytest
+import rasterio
+import shapely
+
+from config import inputs, parameters
+import geocomputation as gcpt
+
+def test_resample_preserves_sum(synthetic_inputs, tmp_path):
+    # WorldPop 1km to 100m pixels: about 9.28 output pixels per source pixel along each axis
+    source = os.path.join(synthetic_inputs, inputs["WorldPop_1km_raster"])
+    resampled = str(tmp_path / 'resampled.tif')
+    gcpt.resample_raster(source, resampled, parameters["x_resolution"], parameters["y_resolution"],
+                         preserve_sum=True, block_rows=100)
+
+    totals = []
+    for path in [source, resampled]:
+        with rasterio.open(path) as src:
+            data = src.read(1).astype(np.float64)
+            totals.append(data[data != src.nodata].sum())
+    assert totals[1] == pytest.approx(totals[0], rel=1e-6)
+
+def test_clip_union():
+    # Overlapping polygons within, across and outside the clip polygon, and a polygon only touching it
+    rng = np.random.default_rng(1)
+    polygons = shapely.buffer(shapely.points(rng.uniform(-1, 3, 200), rng.uniform(-1, 3, 200)), rng.uniform(0.05, 0.3, 200))
+    polygons = np.append(polygons, shapely.box(2, 0, 2.5, 1))
+    clip_geom = shapely.Polygon([(0, 0), (2, 0), (2, 2), (1, 2.5), (0, 2)])
+
+    clipped = gcpt.clip_union(polygons, clip_geom)
+    expected = shapely.intersection(shapely.union_all(polygons), clip_geom)
+    assert shapely.get_type_id(clipped) in [3, 6]
+    assert shapely.symmetric_difference(clipped, expected).area < 1e-9 * expected.area
@@ -0,0 +1,105 @@
+"""
+test_graph.py
+
+Checks of the stage graph (pipeline/graph.py): which stages are run again, and what the code version of a stage covers.
+"""
+import importlib
+import linecache
+import sys
+
+from pipeline import graph
+from pipeline.graph import Stage, run_stages
+
+runs = [] # names of the stages run, in order
+
+def copy_stage(parameters):
+    runs.append('copy')
+    with open('input.txt') as f:
+        text = f.read()
+    with open('out/copy.txt', 'w') as f:
+        f.write(text * parameters['repeat'])
+
+def count_stage(parameters):
+    runs.append('count')
+    with open('out/copy.txt') as f:
+        text = f.read()
+    with open('out/count.txt', 'w') as f:
+        f.write(str(len(text)))
+
+def run_graph(parameters):
+    runs.clear()
+    stages = [Stage('copy', copy_stage, ['input.txt'], ['out/copy.txt'], ['repeat']),
+              Stage('count', count_stage, ['out/copy.txt'], ['out/count.txt'])]
+    run_stages(stages, parameters)
+    return list(runs)
+
+def test_out_of_date_stages(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'input.txt').write_text('abc')
+
+    assert run_graph({'repeat': 1}) == ['copy', 'count']
+    assert run_graph({'repeat': 1}) == []
+
+    # A parameter or an input changed: the stage and the stages depending on it
+    assert run_graph({'repeat': 2}) == ['copy', 'count']
+    (tmp_path / 'input.txt').write_text('abcd')
+    assert run_graph({'repeat': 2}) == ['copy', 'count']
+
+    # A missing output: only its stage
+    (tmp_path / 'out' / 'count.txt').unlink()
+    assert run_graph({'repeat': 2}) == ['count']
+
+    # A file rewritten with the same content
+    (tmp_path / 'input.txt').write_text('abcd')
+    assert run_graph({'repeat': 2}) == []
+
+    assert (tmp_path / 'out' / 'count.txt').read_text() == '8'
+
+helper_source = '''
+class Store:
+    def total(self):
+        return %d
+
+class Backend:
+    def read(self):
+        return %d
+
+backends = {'.x': Backend()}
+
+def open_store():
+    return Store()
+
+def read():
+    return backends['.x'].read()
+'''
+
+stage_source = '''
+import helper
+
+def stage(parameters):
+    return helper.open_store().total() + helper.read()
+'''
+
+def test_code_hash_covers_classes(tmp_path, monkeypatch):
+    # Project modules in a folder of their own
+    monkeypatch.setattr(graph, 'project_dir', str(tmp_path))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / 'helper.py').write_text(helper_source % (1, 1))
+    (tmp_path / 'stage_module.py').write_text(stage_source)
+    try:
+        import helper
+        import stage_module
+
+        def edited_hash(store_total, backend_read):
+            (tmp_path / 'helper.py').write_text(helper_source % (store_total, backend_read))
+            linecache.checkcache()
+            importlib.reload(helper)
+            return graph.code_hash(stage_module.stage)
+
+        # The methods of the classes the stage uses: directly or through instances (in a dictionary)
+        hashes = [graph.code_hash(stage_module.stage), edited_hash(10, 1), edited_hash(10, 10)]
+        assert len(set(hashes)) == 3
+        assert edited_hash(1, 1) == hashes[0]
+    finally:
+        sys.modules.pop('helper', None)
+        sys.modules.pop('stage_module', None)
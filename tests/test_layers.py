@@ -0,0 +1,72 @@
+"""
+test_layers.py
+
+Checks of the layer registry (pipeline/layers.py): layers are served from memory until their file is rewritten, and
+the least recently used ones are evicted beyond the memory budget.
+"""
+import numpy as np
+import geopandas as gpd
+import pytest
+import shapely
+
+import storage
+from pipeline import layers
+
+def write_points(path, n, value=0.0):
+    gdf = gpd.GeoDataFrame({'value': np.full(n, value)}, geometry=shapely.points(np.arange(n), np.arange(n)),
+                           crs='EPSG:4326')
+    storage.write_vector(gdf, path)
+    return layers.layer_size(gdf)
+
+@pytest.fixture
+def registry():
+    layers.clear()
+    budget = layers.memory_budget
+    yield layers
+    layers.clear()
+    layers.memory_budget = budget
+
+def counts():
+    info = layers.cache_info()
+    return info['hits'], info['misses'], info['evictions']
+
+def test_reread_changed_file(registry, tmp_path):
+    path = str(tmp_path / 'points.parquet')
+    write_points(path, 10)
+    registry.set_memory_budget(64)
+
+    start = counts()
+    first = registry.read_layer(path)
+    assert registry.read_layer(path) is first
+    assert np.subtract(counts(), start).tolist() == [1, 1, 0]
+
+    # A copy can be modified without changing the layer held
+    copy = registry.read_layer(path, copy=True)
+    copy['value'] = 1.0
+    assert (registry.read_layer(path)['value'] == 0.0).all()
+
+    # The file is rewritten: the layer is read again
+    write_points(path, 12, value=2.0)
+    layer = registry.read_layer(path)
+    assert len(layer) == 12 and (layer['value'] == 2.0).all()
+
+def test_eviction(registry, tmp_path):
+    paths = [str(tmp_path / ('points_%d.parquet' % k)) for k in range(3)]
+    size = max(write_points(path, 1000) for path in paths)
+    registry.set_memory_budget(2.5 * size / 2**20)  # room for two layers
+
+    start = counts()
+    for path in paths[:2]:
+        registry.read_layer(path)
+    registry.read_layer(paths[0])  # paths[1] is now the least recently used layer
+    registry.read_layer(paths[2])
+    assert np.subtract(counts(), start).tolist() == [1, 3, 1]
+    assert registry.cache_info()['layers'] == 2
+
+    registry.read_layer(paths[0])  # still held
+    registry.read_layer(paths[1])  # evicted: read again
+    assert np.subtract(counts(), start).tolist() == [2, 4, 2]
+
+    # No budget: nothing is held
+    registry.set_memory_budget(0)
+    assert registry.cache_info()['layers'] == 0
@@ -0,0 +1,30 @@
+"""
+test_pointstore.py
+
+Checks of the store of the population cells (pointstore.py).
+"""
+import numpy as np
+import shapely
+
+import pointstore
+
+def test_polygons_sum():
+    rng = np.random.default_rng(1)
+    n = 20000
+    store = pointstore.create_store(rng.uniform(0, 10, n), rng.uniform(0, 10, n), rng.uniform(0, 5, n))
+    store.columns['rural'][:] = rng.random(n) < 0.6
+    polygons = shapely.buffer(shapely.points(rng.uniform(-1, 11, 300), rng.uniform(-1, 11, 300)),
+                              rng.uniform(0.01, 2, 300))
+    polygons[0] = None
+
+    # Same sums as the cells of every polygon queried one at a time, whatever the number of pairs tested at once
+    for where in [None, 'rural']:
+        expected = np.zeros(len(polygons))
+        for k, geom in enumerate(polygons):
+            index = store.query_polygon(geom)
+            if where is not None:
+                index = index[store[where][index]]
+            expected[k] = store['pop'][index].astype(np.float64).sum()
+        for chunk_size in [1000, 1 << 22]:
+            np.testing.assert_allclose(store.polygons_sum(polygons, where=where, chunk_size=chunk_size), expected,
+                                       rtol=1e-12)
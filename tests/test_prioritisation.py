@@ -0,0 +1,31 @@
+"""
+test_prioritisation.py
+
+Checks of the scenario engine of the prioritisation index (prioritisation.py).
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from config import outputs
+import prioritisation
+from tests.model_runs import run_model
+
+def test_normalise_keeps_missing_values():
+    values = np.array([1.0, np.nan, 3.0, 2.5])
+    source = np.array([1.0, 2.0, 3.0])
+    for method in prioritisation.normalisations:
+        assert np.isnan(prioritisation.normalise(values, source, method)).tolist() == [False, True, False, False]
+    np.testing.assert_allclose(prioritisation.normalise(values, source, 'rank'), [1 / 3, np.nan, 1, 2 / 3])
+
+def test_base_scenario(raster_run):
+    # The base scenario gives the ranks and the selection of the tank-index stage
+    run_model(raster_run, index_scenarios=8)
+    stage_tanks = pd.read_csv(os.path.join(raster_run, outputs["two_part_index_tank_level_csv"]))
+    top_tanks = pd.read_csv(os.path.join(raster_run, outputs["three_part_index_tank_level_csv"]))
+    tanks = pd.read_csv(os.path.join(raster_run, outputs["index_rank_stability_csv"]))
+
+    assert tanks['Map_id'].tolist() == stage_tanks['Map_id'].tolist()
+    assert tanks['Rank'].tolist() == stage_tanks['Rank'].tolist()
+    assert sorted(tanks.loc[tanks['top'], 'Map_id']) == sorted(top_tanks['Map_id'])
@@ -0,0 +1,40 @@
+"""
+test_storage.py
+
+Checks of the storage backends (storage.py): layers written or read a chunk at a time are the same as the whole layer.
+"""
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pytest
+import shapely
+
+import storage
+
+@pytest.fixture
+def points():
+    n = 10
+    return gpd.GeoDataFrame({'value': np.arange(n, dtype=np.float64), 'name': ['point %d' % k for k in range(n)]},
+                            geometry=shapely.points(np.arange(n), np.arange(n)), crs='EPSG:4326')
+
+@pytest.mark.parametrize('ext', ['.parquet', '.fgb', '.shp'])
+def test_write_chunks(points, tmp_path, ext):
+    path = str(tmp_path / ('points' + ext))
+    rows = storage.write_vector_chunks((points.iloc[k:k + 3] for k in range(0, len(points), 3)), path)
+
+    assert rows == len(points)
+    written = storage.read_vector(path)
+    assert written.crs == points.crs
+    # (FlatGeobuf files hold the features in the order of their spatial index)
+    assert written.sort_values('value', ignore_index=True).equals(points)
+
+@pytest.mark.parametrize('ext', ['.parquet', '.shp'])
+def test_read_chunks(points, tmp_path, ext):
+    path = str(tmp_path / ('points' + ext))
+    storage.write_vector(points, path)
+
+    chunks = list(storage.read_vector_chunks(path, 4))
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    assert all(chunk.crs == points.crs for chunk in chunks)
+    assert gpd.GeoDataFrame(pd.concat(chunks, ignore_index=True)).equals(points)
+    assert list(next(storage.read_vector_chunks(path, 4, ['value'])).columns) == ['value', 'geometry']